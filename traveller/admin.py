@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from traveller.models import SolveJob
+
+
+@admin.register(SolveJob)
+class SolveJobAdmin(admin.ModelAdmin):
+    list_display = ["id", "status", "progress", "best_objective", "created_at"]
+    list_filter = ["status"]
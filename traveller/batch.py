@@ -0,0 +1,132 @@
+"""Solving many independent route problems in one request.
+
+The distance matrices of all the coordinate problems are computed up front in
+one vectorized pass, then the problems are fanned out to the solver executor,
+never more at once than it has workers so that interactive requests still
+find queue room. Outcomes are yielded as the solves finish.
+"""
+
+import json
+import logging
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from traveller import metrics
+from traveller.executor import SolverBusy
+from traveller.payloads import decode_request
+from traveller.utils import (
+    batch_haversine_matrices,
+    derives_time_matrix,
+    sparse_neighbors,
+)
+
+STATUSES = ("solved", "no_solution", "failed")
+
+
+def dense_distance_problem(data):
+    """Whether ``data`` is solved on a dense distance matrix of its stops."""
+    if derives_time_matrix(data):
+        return True
+    if not (data.get("list_cord") and data.get("num_vehicles")):
+        return False
+    if data.get("time_matrix") is not None and data.get("time_windows"):
+        return False
+    threshold = settings.ROUTE_MMAP_THRESHOLD
+    if threshold is not None and len(data["list_cord"]) >= threshold:
+        return False
+    return not sparse_neighbors(
+        data, settings.ROUTE_SPARSE_THRESHOLD, settings.ROUTE_SPARSE_NEIGHBORS
+    )
+
+
+def failure(message):
+    return {"status": "failed", "message": str(message)}
+
+
+def outcome(future):
+    """Returns the batch item of a finished solve and records its metrics."""
+    try:
+        response = future.result()
+    except ValueError as e:
+        return failure(e)
+    except Exception as e:
+        logging.info(
+            {"message": "error occur while finding best route is {}".format(e)}
+        )
+        return failure(e)
+    metrics.record(response["metrics"])
+    solved = response["metrics"]["objective"] is not None
+    return {"status": "solved" if solved else "no_solution", "result": response}
+
+
+def finished(pending):
+    """Waits for at least one of the ``pending`` futures, a dict of future to
+    problem index, and yields the index and item of every finished one.
+    """
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        yield pending.pop(future), outcome(future)
+
+
+def solve_batch(problems, submit, window):
+    """Yields ``(index, item)`` for every problem, in the order they finish.
+
+    ``submit`` takes a payload and its distance matrix, or ``None``, and
+    returns the future of its response as SolverExecutor.submit does. Items
+    are {"status": "solved" | "no_solution", "result": ...} or
+    {"status": "failed", "message": ...}.
+    """
+    payloads = {}
+    for index, problem in enumerate(problems):
+        try:
+            if not isinstance(problem, dict):
+                raise ValueError("Problem must be an object")
+            payloads[index] = decode_request(problem)
+        except ValueError as e:
+            yield index, failure(e)
+
+    dense = [index for index, data in payloads.items() if dense_distance_problem(data)]
+    matrices = dict(
+        zip(dense, batch_haversine_matrices([payloads[i]["list_cord"] for i in dense]))
+    )
+
+    pending = {}
+    for index, data in payloads.items():
+        while True:
+            if len(pending) < window:
+                try:
+                    future = submit(data, matrices.get(index))
+                except SolverBusy as e:
+                    # Other requests hold the queue, wait for a free slot.
+                    if not pending:
+                        time.sleep(e.retry_after)
+                        continue
+                except ValueError as e:
+                    yield index, failure(e)
+                    break
+                else:
+                    if future is None:
+                        yield index, failure("No Solution Found")
+                    else:
+                        pending[future] = index
+                    break
+            yield from finished(pending)
+        matrices.pop(index, None)
+    while pending:
+        yield from finished(pending)
+
+
+def ndjson_lines(results):
+    """Renders ``solve_batch`` results as newline delimited JSON, one line per
+    problem and a final {"summary": {status: count}} line.
+    """
+    counts = Counter()
+    for index, item in results:
+        counts[item["status"]] += 1
+        yield json.dumps(dict({"index": index}, **item), cls=JSONEncoder) + "\n"
+    summary = {status: counts[status] for status in STATUSES}
+    yield json.dumps({"summary": summary}) + "\n"
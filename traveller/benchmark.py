@@ -0,0 +1,148 @@
+"""Reproducible routing benchmarks.
+
+Instances are generated from a seed, so every run of the same kind, size and
+seed solves the same problem. Each run records the seconds spent building the
+matrix, building the model, solving and formatting the response, together
+with the objective, and compare() checks a run against a saved baseline.
+Instances are solved by every tier: the OR-tools search and the fast NumPy
+heuristic, whose runs are named with a "-fast" suffix.
+"""
+
+import math
+import time
+
+import numpy as np
+from django.conf import settings
+
+from traveller.utils import (
+    haversine_matrix,
+    route_finder_from_request,
+    sparse_neighbors,
+)
+
+KINDS = ("tsp", "vrp", "vrptw")
+DEFAULT_SIZES = (50, 200, 1000, 5000, 20000)
+# Time matrices are dense, larger time window instances do not fit in memory.
+VRPTW_MAX_STOPS = 1000
+PHASES = ("matrix", "model", "solve", "response")
+
+# Generated stops lie in this [longitude, latitude] box, the depot first.
+AREA = ([75.7, 22.6], [76.0, 22.9])
+# Vehicles of the generated vehicle routing instances.
+STOPS_PER_VEHICLE = 100
+MAX_VEHICLES = 50
+VEHICLE_MAXIMUM_TRAVEL_DISTANCE = 500000
+# Time windows: 30 km/h, a working day in minutes, hour long windows.
+METERS_PER_MINUTE = 500
+HORIZON = 480
+WINDOW = 60
+STOPS_PER_TIME_WINDOW_VEHICLE = 5
+
+
+def instance_name(kind, stops, seed, tier="solver"):
+    name = "{}-{}-seed{}".format(kind, stops, seed)
+    return name if tier == "solver" else "{}-{}".format(name, tier)
+
+
+def tier_supports(kind, stops, tier):
+    """The fast tier solves neither time windows nor sparse instances."""
+    return tier == "solver" or (
+        kind != "vrptw" and stops <= settings.ROUTE_SPARSE_THRESHOLD
+    )
+
+
+def generate_instance(kind, stops, seed=0):
+    """Returns the route payload of a generated ``kind`` instance."""
+    rng = np.random.default_rng([seed, stops, KINDS.index(kind)])
+    coordinates = np.round(rng.uniform(*AREA, size=(stops, 2)), 7).tolist()
+    if kind == "tsp":
+        return {"list_cord": coordinates, "num_vehicles": 1}
+    if kind == "vrp":
+        return {
+            "list_cord": coordinates,
+            "num_vehicles": min(MAX_VEHICLES, max(2, stops // STOPS_PER_VEHICLE)),
+            "vehicle_maximum_travel_distance": VEHICLE_MAXIMUM_TRAVEL_DISTANCE,
+        }
+    # Windows open late enough to be reached straight from the depot.
+    from_depot = np.ceil(
+        haversine_matrix(coordinates[:1], coordinates)[0] / METERS_PER_MINUTE
+    ).astype(np.int64)
+    opens = rng.integers(from_depot, HORIZON - WINDOW + 1)
+    time_windows = np.stack([opens, opens + WINDOW], axis=1)
+    time_windows[0] = [0, HORIZON]
+    return {
+        "list_cord": coordinates,
+        "time_windows": time_windows.tolist(),
+        "num_vehicles": max(2, stops // STOPS_PER_TIME_WINDOW_VEHICLE),
+        "speed_profile": {"speed": METERS_PER_MINUTE * 60 / 1000},
+        "allow_waiting_time": HORIZON,
+        "maximum_time_per_vehicle": HORIZON,
+    }
+
+
+def time_matrix(coordinate_list):
+    """Travel minutes between the stops at METERS_PER_MINUTE."""
+    distances = haversine_matrix(coordinate_list, coordinate_list)
+    return np.ceil(distances / METERS_PER_MINUTE).astype(np.int64)
+
+
+def run_instance(kind, stops, seed, search_budgets, tier="solver"):
+    """Solves one generated instance with ``tier`` and returns its
+    measurements.
+    """
+    data = dict(generate_instance(kind, stops, seed), tier=tier)
+    started = time.perf_counter()
+    neighbors = sparse_neighbors(
+        data, settings.ROUTE_SPARSE_THRESHOLD, settings.ROUTE_SPARSE_NEIGHBORS
+    )
+    if neighbors and kind != "vrptw":
+        data = dict(data, sparse_neighbors=neighbors)
+    route, solve = route_finder_from_request(data, search_budgets)
+    solve()
+    total = time.perf_counter() - started
+    return {
+        "kind": kind,
+        "stops": stops,
+        "vehicles": data["num_vehicles"],
+        "seed": seed,
+        "tier": tier,
+        "objective": route.objective,
+        "timings": {phase: route.timings.get(phase, 0.0) for phase in PHASES},
+        "total": total,
+    }
+
+
+def compare(results, baseline, latency_tolerance, objective_tolerance, slack=0.1):
+    """Returns a message for every result that regressed from ``baseline``.
+
+    Latency regresses when the total time grows by more than
+    ``latency_tolerance`` (a fraction) and ``slack`` seconds, the objective
+    when it grows by more than ``objective_tolerance`` or no solution is found.
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        limit = max(
+            previous["total"] * (1 + latency_tolerance), previous["total"] + slack
+        )
+        if result["total"] > limit:
+            regressions.append(
+                "{}: took {:.3f}s, baseline {:.3f}s".format(
+                    name, result["total"], previous["total"]
+                )
+            )
+        if previous["objective"] is None:
+            continue
+        if result["objective"] is None:
+            regressions.append("{}: no solution found".format(name))
+        elif result["objective"] > math.floor(
+            previous["objective"] * (1 + objective_tolerance)
+        ):
+            regressions.append(
+                "{}: objective {}, baseline {}".format(
+                    name, result["objective"], previous["objective"]
+                )
+            )
+    return regressions
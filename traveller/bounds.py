@@ -0,0 +1,104 @@
+"""Lower bounds on the routing objective, to report optimality gaps.
+
+The travelling salesman bound is the Held-Karp 1-tree bound: a minimum
+spanning tree over the stops plus the two cheapest depot edges, with node
+penalties tuned by subgradient steps towards a tree where every node has
+degree two. Any set of vehicle routes shortcut into one tour is no longer
+than the routes, so the same bound holds for their total distance.
+"""
+
+import math
+
+import numpy as np
+
+from traveller.heuristic import nearest_neighbour_tour, path_cost
+
+# Subgradient steps without a better bound before the step size is halved.
+STALLED_STEPS = 5
+
+
+def minimum_spanning_tree(weights):
+    """Returns the weight of the minimum spanning tree of the dense symmetric
+    ``weights`` and the degree of every node in it (Prim).
+    """
+    size = len(weights)
+    in_tree = np.zeros(size, dtype=bool)
+    in_tree[0] = True
+    distance = weights[0].copy()
+    distance[0] = np.inf
+    parent = np.zeros(size, dtype=np.intp)
+    degrees = np.zeros(size, dtype=np.int64)
+    total = 0.0
+    for _ in range(size - 1):
+        node = int(np.argmin(distance))
+        total += distance[node]
+        degrees[node] += 1
+        degrees[parent[node]] += 1
+        in_tree[node] = True
+        # Tree nodes keep an infinite distance so argmin skips them.
+        distance[node] = np.inf
+        row = weights[node]
+        closer = row < distance
+        closer &= ~in_tree
+        distance[closer] = row[closer]
+        parent[closer] = node
+    return total, degrees
+
+
+def held_karp_bound(matrix, iterations, depot=0):
+    """Returns a lower bound on the shortest tour through every node of the
+    integer ``matrix``, from ``iterations`` subgradient steps.
+    """
+    matrix = np.asarray(matrix, dtype=np.int64)
+    size = len(matrix)
+    if size < 3:
+        return int(matrix.sum()) if size == 2 else 0
+    # An asymmetric tour costs at least its arcs' cheaper direction.
+    costs = np.minimum(matrix, matrix.T).astype(np.float64)
+    order = np.concatenate([[depot], np.delete(np.arange(size), depot)])
+    costs = costs[np.ix_(order, order)]
+    stops = np.arange(1, size)
+    upper = path_cost(
+        costs, np.concatenate([[0], nearest_neighbour_tour(costs, stops), [0]])
+    )
+
+    penalties = np.zeros(size)
+    best = 0.0
+    scale = 2.0
+    stalled = 0
+    for _ in range(iterations):
+        weights = costs + penalties[:, np.newaxis] + penalties[np.newaxis, :]
+        tree, degrees = minimum_spanning_tree(weights[1:, 1:])
+        nearest = np.argpartition(weights[0, 1:], 1)[:2]
+        degrees = np.concatenate([[2], degrees])
+        degrees[nearest + 1] += 1
+        bound = tree + weights[0, 1 + nearest].sum() - 2 * penalties.sum()
+        if bound > best + 1e-9:
+            best, stalled = bound, 0
+        else:
+            stalled += 1
+            if stalled == STALLED_STEPS:
+                scale, stalled = scale / 2, 0
+        subgradient = degrees - 2
+        if not subgradient.any() or scale < 1e-3:
+            # A tour: the bound is exact.
+            break
+        step = scale * max(upper - bound, 1.0) / (subgradient @ subgradient)
+        penalties += step * subgradient
+    return int(math.ceil(best - 1e-6))
+
+
+def routing_bound(matrix, num_vehicles, span_cost_coefficient, iterations, depot=0):
+    """Returns a lower bound on the vehicle routing objective, the total
+    distance plus ``span_cost_coefficient`` times the longest route.
+
+    The longest route covers at least its share of the total and the round
+    trip to the farthest stop.
+    """
+    matrix = np.asarray(matrix, dtype=np.int64)
+    total = held_karp_bound(matrix, iterations, depot)
+    if num_vehicles == 1:
+        return total
+    round_trips = matrix[depot] + matrix[:, depot]
+    longest = max(math.ceil(total / num_vehicles), int(round_trips.max()))
+    return total + span_cost_coefficient * longest
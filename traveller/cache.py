@@ -0,0 +1,135 @@
+"""Content addressed cache of distance matrices.
+
+Matrices are keyed by a hash of the normalized coordinate list. The memory
+tier is bounded by bytes and evicts the least recently used matrix, the
+optional disk tier keeps one ``.npy`` file per key so that it survives
+restarts and is shared by every process pointing at the same directory.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from traveller.condensed import CondensedMatrix
+
+# Coordinates are rounded to this many decimals (about 1 cm) before hashing.
+COORDINATE_DECIMALS = 7
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def matrix_key(coordinate_list):
+    """Returns the cache key of the matrix between ``coordinate_list`` points."""
+    coordinates = np.round(
+        np.asarray(coordinate_list, dtype=np.float64).reshape(-1, 2),
+        COORDINATE_DECIMALS,
+    )
+    # Adding 0.0 folds -0.0 into 0.0 so both hash the same.
+    return hashlib.sha256((coordinates + 0.0).tobytes()).hexdigest()
+
+
+class DistanceMatrixCache:
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.matrices = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, "{}.npy".format(key))
+
+    def get(self, key):
+        """Returns the cached matrix for ``key`` or ``None``."""
+        with self.lock:
+            matrix = self.matrices.get(key)
+            if matrix is not None:
+                self.matrices.move_to_end(key)
+                self.hits += 1
+                return matrix
+
+        if self.directory:
+            try:
+                matrix = np.load(self.path(key))
+            except (OSError, ValueError):
+                matrix = None
+            if matrix is not None:
+                if matrix.ndim == 1:
+                    matrix = CondensedMatrix(matrix)
+                with self.lock:
+                    self.disk_hits += 1
+                self.remember(key, matrix)
+                return matrix
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, matrix):
+        """Caches ``matrix`` as int32 and returns the cached copy. A
+        CondensedMatrix stays condensed.
+        """
+        if isinstance(matrix, CondensedMatrix):
+            values = np.asarray(matrix.values, dtype=np.int32)
+            values.setflags(write=False)
+            matrix = CondensedMatrix(values)
+        else:
+            matrix = values = np.asarray(matrix, dtype=np.int32)
+            matrix.setflags(write=False)
+        self.remember(key, matrix)
+        if self.directory:
+            # Write then rename so other processes never read a partial file.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, values)
+            os.replace(tmp_path, self.path(key))
+        return matrix
+
+    def remember(self, key, matrix):
+        if matrix.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.matrices.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous.nbytes
+            self.matrices[key] = matrix
+            self.bytes += matrix.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self.matrices.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.matrices),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def get_distance_matrix_cache():
+    """Returns the distance matrix cache of this process."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DistanceMatrixCache(
+                settings.ROUTE_MATRIX_CACHE_BYTES, settings.ROUTE_MATRIX_CACHE_DIR
+            )
+    return _cache
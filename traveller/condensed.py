@@ -0,0 +1,82 @@
+"""Condensed storage of symmetric matrices with a zero diagonal."""
+
+import math
+
+import numpy as np
+
+
+class CondensedMatrix:
+    """Symmetric matrix with a zero diagonal stored as its upper triangle.
+
+    ``values`` holds the cells above the diagonal row by row, ``n * (n - 1) / 2``
+    of them. Indexing mirrors a dense matrix: ``m[i][j]`` and ``m[i, j]`` give
+    a cell, with arrays of indexes as well, iterating gives the rows and
+    ``np.asarray(m)`` the dense matrix.
+    """
+
+    def __init__(self, values):
+        self.values = np.asarray(values)
+        self.size = (1 + math.isqrt(1 + 8 * len(self.values))) // 2
+        if self.size * (self.size - 1) // 2 != len(self.values):
+            raise ValueError("{} values do not form a triangle".format(len(values)))
+        self.shape = (self.size, self.size)
+
+    @classmethod
+    def from_dense(cls, matrix):
+        matrix = np.asarray(matrix)
+        return cls(matrix[np.triu_indices(len(matrix), k=1)])
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.cells(*key)
+        return CondensedRow(self, key)
+
+    def __iter__(self):
+        for row in range(self.size):
+            yield self.row(row)
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = np.zeros(self.shape, dtype=dtype or self.values.dtype)
+        rows, columns = np.triu_indices(self.size, k=1)
+        matrix[rows, columns] = matrix[columns, rows] = self.values
+        return matrix
+
+    def cells(self, rows, columns):
+        """Returns the cells at ``rows`` and ``columns``, broadcast."""
+        low = np.minimum(rows, columns)
+        high = np.maximum(rows, columns)
+        index = low * (2 * self.size - low - 1) // 2 + high - low - 1
+        diagonal = low == high
+        if len(self.values):
+            cells = np.where(diagonal, 0, self.values[np.where(diagonal, 0, index)])
+        else:
+            cells = np.zeros(np.shape(diagonal), dtype=self.values.dtype)
+        return cells if cells.ndim else int(cells)
+
+    def row(self, row):
+        """Returns row ``row`` as a dense ndarray."""
+        return self.cells(row, np.arange(self.size))
+
+
+class CondensedRow:
+    """One row of a CondensedMatrix, indexed without building it."""
+
+    def __init__(self, matrix, row):
+        self.matrix = matrix
+        self.row = row
+
+    def __len__(self):
+        return self.matrix.size
+
+    def __getitem__(self, column):
+        return self.matrix.cells(self.row, column)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.matrix.row(self.row), dtype=dtype)
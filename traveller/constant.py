@@ -17,3 +17,35 @@ SAMPLE_DISTANCE_MATRIX = [
 NUM_OF_VEHICLES = 1
 
 DEEPOT = 0
+
+# Rows of the distance matrix computed per vectorized block, bounds the
+# temporary memory to DISTANCE_MATRIX_CHUNK_SIZE * number of stops floats.
+DISTANCE_MATRIX_CHUNK_SIZE = 512
+
+# Minimum seconds between two progress writes of a running solve job.
+JOB_PROGRESS_INTERVAL = 0.5
+
+# Cost multiplier of arcs outside the sparse candidate graph, high enough that
+# the solver only takes them when no candidate arc fits.
+SPARSE_FALLBACK_FACTOR = 3
+
+# Cost per meter of the longest route added to the vehicle routing objective,
+# balances the route lengths across vehicles.
+GLOBAL_SPAN_COST_COEFFICIENT = 100
+
+# Cells of the padded distance matrices a batch request computes in one
+# broadcast, small enough for the float temporaries to stay in cache.
+BATCH_MATRIX_CELLS = 64 * 1024
+
+# Largest problem whose lower bound is computed when a request asks for its
+# optimality gap, and the subgradient steps of the Held-Karp bound.
+LOWER_BOUND_MAX_STOPS = 1000
+HELD_KARP_ITERATIONS = 50
+
+# Least seconds of a request deadline kept for the search to overrun its time
+# limit and the response to reach the view. The solver executor raises it to
+# the lateness it measures, see SolverExecutor.observe_response.
+DEADLINE_RESPONSE_SECONDS = 0.05
+
+# A search ending this close to the deadline counts as cut short by it.
+DEADLINE_TOLERANCE_SECONDS = 0.025
@@ -0,0 +1,185 @@
+"""Cluster-first, route-second solving of large multi-vehicle problems.
+
+The stops are swept by angle around the depot into geographic clusters, each
+cluster gets its share of the fleet and is solved as an independent problem
+on the solver executor. A boundary repair pass then re-solves every pair of
+neighbouring clusters together, starting from their current routes, and keeps
+the result when it lowers the pair's objective.
+"""
+
+import math
+import time
+import numpy as np
+
+from traveller.constant import GLOBAL_SPAN_COST_COEFFICIENT
+from traveller.executor import submit_when_free
+from traveller.utils import haversine_pairs
+
+
+def sweep_clusters(coordinate_list, num_clusters, depot=0):
+    """Splits the stops other than the depot into ``num_clusters`` angular
+    sectors around the depot holding the same number of stops.
+    """
+    coordinates = np.asarray(coordinate_list, dtype=np.float64).reshape(-1, 2)
+    offset = coordinates - coordinates[depot]
+    angle = np.arctan2(
+        offset[:, 1], offset[:, 0] * math.cos(math.radians(coordinates[depot, 1]))
+    )
+    stops = np.delete(np.arange(len(coordinates)), depot)
+    order = stops[np.argsort(angle[stops], kind="stable")]
+    if len(order) > 1:
+        # Start the sweep after the widest empty sector so that no cluster
+        # straddles it.
+        gaps = np.diff(np.concatenate([angle[order], angle[order[:1]] + 2 * np.pi]))
+        order = np.roll(order, -(int(np.argmax(gaps)) + 1))
+    return [cluster.tolist() for cluster in np.array_split(order, num_clusters)]
+
+
+def route_distances(coordinate_list, routes, depot=0):
+    """Returns the haversine length of each route, depot to depot."""
+    coordinates = np.asarray(coordinate_list, dtype=np.float64).reshape(-1, 2)
+    distances = []
+    for route in routes:
+        path = [depot] + list(route) + [depot]
+        distances.append(
+            int(haversine_pairs(coordinates[path[:-1]], coordinates[path[1:]]).sum())
+        )
+    return distances
+
+
+def routes_objective(coordinate_list, routes, depot=0):
+    """Objective of ``routes`` as the vehicle routing model scores it: total
+    distance plus the span cost of the longest route.
+    """
+    distances = route_distances(coordinate_list, routes, depot)
+    if not distances:
+        return 0
+    return sum(distances) + GLOBAL_SPAN_COST_COEFFICIENT * max(distances)
+
+
+class Decomposition:
+    """Solves one vehicle routing payload by decomposition.
+
+    ``submit`` takes a route payload and returns the future of its response,
+    as SolverExecutor.submit does with the search budgets bound.
+    """
+
+    def __init__(self, data, submit, cluster_stops, depot=0):
+        self.data = data
+        self.submit = submit
+        self.depot = depot
+        self.coordinate_list = data["list_cord"]
+        self.num_vehicles = int(data["num_vehicles"])
+        stops = len(self.coordinate_list) - 1
+        self.num_clusters = max(
+            1, min(self.num_vehicles, math.ceil(stops / cluster_stops), stops)
+        )
+        self.pending = []
+
+    def submit_when_free(self, payload):
+        """Submits ``payload``, waiting for one of our own solves to finish
+        while the executor queue is full.
+        """
+        return submit_when_free(lambda: self.submit(payload), self.pending)
+
+    def subproblem(self, stops, num_vehicles, routes=None):
+        """Returns the payload solving ``stops`` with ``num_vehicles``, where
+        ``routes`` are global stop indexes to start from.
+        """
+        payload = {
+            key: value
+            for key, value in self.data.items()
+            if key not in ("decompose", "compare_monolithic", "routes")
+        }
+        payload["list_cord"] = [self.coordinate_list[self.depot]] + [
+            self.coordinate_list[stop] for stop in stops
+        ]
+        payload["num_vehicles"] = num_vehicles
+        if routes is not None:
+            local = {stop: index + 1 for index, stop in enumerate(stops)}
+            payload["routes"] = [[local[stop] for stop in route] for route in routes]
+        return payload
+
+    def collect(self, future, stops):
+        """Waits for a subproblem and maps its routes back to global stops."""
+        response = future.result()
+        if "routes" not in response:
+            raise ValueError(response.get("message", "No solution found !"))
+        return [[stops[index - 1] for index in route] for route in response["routes"]]
+
+    def solve(self):
+        started = time.monotonic()
+        clusters = sweep_clusters(self.coordinate_list, self.num_clusters, self.depot)
+        vehicles = [
+            len(part)
+            for part in np.array_split(range(self.num_vehicles), self.num_clusters)
+        ]
+        futures = [
+            self.submit_when_free(self.subproblem(stops, count))
+            for stops, count in zip(clusters, vehicles)
+        ]
+        cluster_routes = [
+            self.collect(future, stops) for future, stops in zip(futures, clusters)
+        ]
+        cluster_routes = self.repair_boundaries(clusters, cluster_routes)
+
+        routes = [route for part in cluster_routes for route in part]
+        return self.response(routes, time.monotonic() - started)
+
+    def repair_boundaries(self, clusters, cluster_routes):
+        """Re-solves neighbouring cluster pairs together, even pairs first and
+        odd pairs second so that the solves of a round are independent.
+        """
+        for first in (0, 1):
+            pairs = list(range(first, self.num_clusters - 1, 2))
+            futures = []
+            for left in pairs:
+                stops = clusters[left] + clusters[left + 1]
+                routes = cluster_routes[left] + cluster_routes[left + 1]
+                futures.append(
+                    self.submit_when_free(self.subproblem(stops, len(routes), routes))
+                )
+            for left, future in zip(pairs, futures):
+                stops = clusters[left] + clusters[left + 1]
+                current = cluster_routes[left] + cluster_routes[left + 1]
+                try:
+                    repaired = self.collect(future, stops)
+                except ValueError:
+                    continue
+                if routes_objective(
+                    self.coordinate_list, repaired, self.depot
+                ) < routes_objective(self.coordinate_list, current, self.depot):
+                    split = len(cluster_routes[left])
+                    cluster_routes[left] = repaired[:split]
+                    cluster_routes[left + 1] = repaired[split:]
+                    clusters[left] = sorted(sum(cluster_routes[left], []))
+                    clusters[left + 1] = sorted(sum(cluster_routes[left + 1], []))
+        return cluster_routes
+
+    def response(self, routes, wall_time):
+        distances = route_distances(self.coordinate_list, routes, self.depot)
+        response = {"routes": routes}
+        for vehicle_id, distance in enumerate(distances):
+            response[
+                "Distance of the route for vehicle {} in meter".format(vehicle_id)
+            ] = distance
+        response["Maximum of the route distances"] = max(distances, default=0)
+        response["objective"] = routes_objective(
+            self.coordinate_list, routes, self.depot
+        )
+        response["clusters"] = self.num_clusters
+        response["wall_time"] = round(wall_time, 3)
+        return response
+
+    def monolithic(self):
+        """Solves the whole payload as one model, for comparison."""
+        started = time.monotonic()
+        stops = [
+            stop for stop in range(len(self.coordinate_list)) if stop != self.depot
+        ]
+        payload = self.subproblem(stops, self.num_vehicles)
+        routes = self.collect(self.submit_when_free(payload), stops)
+        return {
+            "objective": routes_objective(self.coordinate_list, routes, self.depot),
+            "wall_time": round(time.monotonic() - started, 3),
+        }
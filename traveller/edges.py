@@ -0,0 +1,155 @@
+"""Pairwise distance store shared by partially overlapping stop sets.
+
+Points are identified by their coordinates quantized to COORDINATE_DECIMALS
+and each known point owns a slot of a square int32 matrix, ``-1`` marking
+pairs that were never computed. A request only computes the pairs missing
+from the store, so ``k`` new stops among ``n`` cost O(k * n) instead of
+O(n^2). The matrix is bounded by bytes and the least recently used points are
+evicted to make room for new ones.
+"""
+
+import math
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from traveller.cache import COORDINATE_DECIMALS
+from traveller.utils import haversine_matrix, haversine_pairs
+
+UNKNOWN = -1
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def point_keys(coordinates):
+    """Packs the quantized longitude and latitude of each point in one int64."""
+    quantized = np.rint(coordinates * 10**COORDINATE_DECIMALS).astype(np.int64)
+    return (quantized[:, 0] << 32) | (quantized[:, 1] & 0xFFFFFFFF)
+
+
+class EdgeStore:
+    def __init__(self, max_bytes, initial_points=1024):
+        self.capacity = math.isqrt(max_bytes // np.dtype(np.int32).itemsize)
+        self.slots = {}
+        self.slot_keys = np.zeros(0, dtype=np.int64)
+        self.coordinates = np.zeros((0, 2))
+        self.last_used = np.zeros(0, dtype=np.int64)
+        self.distances = np.zeros((0, 0), dtype=np.int32)
+        self.free = []
+        self.clock = 0
+        self.computed_edges = 0
+        self.reused_edges = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.grow(min(initial_points, self.capacity))
+
+    def grow(self, size):
+        """Enlarges the slot arrays to ``size`` points."""
+        current = len(self.slot_keys)
+        distances = np.full((size, size), UNKNOWN, dtype=np.int32)
+        distances[:current, :current] = self.distances
+        self.distances = distances
+        self.slot_keys = np.concatenate(
+            [self.slot_keys, np.zeros(size - current, dtype=np.int64)]
+        )
+        self.coordinates = np.concatenate(
+            [self.coordinates, np.zeros((size - current, 2))]
+        )
+        self.last_used = np.concatenate(
+            [self.last_used, np.zeros(size - current, dtype=np.int64)]
+        )
+        self.free.extend(range(size - 1, current - 1, -1))
+
+    def allocate(self, count):
+        """Returns ``count`` free slots, growing or evicting as needed, or
+        ``None`` when the points in use leave no room.
+        """
+        while len(self.free) < count and len(self.slot_keys) < self.capacity:
+            self.grow(min(max(2 * len(self.slot_keys), 1), self.capacity))
+        if len(self.free) < count:
+            # Points of the current request were stamped with the clock.
+            free = set(self.free)
+            candidates = [
+                slot
+                for slot in np.flatnonzero(self.last_used < self.clock)
+                if slot not in free
+            ]
+            needed = count - len(self.free)
+            if len(candidates) < needed:
+                return None
+            order = np.argsort(self.last_used[candidates], kind="stable")
+            for slot in np.asarray(candidates)[order[:needed]]:
+                del self.slots[int(self.slot_keys[slot])]
+                self.distances[slot, :] = UNKNOWN
+                self.distances[:, slot] = UNKNOWN
+                self.free.append(int(slot))
+                self.evictions += 1
+        return [self.free.pop() for _ in range(count)]
+
+    def matrix(self, coordinate_list):
+        """Returns the int64 distance matrix between ``coordinate_list``
+        points, computing only the pairs missing from the store.
+        """
+        coordinates = np.asarray(coordinate_list, dtype=np.float64).reshape(-1, 2)
+        if len(coordinates) > self.capacity:
+            return haversine_matrix(coordinates, coordinates)
+
+        keys = point_keys(coordinates).tolist()
+        with self.lock:
+            self.clock += 1
+            slots = [self.slots.get(key) for key in keys]
+            known = [slot for slot in slots if slot is not None]
+            self.last_used[known] = self.clock
+
+            new_keys = list(
+                dict.fromkeys(key for key, slot in zip(keys, slots) if slot is None)
+            )
+            if new_keys:
+                new_slots = self.allocate(len(new_keys))
+                if new_slots is None:
+                    return haversine_matrix(coordinates, coordinates)
+                first_point = dict(zip(reversed(keys), reversed(range(len(keys)))))
+                for key, slot in zip(new_keys, new_slots):
+                    self.slots[key] = slot
+                    self.slot_keys[slot] = key
+                    self.coordinates[slot] = coordinates[first_point[key]]
+                    self.distances[slot, slot] = 0
+                self.last_used[new_slots] = self.clock
+                slots = [self.slots[key] for key in keys]
+
+            index = np.asarray(slots, dtype=np.intp)
+            matrix = self.distances[np.ix_(index, index)].astype(np.int64)
+            # Pairs are always stored both ways, compute each one once.
+            rows, columns = np.nonzero(np.triu(matrix == UNKNOWN))
+            if len(rows):
+                distances = haversine_pairs(
+                    self.coordinates[index[rows]], self.coordinates[index[columns]]
+                )
+                matrix[rows, columns] = matrix[columns, rows] = distances
+                self.distances[index[rows], index[columns]] = distances
+                self.distances[index[columns], index[rows]] = distances
+            self.computed_edges += len(rows)
+            self.reused_edges += (matrix.size + len(index)) // 2 - len(rows)
+        return matrix
+
+    def stats(self):
+        with self.lock:
+            return {
+                "points": len(self.slots),
+                "capacity": self.capacity,
+                "bytes": self.distances.nbytes,
+                "computed_edges": self.computed_edges,
+                "reused_edges": self.reused_edges,
+                "evictions": self.evictions,
+            }
+
+
+def get_edge_store():
+    """Returns the edge store of this process."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EdgeStore(settings.ROUTE_EDGE_STORE_BYTES)
+    return _store
@@ -0,0 +1,410 @@
+"""Process pool running route solves off the request threads.
+
+A fixed number of worker processes, sized to the cores, is started up front.
+At most ``workers + queue_size`` solves are admitted at once, further
+submissions are rejected with SolverBusy so that the view can answer 429.
+Distance and time matrices reach the workers through shared memory, large
+distance matrices through a memory-mapped file.
+"""
+
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from django.conf import settings
+
+from traveller.cache import get_distance_matrix_cache
+from traveller.condensed import CondensedMatrix
+from traveller.constant import DEADLINE_RESPONSE_SECONDS, DISTANCE_MATRIX_CHUNK_SIZE
+from traveller.edges import get_edge_store
+from traveller.matrixfile import MappedMatrix, mapped_transit
+from traveller.utils import (
+    DistanceMatrix,
+    derives_time_matrix,
+    route_finder_from_request,
+    sparse_neighbors,
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class SolverBusy(Exception):
+    """Raised when the solver queue is full."""
+
+    def __init__(self, retry_after):
+        super().__init__("Solver queue is full, retry after {}s".format(retry_after))
+        self.retry_after = retry_after
+
+
+class SharedMatrix:
+    """An integer matrix copied once into a named shared memory block.
+
+    A CondensedMatrix is shared as its values and attached as a
+    CondensedMatrix again.
+    """
+
+    def __init__(self, matrix):
+        if isinstance(matrix, CondensedMatrix):
+            matrix = np.ascontiguousarray(matrix.values)
+        else:
+            matrix = np.ascontiguousarray(matrix, dtype=np.int64)
+        self.shape = matrix.shape
+        self.dtype = matrix.dtype.str
+        self.shm = SharedMemory(create=True, size=max(matrix.nbytes, 1))
+        self.name = self.shm.name
+        np.ndarray(self.shape, dtype=matrix.dtype, buffer=self.shm.buf)[:] = matrix
+
+    def __getstate__(self):
+        # Only the handle travels to the workers, never the matrix itself.
+        return {"name": self.name, "shape": self.shape, "dtype": self.dtype}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = None
+
+    def attach(self):
+        """Attaches to the block from a worker, returns the shm and the view."""
+        shm = SharedMemory(name=self.name)
+        view = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+        if len(self.shape) == 1:
+            view = CondensedMatrix(view)
+        return shm, view
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedStop:
+    """A one byte shared memory flag ending every solve it is given.
+
+    Solves stop with their best solution once the flag is set or
+    ``deadline``, a time.time() timestamp, has passed. A solve finding an
+    objective of at most ``target_objective`` sets the flag.
+    """
+
+    def __init__(self, deadline=None, target_objective=None):
+        self.deadline = deadline
+        self.target_objective = target_objective
+        self.shm = SharedMemory(create=True, size=1)
+        self.shm.buf[0] = 0
+        self.name = self.shm.name
+
+    def __getstate__(self):
+        return {
+            "name": self.name,
+            "deadline": self.deadline,
+            "target_objective": self.target_objective,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = None
+
+    def attach(self):
+        self.shm = SharedMemory(name=self.name)
+
+    def is_set(self):
+        if self.deadline is not None and time.time() >= self.deadline:
+            return True
+        return bool(self.shm.buf[0])
+
+    def set(self):
+        self.shm.buf[0] = 1
+
+    def reached(self, objective):
+        if self.target_objective is not None and objective <= self.target_objective:
+            self.set()
+
+    def close(self):
+        self.shm.close()
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _solve(
+    data,
+    search_budgets,
+    shared_matrices,
+    stop=None,
+    deadline=None,
+    solution=None,
+    response_seconds=DEADLINE_RESPONSE_SECONDS,
+):
+    """Worker entry point: solves ``data`` using the shared matrices, until
+    the SharedStop ``stop`` when one is given and by the time.time()
+    ``deadline``, less ``response_seconds``. Improving solutions are
+    published to the SharedSolution ``solution`` when one is given.
+
+    Returns the response, the metrics, the seconds spent here and when the
+    search was due to end by the deadline, ``None`` without one.
+    """
+    started = time.perf_counter()
+    attached = {key: shared.attach() for key, shared in shared_matrices.items()}
+    kwargs = {"deadline": deadline, "response_seconds": response_seconds}
+    if stop is not None:
+        stop.attach()
+        kwargs.update(
+            should_stop=stop.is_set,
+            solution_callback=stop.reached,
+            on_target=stop.set,
+        )
+    if solution is not None:
+        solution.attach()
+        kwargs["routes_callback"] = solution.publish
+    try:
+        matrices = {key: view for key, (shm, view) in attached.items()}
+        route, solve = route_finder_from_request(
+            data, search_budgets, **matrices, **kwargs
+        )
+        response = solve()
+        metrics = route.metrics()
+        search_end = route.search_end
+        # Views into the block must be gone before it can be closed.
+        del route, solve, matrices
+        return response, metrics, time.perf_counter() - started, search_end
+    finally:
+        for key in list(attached):
+            shm, view = attached.pop(key)
+            del view
+            shm.close()
+        if stop is not None:
+            stop.close()
+        if solution is not None:
+            solution.close()
+
+
+def _warm_up():
+    return True
+
+
+class SolverExecutor:
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.capacity = threading.BoundedSemaphore(workers + queue_size)
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.average_duration = 1.0
+        self.response_seconds = DEADLINE_RESPONSE_SECONDS
+        # Start every worker now instead of on the first requests.
+        for future in [self.pool.submit(_warm_up) for _ in range(workers)]:
+            future.result()
+
+    def retry_after(self):
+        """Estimated seconds until a queue slot frees up."""
+        with self.lock:
+            return max(
+                1, math.ceil(self.average_duration * self.pending / self.workers)
+            )
+
+    def observe_response(self, seconds):
+        """Records how late a response reached this process after its search
+        was due to end by the deadline: the search overrunning its time
+        limit, formatting, pickling and the way back. The margin kept for
+        the next deadlines follows increases at once and decreases slowly.
+        """
+        with self.lock:
+            self.response_seconds = max(
+                seconds,
+                0.8 * self.response_seconds + 0.2 * seconds,
+                DEADLINE_RESPONSE_SECONDS,
+            )
+
+    def submit(
+        self,
+        data,
+        search_budgets,
+        distance_matrix=None,
+        stop=None,
+        deadline=None,
+        solution=None,
+    ):
+        """Admits a route request payload and returns the future of its
+        response, or ``None`` when the payload describes no problem. The
+        response carries the RouteFinder metrics of the solve under "metrics",
+        with the matrix sharing and queue wait added to its phases.
+        ``distance_matrix`` is the already computed matrix of its stops,
+        ``stop`` a SharedStop ending the solve early, ``deadline`` the
+        time.time() by which the response is due and ``solution`` a
+        SharedSolution the improving solutions are published to. The search
+        ends by the deadline less the lateness measured by observe_response.
+
+        Raises SolverBusy when the queue is full.
+        """
+        if not self.capacity.acquire(blocking=False):
+            raise SolverBusy(self.retry_after())
+
+        submitted = time.perf_counter()
+        try:
+            data, shared_matrices = share_matrices(data, distance_matrix)
+        except Exception:
+            self.capacity.release()
+            raise
+        if shared_matrices is None:
+            self.capacity.release()
+            return None
+
+        share_seconds = time.perf_counter() - submitted
+        with self.lock:
+            self.pending += 1
+        started = time.monotonic()
+        # The caller's future completes only once the slot is released again.
+        response = Future()
+
+        def release():
+            for shared in shared_matrices.values():
+                shared.release()
+            with self.lock:
+                self.pending -= 1
+                duration = time.monotonic() - started
+                self.average_duration = 0.8 * self.average_duration + 0.2 * duration
+            self.capacity.release()
+
+        def done(future):
+            release()
+            if future.exception() is not None:
+                response.set_exception(future.exception())
+                return
+            result, metrics, worker_seconds, search_end = future.result()
+            if search_end is not None:
+                self.observe_response(time.time() - search_end)
+            phases = metrics["phases"]
+            phases["matrix"] = phases.get("matrix", 0.0) + share_seconds
+            phases["queue"] = max(
+                time.perf_counter() - submitted - share_seconds - worker_seconds, 0.0
+            )
+            response.set_result(dict(result, metrics=metrics))
+
+        with self.lock:
+            response_seconds = self.response_seconds
+        try:
+            future = self.pool.submit(
+                _solve,
+                data,
+                search_budgets,
+                shared_matrices,
+                stop,
+                deadline,
+                solution,
+                response_seconds,
+            )
+        except BaseException:
+            # BrokenProcessPool once a worker died, get_solver_executor then
+            # starts a new pool.
+            release()
+            raise
+        future.add_done_callback(done)
+        return response
+
+    def broken(self):
+        """Whether a worker died, after which the pool takes no more solves."""
+        return bool(getattr(self.pool, "_broken", False))
+
+
+def submit_when_free(submit, pending):
+    """Calls ``submit`` until the queue admits it and adds its future to the
+    ``pending`` list, waiting for one of those futures, our own solves, to
+    finish while the queue is full.
+    """
+    while True:
+        try:
+            future = submit()
+            pending.append(future)
+            return future
+        except SolverBusy:
+            pending[:] = [future for future in pending if not future.done()]
+            if not pending:
+                raise
+            wait(pending, return_when=FIRST_COMPLETED)
+
+
+def share_matrices(data, distance_matrix=None):
+    """Moves the matrices of a route payload into shared memory.
+
+    Returns the payload without its matrices and the SharedMatrix handles keyed
+    by the route_finder_from_request argument they replace, or ``None`` handles
+    when the payload describes no problem. From ROUTE_MMAP_THRESHOLD stops the
+    distance matrix is streamed to a MappedMatrix file instead, so it is never
+    held in memory here. Mapped matrices are solved through the transit
+    callback unless the payload asks for a transit mode. Larger stop lists are left to the worker, which
+    builds their sparse candidate graph itself. A given ``distance_matrix`` is
+    shared as is. Time windows with a speed profile share the distance matrix
+    of their stops, the worker derives the time matrices from it.
+    """
+    time_matrix = data.get("time_matrix")
+    has_time_matrix = isinstance(time_matrix, MappedMatrix) or (
+        time_matrix is not None and len(time_matrix) > 0
+    )
+    if has_time_matrix and data.get("time_windows"):
+        data = {key: value for key, value in data.items() if key != "time_matrix"}
+        # An uploaded matrix is already a file the workers can map.
+        if isinstance(time_matrix, MappedMatrix):
+            data = mapped_transit(data)
+        else:
+            time_matrix = SharedMatrix(time_matrix)
+        return data, {"time_matrix": time_matrix}
+    if derives_time_matrix(data):
+        # Time windows need the dense matrix, whatever the stop count.
+        if distance_matrix is None:
+            distance_matrix = DistanceMatrix(
+                data["list_cord"],
+                chunk_size=DISTANCE_MATRIX_CHUNK_SIZE,
+                cache=get_distance_matrix_cache(),
+                edge_store=get_edge_store(),
+                condensed=True,
+            ).create_distance_matrix()
+        return data, {"distance_matrix": SharedMatrix(distance_matrix)}
+    if data.get("list_cord") and data.get("num_vehicles"):
+        if distance_matrix is not None:
+            return data, {"distance_matrix": SharedMatrix(distance_matrix)}
+        neighbors = sparse_neighbors(
+            data, settings.ROUTE_SPARSE_THRESHOLD, settings.ROUTE_SPARSE_NEIGHBORS
+        )
+        if neighbors:
+            return dict(data, sparse_neighbors=neighbors), {}
+        threshold = settings.ROUTE_MMAP_THRESHOLD
+        if threshold is not None and len(data["list_cord"]) >= threshold:
+            matrix = MappedMatrix.from_coordinates(
+                data["list_cord"],
+                settings.ROUTE_MATRIX_DIR,
+                chunk_size=DISTANCE_MATRIX_CHUNK_SIZE,
+            )
+            return mapped_transit(data), {"distance_matrix": matrix}
+        matrix = DistanceMatrix(
+            data["list_cord"],
+            chunk_size=DISTANCE_MATRIX_CHUNK_SIZE,
+            cache=get_distance_matrix_cache(),
+            edge_store=get_edge_store(),
+            condensed=True,
+        ).create_distance_matrix()
+        return data, {"distance_matrix": SharedMatrix(matrix)}
+    return data, None
+
+
+def get_solver_executor():
+    """Returns the solver executor of this web worker, starting it on first use
+    and again once a worker died, killed when out of memory for instance.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor.broken():
+            logging.info("Solver pool broken, starting a new one")
+            # Its solves have already failed with BrokenProcessPool.
+            _executor.pool.shutdown(wait=False)
+            _executor = None
+        if _executor is None:
+            _executor = SolverExecutor(
+                settings.ROUTE_SOLVER_WORKERS, settings.ROUTE_SOLVER_QUEUE_SIZE
+            )
+    return _executor
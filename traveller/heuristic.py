@@ -0,0 +1,219 @@
+"""NumPy routing heuristic for low latency answers.
+
+A nearest neighbour tour is improved by 2-opt and Or-opt moves until neither
+finds an improvement. Every round evaluates the delta cost of all the moves
+of a kind at once over the dense integer matrix, so Python only runs once per
+applied move. Vehicle routing splits one tour over all the stops into
+consecutive routes, minimising the longest route. Matrices are assumed
+symmetric, as the haversine distance matrices are.
+"""
+
+import numpy as np
+
+# Nearest nodes of each node whose edges the moves try.
+NEIGHBORS = 10
+# Longest segment of stops Or-opt moves elsewhere in the route.
+OR_OPT_SEGMENT = 3
+# Rounds of improvement before giving up, a safety net for cycling on ties.
+MAX_ROUNDS = 10000
+
+
+def nearest_neighbour_tour(matrix, stops, depot=0):
+    """Orders ``stops`` by always going to the nearest unvisited one, starting
+    from the depot.
+    """
+    stops = np.asarray(stops, dtype=np.intp)
+    unvisited = np.ones(len(stops), dtype=bool)
+    tour = np.empty(len(stops), dtype=np.intp)
+    current = depot
+    for position in range(len(stops)):
+        costs = np.where(unvisited, matrix[current, stops], np.iinfo(np.int64).max)
+        nearest = int(np.argmin(costs))
+        unvisited[nearest] = False
+        tour[position] = current = stops[nearest]
+    return tour
+
+
+def candidate_neighbors(matrix, count):
+    """Returns the ``count`` nearest other nodes of every node."""
+    count = min(count, len(matrix) - 1)
+    others = matrix.copy()
+    np.fill_diagonal(others, np.iinfo(np.int64).max)
+    return np.argpartition(others, count - 1, axis=1)[:, :count]
+
+
+def disjoint_moves(lows, highs, deltas):
+    """Returns the indexes of the improving moves to apply together, best
+    first, skipping those whose edge range [low, high] overlaps a taken one.
+    """
+    taken = np.zeros(int(highs.max()) + 1, dtype=bool)
+    chosen = []
+    for move in np.argsort(deltas, kind="stable"):
+        if deltas[move] >= 0:
+            break
+        if not taken[lows[move] : highs[move] + 1].any():
+            taken[lows[move] : highs[move] + 1] = True
+            chosen.append(move)
+    return chosen
+
+
+def two_opt_moves(matrix, path, neighbors, position):
+    """Returns the improving 2-opt moves of ``path`` that can be applied
+    together, as (i, j) reversing ``path[i + 1 : j + 1]``.
+
+    Edge i, from a to b, is only exchanged with the edge j leaving one of the
+    ``neighbors`` c of a, giving the edges a-c and b-d.
+    """
+    edges = len(path) - 1
+    a, b = path[:-1, np.newaxis], path[1:, np.newaxis]
+    c = neighbors[path[:-1]]
+    i = np.arange(edges)[:, np.newaxis]
+    j = np.minimum(position[c], edges - 1)
+    d = path[j + 1]
+    delta = matrix[a, c] + matrix[b, d] - matrix[a, b] - matrix[c, d]
+    # Adjacent edges share a node.
+    delta[np.abs(i - j) < 2] = 0
+    best = np.argmin(delta, axis=1)
+    rows = np.arange(edges)
+    i, j, delta = rows, j[rows, best], delta[rows, best]
+    lows, highs = np.minimum(i, j), np.maximum(i, j)
+    return [(lows[move], highs[move]) for move in disjoint_moves(lows, highs, delta)]
+
+
+def or_opt_moves(matrix, path, neighbors, position, length):
+    """Returns the improving moves of ``length`` consecutive stops that can be
+    applied together, as (start, edge, reversed).
+
+    A segment is only inserted on an edge touching a neighbour of one of its
+    ends.
+    """
+    stops = len(path) - 2
+    if stops <= length:
+        return []
+    edges = len(path) - 1
+    starts = np.arange(1, stops - length + 2)
+    first, last = path[starts], path[starts + length - 1]
+    before, after = path[starts - 1], path[starts + length]
+    removal = matrix[before, first] + matrix[last, after] - matrix[before, after]
+
+    near = position[np.concatenate([neighbors[first], neighbors[last]], axis=1)]
+    edge = np.clip(np.concatenate([near, near - 1], axis=1), 0, edges - 1)
+    edge_from, edge_to = path[edge], path[edge + 1]
+    first, last = first[:, np.newaxis], last[:, np.newaxis]
+    insertion = matrix[edge_from, edge_to] + removal[:, np.newaxis]
+    forward = matrix[edge_from, first] + matrix[last, edge_to] - insertion
+    backward = matrix[edge_from, last] + matrix[first, edge_to] - insertion
+    # The edges touching the segment are not insertion points.
+    inside = (edge >= starts[:, np.newaxis] - 1) & (
+        edge <= starts[:, np.newaxis] + length - 1
+    )
+    forward[inside] = 0
+    backward[inside] = 0
+    reverse = backward < forward
+    delta = np.where(reverse, backward, forward)
+    best = np.argmin(delta, axis=1)
+    rows = np.arange(len(starts))
+    edge, reverse, delta = edge[rows, best], reverse[rows, best], delta[rows, best]
+    lows = np.minimum(starts - 1, edge)
+    highs = np.maximum(starts + length - 1, edge)
+    return [
+        (starts[move], edge[move], reverse[move])
+        for move in disjoint_moves(lows, highs, delta)
+    ]
+
+
+def apply_or_opt(path, start, edge, reverse, length):
+    segment = path[start : start + length]
+    if reverse:
+        segment = segment[::-1]
+    rest = np.concatenate([path[:start], path[start + length :]])
+    # Edges after the segment moved left by its length.
+    position = edge + 1 if edge < start else edge + 1 - length
+    return np.concatenate([rest[:position], segment, rest[position:]])
+
+
+def improve_path(matrix, path):
+    """Applies 2-opt and Or-opt moves to ``path``, depot to depot and
+    visiting every node of ``matrix``, until neither improves it.
+    """
+    path = np.array(path, dtype=np.intp)
+    neighbors = candidate_neighbors(matrix, NEIGHBORS)
+    position = np.zeros(len(matrix), dtype=np.intp)
+    for _ in range(MAX_ROUNDS):
+        # The depot closing the path keeps position 0.
+        position[path[:-1]] = np.arange(len(path) - 1)
+        moves = (
+            two_opt_moves(matrix, path, neighbors, position) if len(path) > 3 else []
+        )
+        for i, j in moves:
+            path[i + 1 : j + 1] = path[i + 1 : j + 1][::-1].copy()
+        if moves:
+            continue
+        for length in range(1, OR_OPT_SEGMENT + 1):
+            moves = or_opt_moves(matrix, path, neighbors, position, length)
+            for start, edge, reverse in moves:
+                path = apply_or_opt(path, start, edge, reverse, length)
+            if moves:
+                break
+        else:
+            break
+    return path
+
+
+def path_cost(matrix, path):
+    return int(matrix[path[:-1], path[1:]].sum())
+
+
+def split_tour(matrix, tour, num_vehicles, depot=0):
+    """Splits ``tour`` into at most ``num_vehicles`` consecutive routes with
+    the shortest possible longest route.
+    """
+    if len(tour) == 0:
+        return []
+    legs = np.concatenate([[0], np.cumsum(matrix[tour[:-1], tour[1:]])])
+    out, back = matrix[depot, tour], matrix[tour, depot]
+
+    def split(limit):
+        routes, first = [], 0
+        for last in range(1, len(tour)):
+            cost = out[first] + legs[last] - legs[first] + back[last]
+            if cost > limit:
+                routes.append(tour[first:last])
+                first = last
+        routes.append(tour[first:])
+        return routes
+
+    low = int((out + back).max())
+    high = int(out[0] + legs[-1] + back[-1])
+    while low < high:
+        middle = (low + high) // 2
+        if len(split(middle)) <= num_vehicles:
+            high = middle
+        else:
+            low = middle + 1
+    return split(low)
+
+
+def improve_route(matrix, route, depot=0):
+    """Returns ``route`` improved on the submatrix of its stops and the depot."""
+    nodes = np.concatenate([[depot], route]).astype(np.intp)
+    local = matrix[np.ix_(nodes, nodes)]
+    path = np.concatenate([np.arange(len(nodes)), [0]])
+    return nodes[improve_path(local, path)[1:-1]]
+
+
+def solve(matrix, num_vehicles=1, depot=0):
+    """Returns the stops visited by each of ``num_vehicles``, without the
+    depot, for the dense distance ``matrix``.
+    """
+    matrix = np.asarray(matrix, dtype=np.int64)
+    stops = np.delete(np.arange(len(matrix)), depot)
+    if len(stops) == 0:
+        return [[] for _ in range(num_vehicles)]
+    tour = improve_route(matrix, nearest_neighbour_tour(matrix, stops, depot), depot)
+    routes = [
+        improve_route(matrix, route, depot)
+        for route in split_tour(matrix, tour, num_vehicles, depot)
+    ]
+    routes += [np.empty(0, dtype=np.intp)] * (num_vehicles - len(routes))
+    return [route.tolist() for route in routes]
@@ -0,0 +1,203 @@
+"""Background solve jobs, run on a bounded pool of worker processes.
+
+The pool has ROUTE_JOB_WORKERS processes next to the solver executor's and
+admits at most ROUTE_JOB_QUEUE_SIZE more jobs than it has workers, further
+submissions are rejected with SolverBusy so that the view can answer 429.
+"""
+
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import transaction
+
+from traveller.cache import get_distance_matrix_cache
+from traveller.constant import JOB_PROGRESS_INTERVAL
+from traveller.edges import get_edge_store
+from traveller.executor import SolverBusy
+from traveller.matrixfile import MappedMatrix, mapped_transit
+from traveller.models import SolveJob
+from traveller.payloads import decode_request
+from traveller.utils import route_finder_from_request, sparse_neighbors
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    django.setup()
+
+
+class JobPool:
+    """The process pool shared by all jobs of this web worker, admitting at
+    most ``workers + queue_size`` unfinished jobs.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.capacity = threading.BoundedSemaphore(workers + queue_size)
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.average_duration = 1.0
+
+    def retry_after(self):
+        """Estimated seconds until a queue slot frees up."""
+        with self.lock:
+            return max(
+                1, math.ceil(self.average_duration * self.pending / self.workers)
+            )
+
+    def admit(self):
+        """Takes a slot for a job, raises SolverBusy when the queue is full."""
+        if not self.capacity.acquire(blocking=False):
+            raise SolverBusy(self.retry_after())
+        with self.lock:
+            self.pending += 1
+
+    def release(self, started):
+        with self.lock:
+            self.pending -= 1
+            duration = time.monotonic() - started
+            self.average_duration = 0.8 * self.average_duration + 0.2 * duration
+        self.capacity.release()
+
+    def submit(self, job_id):
+        """Runs an admitted job, releasing its slot once it finished."""
+        started = time.monotonic()
+        try:
+            future = self.executor.submit(run_solve_job, job_id)
+        except BaseException:
+            self.release(started)
+            raise
+        future.add_done_callback(lambda future: self.release(started))
+        return future
+
+
+def get_job_pool():
+    """Returns the job pool of this web worker, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = JobPool(settings.ROUTE_JOB_WORKERS, settings.ROUTE_JOB_QUEUE_SIZE)
+    return _pool
+
+
+def submit_job(problem):
+    """Stores a route request payload as a queued job and hands it to the pool
+    once the job row is committed.
+
+    Raises SolverBusy when the pool's queue is full.
+    """
+    pool = get_job_pool()
+    pool.admit()
+    try:
+        job = SolveJob.objects.create(problem=problem)
+    except BaseException:
+        pool.release(time.monotonic())
+        raise
+    transaction.on_commit(lambda: pool.submit(job.pk))
+    return job
+
+
+def fail_stale_jobs():
+    """Marks the jobs left queued or running by stopped web workers as
+    failed, their futures died with them. Returns how many there were.
+
+    Only safe while no web worker runs, before the server starts.
+    """
+    return SolveJob.objects.filter(
+        status__in=[SolveJob.QUEUED, SolveJob.RUNNING]
+    ).update(
+        status=SolveJob.FAILED,
+        error="Interrupted by a server restart, submit the job again",
+    )
+
+
+class JobProgress:
+    """Solution callback recording the best objective of a running job.
+
+    Writes are throttled to one every JOB_PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.started = time.monotonic()
+        self.time_limit = None
+        self.solutions_found = 0
+        self.best_objective = None
+        self.last_write = 0
+
+    def progress(self):
+        if not self.time_limit:
+            return 0
+        return min((time.monotonic() - self.started) / self.time_limit, 1)
+
+    def __call__(self, objective):
+        self.solutions_found += 1
+        if self.best_objective is None or objective < self.best_objective:
+            self.best_objective = objective
+        now = time.monotonic()
+        if now - self.last_write < JOB_PROGRESS_INTERVAL:
+            return
+        self.last_write = now
+        SolveJob.objects.filter(pk=self.job_id).update(
+            progress=self.progress(),
+            solutions_found=self.solutions_found,
+            best_objective=self.best_objective,
+        )
+
+
+def run_solve_job(job_id):
+    """Solves a stored job and persists its result, runs in a pool worker."""
+    job = SolveJob.objects.get(pk=job_id)
+    job.status = SolveJob.RUNNING
+    job.save(update_fields=["status", "updated_at"])
+
+    progress = JobProgress(job_id)
+    try:
+        data = decode_request(job.problem)
+        if isinstance(data.get("time_matrix"), MappedMatrix):
+            # The view keeps the mapping open until the solve drops it.
+            data = mapped_transit(
+                dict(data, time_matrix=data["time_matrix"].attach()[1])
+            )
+        neighbors = sparse_neighbors(
+            data, settings.ROUTE_SPARSE_THRESHOLD, settings.ROUTE_SPARSE_NEIGHBORS
+        )
+        if neighbors:
+            data = dict(data, sparse_neighbors=neighbors)
+        problem = route_finder_from_request(
+            data,
+            settings.ROUTE_SEARCH_BUDGETS,
+            matrix_cache=get_distance_matrix_cache(),
+            edge_store=get_edge_store(),
+            solution_callback=progress,
+        )
+        if problem is None:
+            raise ValueError("No Solution Found")
+        route, solve = problem
+        progress.time_limit = route.search_parameters.time_limit.ToMilliseconds() / 1000
+        job.result = solve()
+        job.status = SolveJob.SUCCEEDED
+    except Exception as e:
+        logging.info(
+            {"message": "error occur while solving job {} is {}".format(job_id, e)}
+        )
+        job.error = str(e)
+        job.status = SolveJob.FAILED
+
+    job.progress = 1
+    job.solutions_found = progress.solutions_found
+    job.best_objective = progress.best_objective
+    job.save()
+    return job.status
@@ -0,0 +1,138 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from traveller.benchmark import (
+    DEFAULT_SIZES,
+    KINDS,
+    PHASES,
+    VRPTW_MAX_STOPS,
+    compare,
+    instance_name,
+    run_instance,
+    tier_supports,
+)
+from traveller.utils import TIERS
+
+
+def comma_separated(cast):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+def relative(result, solver):
+    """Objective and total time of ``result`` relative to the solver run."""
+    if not solver or not solver["objective"] or result["objective"] is None:
+        return ""
+    return " vs solver: objective {:+.1%}, time x{:.2f}".format(
+        result["objective"] / solver["objective"] - 1,
+        result["total"] / solver["total"],
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Solves seeded TSP, VRP and VRPTW instances with every tier, reports the "
+        "time of every phase and fails when latency or objective regress from a "
+        "baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kinds", type=comma_separated(str), default=list(KINDS))
+        parser.add_argument(
+            "--sizes", type=comma_separated(int), default=list(DEFAULT_SIZES)
+        )
+        parser.add_argument("--tiers", type=comma_separated(str), default=list(TIERS))
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--time-limit",
+            type=float,
+            help="Solver seconds per instance instead of ROUTE_SEARCH_BUDGETS.",
+        )
+        parser.add_argument("--baseline", help="JSON baseline to compare with.")
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Write the results to --baseline instead of comparing.",
+        )
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+        parser.add_argument(
+            "--latency-tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed growth of the total time, as a fraction.",
+        )
+        parser.add_argument(
+            "--objective-tolerance",
+            type=float,
+            default=0.01,
+            help="Allowed growth of the objective, as a fraction.",
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options["kinds"]) - set(KINDS)
+        if unknown:
+            raise CommandError("Unknown kinds {}".format(", ".join(sorted(unknown))))
+        unknown = set(options["tiers"]) - set(TIERS)
+        if unknown:
+            raise CommandError("Unknown tiers {}".format(", ".join(sorted(unknown))))
+        if options["save_baseline"] and not options["baseline"]:
+            raise CommandError("--save-baseline needs --baseline")
+
+        search_budgets = settings.ROUTE_SEARCH_BUDGETS
+        if options["time_limit"]:
+            search_budgets = [
+                dict(tier, time_limit=options["time_limit"]) for tier in search_budgets
+            ]
+
+        results = {}
+        for kind in options["kinds"]:
+            for stops in options["sizes"]:
+                if kind == "vrptw" and stops > VRPTW_MAX_STOPS:
+                    continue
+                for tier in options["tiers"]:
+                    if not tier_supports(kind, stops, tier):
+                        continue
+                    name = instance_name(kind, stops, options["seed"], tier)
+                    result = run_instance(
+                        kind, stops, options["seed"], search_budgets, tier
+                    )
+                    results[name] = result
+                    solver = results.get(instance_name(kind, stops, options["seed"]))
+                    self.stdout.write(
+                        "{:<23} objective {:>12} {} total {:.3f}s{}".format(
+                            name,
+                            str(result["objective"]),
+                            " ".join(
+                                "{} {:.3f}s".format(phase, result["timings"][phase])
+                                for phase in PHASES
+                            ),
+                            result["total"],
+                            relative(result, solver) if tier != "solver" else "",
+                        )
+                    )
+
+        if options["output"]:
+            self.write(options["output"], results)
+        if options["save_baseline"]:
+            self.write(options["baseline"], results)
+            self.stdout.write(self.style.SUCCESS("Saved baseline"))
+            return
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)["results"]
+            regressions = compare(
+                results,
+                baseline,
+                options["latency_tolerance"],
+                options["objective_tolerance"],
+            )
+            if regressions:
+                raise CommandError(
+                    "Regressed from the baseline:\n" + "\n".join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS("No regression"))
+
+    def write(self, path, results):
+        with open(path, "w") as f:
+            json.dump({"results": results}, f, indent=2)
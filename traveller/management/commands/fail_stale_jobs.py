@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from traveller.jobs import fail_stale_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Marks the solve jobs left queued or running by a previous run of the "
+        "server as failed. Run it before the server starts."
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write("{} stale jobs marked failed".format(fail_stale_jobs()))
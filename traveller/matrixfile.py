@@ -0,0 +1,199 @@
+"""On-disk int32 matrices read back through ``mmap``.
+
+A matrix file is a 32 byte header followed by the row-major little endian
+int32 cells, meters for distances and minutes for uploaded times. Files are written in
+row blocks so the full matrix is never held in memory, and every process that
+maps one shares the same page cache copy. Uploaded matrices are kept as such
+files in ROUTE_MATRIX_UPLOAD_DIR, named after their content.
+"""
+
+import hashlib
+import mmap
+import os
+import re
+import struct
+import tempfile
+
+import numpy as np
+from django.conf import settings
+
+from traveller.utils import haversine_matrix
+
+MAGIC = b"TSPM"
+VERSION = 1
+UNITS = ("meters", "seconds", "minutes")
+# Magic, version, unit, rows, columns, padded to keep the cells aligned.
+HEADER = struct.Struct("<4sHHQQ8x")
+CELL = np.dtype("<i4")
+
+
+def write_matrix_file(path, blocks, shape, unit="meters"):
+    """Writes the int32 row ``blocks`` of a ``shape`` matrix to ``path``."""
+    rows, columns = shape
+    directory = os.path.dirname(os.path.abspath(path))
+    # Write then rename so readers never map a partial file.
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, UNITS.index(unit), rows, columns))
+            written = 0
+            for block in blocks:
+                block = np.ascontiguousarray(block, dtype=CELL)
+                if block.ndim != 2 or block.shape[1] != columns:
+                    raise ValueError(
+                        "Row block does not match {} columns".format(columns)
+                    )
+                f.write(block.tobytes())
+                written += len(block)
+        if written != rows:
+            raise ValueError("Wrote {} rows, expected {}".format(written, rows))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def haversine_blocks(coordinate_list, chunk_size):
+    """Yields the distance matrix of ``coordinate_list`` ``chunk_size`` rows at
+    a time.
+    """
+    coordinates = np.asarray(coordinate_list, dtype=np.float64).reshape(-1, 2)
+    for start in range(0, len(coordinates), chunk_size):
+        yield haversine_matrix(coordinates[start : start + chunk_size], coordinates)
+
+
+def read_header(mapping):
+    magic, version, unit, rows, columns = HEADER.unpack_from(mapping)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a version {} matrix file".format(VERSION))
+    return UNITS[unit], (rows, columns)
+
+
+def open_matrix_file(path):
+    """Maps the matrix file at ``path`` read-only.
+
+    Returns the mmap, the unit and the read-only int32 view of the cells. The
+    view must be deleted before the mmap is closed.
+    """
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        unit, shape = read_header(mapping)
+        view = np.frombuffer(
+            mapping, dtype=CELL, count=shape[0] * shape[1], offset=HEADER.size
+        ).reshape(shape)
+    except (ValueError, struct.error):
+        mapping.close()
+        raise
+    return mapping, unit, view
+
+
+class MappedMatrix:
+    """A matrix file, removed on release when ``owned`` by the process that
+    wrote it.
+
+    Pickles as its path only, so worker processes map the same file. Offers
+    the attach/release interface of SharedMatrix.
+    """
+
+    def __init__(self, path, owned=True):
+        self.path = path
+        self.owned = owned
+
+    @classmethod
+    def from_coordinates(cls, coordinate_list, directory=None, chunk_size=512):
+        """Streams the distance matrix of ``coordinate_list`` to a new file."""
+        fd, path = tempfile.mkstemp(dir=directory, suffix=".tspm")
+        os.close(fd)
+        size = len(coordinate_list)
+        try:
+            write_matrix_file(
+                path, haversine_blocks(coordinate_list, chunk_size), (size, size)
+            )
+        except BaseException:
+            os.unlink(path)
+            raise
+        return cls(path)
+
+    def shape(self):
+        """Reads the shape of the matrix from the file header."""
+        with open(self.path, "rb") as f:
+            return read_header(f.read(HEADER.size))[1]
+
+    def attach(self):
+        """Maps the file, returns the mmap and the matrix view."""
+        mapping, unit, view = open_matrix_file(self.path)
+        return mapping, view
+
+    def release(self):
+        if self.owned:
+            os.unlink(self.path)
+
+
+def mapped_transit(data):
+    """Returns the route payload ``data`` of a mapped matrix with the
+    "callback" transit mode unless it asks for one. The callback reads the
+    cells from the shared page cache where "matrix" copies every one of them.
+    """
+    return dict(data, transit_mode=data.get("transit_mode") or "callback")
+
+
+def uploaded_matrix_path(matrix_id):
+    if not re.fullmatch(r"[0-9a-f]{64}", str(matrix_id)):
+        raise ValueError("Invalid matrix id {}".format(matrix_id))
+    return os.path.join(settings.ROUTE_MATRIX_UPLOAD_DIR, "{}.tspm".format(matrix_id))
+
+
+def validate_time_matrix(matrix):
+    """Returns ``matrix`` as an integer array, integer arrays as they are.
+
+    Raises ValueError unless it is square and its cells are whole numbers
+    from 0 to the int32 maximum, as the solver and matrix files take them.
+    """
+    try:
+        matrix = np.asarray(matrix)
+    except ValueError:
+        raise ValueError("Matrix rows must all have the same length")
+    if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1]:
+        raise ValueError("Matrix must be a square 2D array")
+    if not (
+        np.issubdtype(matrix.dtype, np.integer)
+        or np.issubdtype(matrix.dtype, np.floating)
+    ):
+        raise ValueError("Matrix must hold numbers")
+    if np.issubdtype(matrix.dtype, np.floating):
+        if not (np.isfinite(matrix).all() and (matrix == np.floor(matrix)).all()):
+            raise ValueError("Matrix cells must be whole numbers")
+        matrix = matrix.astype(np.int64)
+    if matrix.size and (matrix.min() < 0 or matrix.max() > np.iinfo(CELL).max):
+        raise ValueError(
+            "Matrix cells must be between 0 and {}".format(np.iinfo(CELL).max)
+        )
+    return matrix
+
+
+def save_uploaded_matrix(matrix):
+    """Stores an uploaded square time matrix and returns its id, the sha256
+    of its shape and int32 cells.
+
+    The solver takes the cells as they are, in the unit of the time windows
+    they are sent with, minutes in this API. Raises ValueError for cells
+    that are not whole numbers from 0 to the int32 maximum.
+    """
+    cells = np.ascontiguousarray(validate_time_matrix(matrix), dtype=CELL)
+    digest = hashlib.sha256(np.asarray(cells.shape, dtype="<u8").tobytes())
+    digest.update(cells.data)
+    matrix_id = digest.hexdigest()
+    path = uploaded_matrix_path(matrix_id)
+    if not os.path.exists(path):
+        os.makedirs(settings.ROUTE_MATRIX_UPLOAD_DIR, exist_ok=True)
+        write_matrix_file(path, [cells], cells.shape, "minutes")
+    return matrix_id
+
+
+def uploaded_matrix(matrix_id):
+    """Returns the MappedMatrix of an uploaded matrix, which release keeps."""
+    path = uploaded_matrix_path(matrix_id)
+    if not os.path.exists(path):
+        raise ValueError("Unknown matrix id {}".format(matrix_id))
+    return MappedMatrix(path, owned=False)
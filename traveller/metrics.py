@@ -0,0 +1,166 @@
+"""Route solve metrics in the Prometheus text format.
+
+Every solved request is recorded into the histograms and counters below,
+which /metrics renders. They live in the memory of each web worker process,
+so every process is scraped on its own.
+"""
+
+import math
+import threading
+from collections import defaultdict
+
+from ortools.constraint_solver import routing_enums_pb2
+
+PHASES = (
+    "parse",
+    "matrix",
+    "queue",
+    "model",
+    "prune",
+    "bound",
+    "solve",
+    "response",
+)
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+STOPS_BUCKETS = (10, 50, 100, 500, 1000, 5000, 10000, 20000)
+VEHICLES_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+OBJECTIVE_BUCKETS = tuple(10**power for power in range(3, 11))
+
+
+def solver_status(routing):
+    """Returns the name of the routing model's search status."""
+    return routing_enums_pb2.RoutingSearchStatus.Value.Name(routing.status())
+
+
+def format_labels(labels):
+    return ",".join('{}="{}"'.format(name, value) for name, value in labels)
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.labels = labels
+        self.counts = defaultdict(lambda: [0] * len(self.buckets))
+        self.sums = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            counts = self.counts[label_values]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.sums[label_values] += value
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        with self.lock:
+            for label_values, counts in sorted(self.counts.items()):
+                labels = list(zip(self.labels, label_values))
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(
+                        "{}_bucket{{{}}} {}".format(
+                            self.name,
+                            format_labels(labels + [("le", format_value(bound))]),
+                            count,
+                        )
+                    )
+                suffix = "{{{}}}".format(format_labels(labels)) if labels else ""
+                lines.append(
+                    "{}_sum{} {}".format(
+                        self.name, suffix, format_value(self.sums[label_values])
+                    )
+                )
+                lines.append("{}_count{} {}".format(self.name, suffix, counts[-1]))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self.lock:
+            self.values[label_values] += 1
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} counter".format(self.name),
+        ]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                labels = format_labels(zip(self.labels, label_values))
+                lines.append("{}{{{}}} {}".format(self.name, labels, value))
+        return lines
+
+
+PHASE_SECONDS = Histogram(
+    "route_phase_seconds",
+    "Seconds spent in each phase of a route solve.",
+    SECONDS_BUCKETS,
+    ("problem", "phase"),
+)
+STOPS = Histogram(
+    "route_stops", "Stops per solved route request.", STOPS_BUCKETS, ("problem",)
+)
+VEHICLES = Histogram(
+    "route_vehicles",
+    "Vehicles per solved route request.",
+    VEHICLES_BUCKETS,
+    ("problem",),
+)
+OBJECTIVE = Histogram(
+    "route_objective",
+    "Objective of the returned solutions.",
+    OBJECTIVE_BUCKETS,
+    ("problem",),
+)
+SOLVES = Counter(
+    "route_solves_total",
+    "Route solves by problem type and solver status.",
+    ("problem", "status"),
+)
+REGISTRY = (PHASE_SECONDS, STOPS, VEHICLES, OBJECTIVE, SOLVES)
+
+
+def record(metrics):
+    """Adds the metrics of one solve, as RouteFinder.metrics returns them."""
+    problem = metrics["problem"]
+    for phase, seconds in metrics["phases"].items():
+        PHASE_SECONDS.observe(seconds, problem, phase)
+    STOPS.observe(metrics["stops"], problem)
+    VEHICLES.observe(metrics["vehicles"], problem)
+    if metrics["objective"] is not None:
+        OBJECTIVE.observe(metrics["objective"], problem)
+    SOLVES.inc(problem, metrics["status"])
+
+
+def render():
+    """Returns every metric in the Prometheus text exposition format."""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+def server_timing(metrics):
+    """Returns the phases of ``metrics`` as a Server-Timing header value."""
+    return ", ".join(
+        "{};dur={:.1f}".format(phase, metrics["phases"][phase] * 1000)
+        for phase in PHASES
+        if phase in metrics["phases"]
+    )
@@ -0,0 +1,82 @@
+"""Decompression of gzip and zstd encoded request bodies."""
+
+import gzip
+import io
+import zlib
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DECODE_ERRORS = (OSError, EOFError, zlib.error) + (
+    (zstandard.ZstdError,) if zstandard is not None else ()
+)
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+def read_limited(stream, limit):
+    """Reads ``stream`` to the end, raising RequestTooLarge past ``limit``
+    bytes.
+    """
+    chunks = []
+    size = 0
+    while True:
+        chunk = stream.read(min(1 << 20, limit + 1 - size))
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            raise RequestTooLarge()
+
+
+def decompressing_reader(request, encoding):
+    """Returns a reader of the decoded body, or ``None`` for an unsupported
+    ``Content-Encoding``.
+    """
+    if encoding in ("gzip", "x-gzip"):
+        return gzip.GzipFile(fileobj=request, mode="rb")
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(request)
+    return None
+
+
+class DecompressRequestMiddleware(MiddlewareMixin):
+    """Replaces gzip or zstd encoded request bodies by their decoded bytes, at
+    most ROUTE_MAX_REQUEST_BYTES of them.
+
+    A MiddlewareMixin so that async views stay async under ASGI.
+    """
+
+    def process_request(self, request):
+        encoding = request.META.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+        if encoding and encoding != "identity":
+            reader = decompressing_reader(request, encoding)
+            if reader is None:
+                return JsonResponse(
+                    {"message": "Unsupported Content-Encoding {}".format(encoding)},
+                    status=415,
+                )
+            try:
+                body = read_limited(reader, settings.ROUTE_MAX_REQUEST_BYTES)
+            except RequestTooLarge:
+                return JsonResponse(
+                    {"message": "Decoded request body is too large"}, status=413
+                )
+            except DECODE_ERRORS:
+                return JsonResponse(
+                    {"message": "Request body is not valid {}".format(encoding)},
+                    status=400,
+                )
+            request._stream = io.BytesIO(body)
+            request._read_started = False
+            request.META["CONTENT_LENGTH"] = str(len(body))
+            del request.META["HTTP_CONTENT_ENCODING"]
@@ -1,3 +1,34 @@
+import uuid
+
 from django.db import models
 
-# Create your models here.
+
+class SolveJob(models.Model):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    problem = models.JSONField()
+    # Fraction of the search time limit spent so far, 1 once finished.
+    progress = models.FloatField(default=0)
+    solutions_found = models.PositiveIntegerField(default=0)
+    best_objective = models.BigIntegerField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return "{} ({})".format(self.id, self.status)
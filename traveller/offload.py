@@ -0,0 +1,176 @@
+"""Solving from an event loop, for the async route endpoint served over ASGI.
+
+A request awaiting its solve holds no thread: the solve runs on the solver
+executor and the coroutine only waits on its future. Submitting, which
+computes and shares the matrices, runs on a thread of the loop's default
+executor so a large request does not hold up the others. Requests of the loop
+beyond the executor's capacity wait for a free slot on the loop instead of
+being answered 429. A solve whose request times out or whose task is
+cancelled, as CancelOnDisconnect does when the client goes away, is stopped
+through its SharedStop so the worker moves on.
+"""
+
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+
+from traveller.executor import SharedStop
+
+# One semaphore per event loop, an asyncio semaphore only serves the loop it
+# was first used on.
+_slots = weakref.WeakKeyDictionary()
+
+
+def solver_slots():
+    """Returns the semaphore bounding the solves the running loop submits at
+    once to the executor's workers and queue.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _slots:
+        _slots[loop] = asyncio.Semaphore(
+            settings.ROUTE_SOLVER_WORKERS + settings.ROUTE_SOLVER_QUEUE_SIZE
+        )
+    return _slots[loop]
+
+
+async def solve_offloaded(submit, timeout):
+    """Returns the response of ``submit(stop)``, a SolverExecutor.submit
+    future solving until the SharedStop ``stop``, or ``None`` when it
+    describes no problem.
+
+    After ``timeout`` seconds, waiting for a slot included, the solve is
+    stopped and asyncio.TimeoutError raised. Cancelling the awaiting task
+    stops it as well. SolverBusy and ValueError of ``submit`` are raised.
+    """
+    stop = submitted = None
+
+    async def solve():
+        nonlocal stop, submitted
+        async with solver_slots():
+            # Created once admitted, waiting requests hold no shared memory.
+            stop = SharedStop()
+            submitted = asyncio.get_running_loop().run_in_executor(None, submit, stop)
+            # Cancelling the wait must not cancel the submission or the
+            # executor's future, the solve only ends through the stop.
+            future = await asyncio.shield(submitted)
+            if future is None:
+                return None
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+    try:
+        return await asyncio.wait_for(solve(), timeout)
+    except BaseException:
+        if stop is not None:
+            stop.set()
+        raise
+    finally:
+        if submitted is not None:
+            submitted.add_done_callback(
+                lambda submitted: release_after_solve(submitted, stop)
+            )
+        elif stop is not None:
+            stop.release()
+
+
+def release_after_solve(submitted, stop):
+    """Releases ``stop`` once the solve whose future ``submitted`` resolved
+    to has ended, at once when nothing was submitted.
+    """
+    if submitted.cancelled() or submitted.exception() is not None:
+        future = None
+    else:
+        future = submitted.result()
+    if future is None:
+        stop.release()
+    else:
+        # The worker reads the flag until its solve returns.
+        future.add_done_callback(lambda future: stop.release())
+
+
+class CancelOnDisconnect:
+    """ASGI middleware cancelling the handling of an HTTP request when its
+    client disconnects.
+
+    The request body is read up front and replayed to ``app``, then the
+    connection is watched for the disconnect message while ``app`` runs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        messages = []
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] == "http.disconnect":
+                return
+            if not message.get("more_body", False):
+                break
+        disconnect = asyncio.ensure_future(receive())
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            return await asyncio.shield(disconnect)
+
+        handler = asyncio.ensure_future(self.app(scope, replay, send))
+        await asyncio.wait({handler, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        if handler.done():
+            disconnect.cancel()
+            return handler.result()
+        handler.cancel()
+        try:
+            await handler
+        except asyncio.CancelledError:
+            pass
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """Django's ASGI handler, sending the ``async_content`` of a streaming
+    response, an async iterable such as a SolutionStream, from the event loop.
+
+    Django 3.2 iterates streaming responses synchronously on the loop, which
+    a stream waiting on a solve would block.
+    """
+
+    async def send_response(self, response, send):
+        content = getattr(response, "async_content", None)
+        if content is None:
+            return await super().send_response(response, send)
+        headers = [
+            (header.encode("ascii"), value.encode("latin1"))
+            for header, value in response.items()
+        ]
+        headers.extend(
+            (b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+            for cookie in response.cookies.values()
+        )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": headers,
+            }
+        )
+        parts = content.__aiter__()
+        try:
+            async for part in parts:
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": response.make_bytes(part),
+                        "more_body": True,
+                    }
+                )
+            await send({"type": "http.response.body"})
+        finally:
+            # Cancelled while sending, the stream still has to end.
+            await parts.aclose()
+            await sync_to_async(response.close, thread_sensitive=True)()
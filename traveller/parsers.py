@@ -0,0 +1,18 @@
+"""Request parsers beyond the rest_framework defaults."""
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from traveller.payloads import npy_view
+
+
+class NpyParser(BaseParser):
+    """Parses a raw ``.npy`` body into an array viewing the body bytes."""
+
+    media_type = "application/x-npy"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return npy_view(stream.read() if stream is not None else b"")
+        except ValueError as e:
+            raise ParseError(str(e))
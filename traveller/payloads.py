@@ -0,0 +1,110 @@
+"""Compact encodings of the matrices of a route request.
+
+Besides nested JSON lists, "time_matrix" may be given as
+
+    {"encoding": "base64", "shape": [n, n], "data": "..."}  raw little endian int32
+    {"encoding": "npy", "data": "..."}                      a base64 ``.npy`` file
+    {"matrix_id": "..."}                                    a matrix uploaded before
+
+The decoded arrays are views of the decoded bytes, uploaded matrices are
+memory-mapped where they are used. Every form is validated as uploads are,
+see validate_time_matrix.
+"""
+
+import base64
+import binascii
+import io
+import math
+
+import numpy as np
+
+from traveller.matrixfile import (
+    CELL,
+    MappedMatrix,
+    uploaded_matrix,
+    validate_time_matrix,
+)
+
+
+def npy_view(buffer):
+    """Returns the array of the ``.npy`` bytes ``buffer`` as a view into it."""
+    stream = io.BytesIO(buffer)
+    try:
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    except ValueError as e:
+        raise ValueError("Invalid npy data: {}".format(e))
+    if dtype.hasobject:
+        raise ValueError("npy object arrays are not supported")
+    count = math.prod(shape)
+    if len(buffer) - stream.tell() != count * dtype.itemsize:
+        raise ValueError("npy data does not match its shape {}".format(shape))
+    return np.frombuffer(
+        buffer, dtype=dtype, count=count, offset=stream.tell()
+    ).reshape(shape, order="F" if fortran_order else "C")
+
+
+def decode_matrix(value):
+    """Decodes one matrix of a route request, see the module docstring.
+
+    Lists are returned untouched. Raises ValueError for a malformed encoding.
+    """
+    if not isinstance(value, dict):
+        return value
+    if "matrix_id" in value:
+        return uploaded_matrix(value["matrix_id"])
+
+    encoding = value.get("encoding")
+    if encoding not in ("base64", "npy"):
+        raise ValueError("Unknown matrix encoding {}".format(encoding))
+    try:
+        data = base64.b64decode(value["data"], validate=True)
+    except (KeyError, TypeError, binascii.Error):
+        raise ValueError("Matrix data must be base64")
+
+    if encoding == "npy":
+        matrix = npy_view(data)
+    else:
+        shape = value.get("shape")
+        if (
+            not isinstance(shape, list)
+            or len(shape) != 2
+            or not all(isinstance(size, int) and size >= 0 for size in shape)
+        ):
+            raise ValueError("base64 matrices need a [rows, columns] shape")
+        if len(data) != shape[0] * shape[1] * CELL.itemsize:
+            raise ValueError("Matrix data does not match its shape {}".format(shape))
+        matrix = np.frombuffer(data, dtype=CELL).reshape(shape)
+
+    return validate_time_matrix(matrix)
+
+
+def decode_request(data):
+    """Returns route request ``data`` with its encoded matrices decoded.
+
+    Raises ValueError for a time matrix validate_time_matrix rejects or whose
+    size differs from the number of time windows.
+    """
+    time_matrix = data.get("time_matrix")
+    if isinstance(time_matrix, dict):
+        time_matrix = decode_matrix(time_matrix)
+        data = dict(data, time_matrix=time_matrix)
+    elif isinstance(time_matrix, list) and time_matrix:
+        validate_time_matrix(time_matrix)
+    time_windows = data.get("time_windows")
+    if time_matrix is None or not isinstance(time_windows, list) or not time_windows:
+        return data
+    if isinstance(time_matrix, MappedMatrix):
+        size = time_matrix.shape()[0]
+    else:
+        size = len(time_matrix)
+    if size and size != len(time_windows):
+        raise ValueError(
+            "time_matrix has {} stops but time_windows {}".format(
+                size, len(time_windows)
+            )
+        )
+    return data
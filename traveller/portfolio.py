@@ -0,0 +1,136 @@
+"""Portfolio solving: one payload searched with several strategies at once.
+
+Every member overrides the first solution strategy and metaheuristic of the
+request's search budget and runs on its own solver worker. The members share
+a SharedStop, so they all end at the request's time limit or deadline,
+whichever comes first, or as soon as one of them reaches the target objective
+or target gap, and the best solution is kept.
+"""
+
+import time
+
+from traveller.executor import SharedStop, submit_when_free
+from traveller.utils import default_search_budget, derives_time_matrix, request_flag
+
+STRATEGY_FIELDS = ("first_solution_strategy", "local_search_metaheuristic")
+
+
+def problem_stops(data):
+    """Stops of the problem ``data`` describes, 0 when it describes none."""
+    time_matrix = data.get("time_matrix")
+    if time_matrix is not None and len(time_matrix) and data.get("time_windows"):
+        return len(time_matrix)
+    if derives_time_matrix(data) or (
+        data.get("list_cord") and data.get("num_vehicles")
+    ):
+        return len(data["list_cord"])
+    return 0
+
+
+def portfolio_members(data, default_members):
+    """Returns the search budgets of the portfolio a route payload asks for,
+    ``default_members`` for "portfolio": true, or ``None`` without one.
+    """
+    value = data.get("portfolio", False)
+    if isinstance(value, list):
+        return value or None
+    return default_members if request_flag(data, "portfolio", False) else None
+
+
+class Portfolio:
+    """Solves ``data`` once per member of ``members``, search budget fields
+    naming a strategy and metaheuristic.
+
+    ``submit`` takes a payload and a SharedStop and returns the future of its
+    response, as SolverExecutor.submit does with the search budgets bound.
+    ``deadline`` is the time.time() by which the members end at the latest.
+    """
+
+    def __init__(
+        self,
+        data,
+        submit,
+        members,
+        search_budgets,
+        target_objective=None,
+        deadline=None,
+    ):
+        self.data = data
+        self.submit = submit
+        self.stops = problem_stops(data)
+        if not members or not all(isinstance(member, dict) for member in members):
+            raise ValueError("portfolio must be a list of search budgets")
+        self.members = [
+            {field: member[field] for field in STRATEGY_FIELDS if field in member}
+            for member in members
+        ]
+        budget = default_search_budget(
+            search_budgets, self.stops, data.get("search_budget")
+        )
+        self.time_limit = budget.get("time_limit")
+        if not self.time_limit:
+            raise ValueError("portfolio requires a time_limit")
+        self.target_objective = target_objective
+        self.deadline = deadline
+
+    def payload(self, member):
+        payload = {
+            key: value
+            for key, value in self.data.items()
+            if key not in ("portfolio", "target_objective")
+        }
+        payload["search_budget"] = dict(self.data.get("search_budget") or {}, **member)
+        return payload
+
+    def solve(self):
+        """Returns the best member's response, with a "portfolio" report of
+        the winning strategy and the outcome of every member, and the
+        metrics of every member. Returns ``None`` when the payload describes
+        no problem.
+        """
+        if not self.stops:
+            return None
+        deadline = time.time() + float(self.time_limit)
+        if self.deadline is not None:
+            deadline = min(deadline, self.deadline)
+        stop = SharedStop(deadline=deadline, target_objective=self.target_objective)
+        pending = []
+        try:
+            futures = [
+                submit_when_free(
+                    lambda member=member: self.submit(self.payload(member), stop),
+                    pending,
+                )
+                for member in self.members
+            ]
+            responses = [future.result() for future in futures]
+        finally:
+            # After a failure the others stop early, the flag stays until
+            # they all ended.
+            stop.set()
+            for future in pending:
+                future.exception()
+            stop.release()
+
+        outcomes = [
+            dict(
+                member,
+                objective=response["metrics"]["objective"],
+                status=response["metrics"]["status"],
+            )
+            for member, response in zip(self.members, responses)
+        ]
+        solved = [
+            index
+            for index, outcome in enumerate(outcomes)
+            if outcome["objective"] is not None
+        ]
+        if not solved:
+            response = dict(responses[0])
+            winner = None
+        else:
+            best = min(solved, key=lambda index: outcomes[index]["objective"])
+            response = dict(responses[best])
+            winner = self.members[best]
+        response["portfolio"] = {"winner": winner, "members": outcomes}
+        return response, [response["metrics"] for response in responses]
@@ -0,0 +1,33 @@
+"""Response renderers beyond the rest_framework defaults."""
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renders responses as MessagePack, ``Accept: application/msgpack``."""
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, use_bin_type=True)
+
+
+def route_renderer_classes():
+    """Returns the default renderers, plus MessagePack when msgpack is
+    installed.
+    """
+    renderers = list(api_settings.DEFAULT_RENDERER_CLASSES)
+    if msgpack is not None:
+        renderers.append(MessagePackRenderer)
+    return renderers
@@ -0,0 +1,21 @@
+from rest_framework import serializers
+
+from traveller.models import SolveJob
+
+
+class SolveJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.UUIDField(source="id", read_only=True)
+
+    class Meta:
+        model = SolveJob
+        fields = [
+            "job_id",
+            "status",
+            "progress",
+            "solutions_found",
+            "best_objective",
+            "result",
+            "error",
+            "created_at",
+            "updated_at",
+        ]
@@ -0,0 +1,70 @@
+"""Travel time matrices derived from the stops' distances and a speed profile.
+
+A time window payload can send "speed_profile" with its "list_cord" instead
+of a "time_matrix". The profile gives a "speed" in km/h for every vehicle or
+"vehicle_speeds", one per vehicle, and optionally "time_of_day", a list of
+[start_minute, multiplier] pairs scaling the travel times from that minute
+on. Time matrices are static, so an arc takes the multiplier in effect when
+the time window of the stop it leaves opens. Times are whole minutes,
+rounded up.
+"""
+
+import numpy as np
+
+
+def vehicle_speeds(speed_profile, num_vehicles):
+    """Returns the speed of every vehicle in km/h."""
+    if not isinstance(speed_profile, dict):
+        raise ValueError("speed_profile must be an object")
+    speeds = speed_profile.get("vehicle_speeds")
+    if speeds is None:
+        if speed_profile.get("speed") is None:
+            raise ValueError("speed_profile requires speed or vehicle_speeds")
+        speeds = [speed_profile["speed"]] * num_vehicles
+    speeds = np.asarray(speeds, dtype=np.float64)
+    if speeds.shape != (num_vehicles,):
+        raise ValueError("vehicle_speeds must give one speed per vehicle")
+    if not (speeds > 0).all():
+        raise ValueError("speeds must be positive")
+    return speeds
+
+
+def departure_multipliers(speed_profile, time_windows):
+    """Returns the travel time multiplier of the arcs leaving every stop, the
+    one in effect when its time window opens.
+    """
+    time_of_day = speed_profile.get("time_of_day") or []
+    opens = np.asarray(time_windows, dtype=np.float64).reshape(-1, 2)[:, 0]
+    if not time_of_day:
+        return np.ones(len(opens))
+    periods = np.asarray(time_of_day, dtype=np.float64)
+    if periods.ndim != 2 or periods.shape[1] != 2:
+        raise ValueError("time_of_day must be a list of [start_minute, multiplier]")
+    if (np.diff(periods[:, 0]) <= 0).any() or not (periods[:, 1] > 0).all():
+        raise ValueError("time_of_day starts must increase and multipliers be positive")
+    # Before the first period travel takes its plain time.
+    multipliers = np.concatenate([[1.0], periods[:, 1]])
+    return multipliers[np.searchsorted(periods[:, 0], opens, side="right")]
+
+
+def travel_time_matrices(distance_matrix, speed_profile, time_windows, num_vehicles):
+    """Returns the integer travel time matrix of every vehicle, in minutes.
+
+    The matrices of all the distinct speeds are computed in one broadcast over
+    the distance matrix, vehicles of the same speed share the same matrix
+    object.
+    """
+    distances = np.asarray(distance_matrix, dtype=np.float64)
+    if len(time_windows) != len(distances):
+        raise ValueError("time_windows must give one window per stop")
+    speeds, vehicle_matrix = np.unique(
+        vehicle_speeds(speed_profile, num_vehicles), return_inverse=True
+    )
+    meters_per_minute = speeds * 1000 / 60
+    times = np.ceil(
+        distances[np.newaxis]
+        * departure_multipliers(speed_profile, time_windows)[np.newaxis, :, np.newaxis]
+        / meters_per_minute[:, np.newaxis, np.newaxis]
+    ).astype(np.int64)
+    matrices = list(times)
+    return [matrices[index] for index in vehicle_matrix]
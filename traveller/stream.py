@@ -0,0 +1,231 @@
+"""Streaming the improving solutions of a solve as Server-Sent Events.
+
+The worker publishes the objective and routes of every improving solution to
+a SharedSolution, a shared memory block only holding the latest one. The view
+reads it every ROUTE_STREAM_INTERVAL seconds and sends an event when it
+changed, so a search improving hundreds of times a second still costs one
+event per interval.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+from concurrent.futures import wait
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+from traveller import metrics
+from traveller.executor import SharedStop
+from traveller.portfolio import problem_stops
+
+# Sequence number, objective and route count.
+HEADER_SLOTS = 3
+
+
+def solution_slots(data):
+    """Slots a SharedSolution needs for the routes of the problem ``data``
+    describes: one length per vehicle and one per stop. Time window problems
+    without "list_cord" always have 4 vehicles.
+    """
+    return problem_stops(data) + max(int(data.get("num_vehicles") or 0), 4)
+
+
+class SharedSolution:
+    """The latest improving solution of a solve, in a shared memory block of
+    int64 slots: a sequence number, the objective, the route count, the
+    length of every route and then their stops.
+
+    The writer makes the sequence odd while it writes, a reader retries until
+    it saw the same even sequence before and after copying.
+    """
+
+    def __init__(self, slots):
+        self.slots = HEADER_SLOTS + slots
+        self.shm = SharedMemory(create=True, size=self.slots * 8)
+        self.name = self.shm.name
+        self.values()[:HEADER_SLOTS] = 0
+
+    def __getstate__(self):
+        return {"name": self.name, "slots": self.slots}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = None
+
+    def attach(self):
+        self.shm = SharedMemory(name=self.name)
+
+    def values(self):
+        return np.ndarray((self.slots,), dtype=np.int64, buffer=self.shm.buf)
+
+    def publish(self, objective, routes):
+        """Replaces the solution with ``routes``, lists of the stops of every
+        vehicle, and their ``objective``.
+        """
+        lengths = [len(route) for route in routes]
+        end = HEADER_SLOTS + len(routes) + sum(lengths)
+        if end > self.slots:
+            return
+        values = self.values()
+        values[0] += 1
+        values[1] = objective
+        values[2] = len(routes)
+        values[HEADER_SLOTS : HEADER_SLOTS + len(routes)] = lengths
+        values[HEADER_SLOTS + len(routes) : end] = list(
+            itertools.chain.from_iterable(routes)
+        )
+        values[0] += 1
+
+    def read(self, after=0):
+        """Returns the sequence number, objective and routes of the solution,
+        or ``None`` while there is none newer than sequence ``after``.
+        """
+        values = self.values()
+        while True:
+            sequence = int(values[0])
+            if sequence == after:
+                return None
+            if sequence % 2:
+                continue
+            objective = int(values[1])
+            count = int(values[2])
+            lengths = values[HEADER_SLOTS : HEADER_SLOTS + count].tolist()
+            start = HEADER_SLOTS + count
+            stops = values[start : start + sum(lengths)].tolist()
+            if int(values[0]) == sequence:
+                break
+        bounds = np.cumsum([0] + lengths).tolist()
+        routes = [stops[begin:end] for begin, end in zip(bounds, bounds[1:])]
+        return sequence, objective, routes
+
+    def close(self):
+        self.shm.close()
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def sse_event(event, data, event_id=None):
+    """Formats one Server-Sent Event with JSON ``data``."""
+    lines = ["event: {}".format(event)]
+    if event_id is not None:
+        lines.append("id: {}".format(event_id))
+    lines.append("data: {}".format(json.dumps(data, cls=JSONEncoder)))
+    return "\n".join(lines) + "\n\n"
+
+
+class SolutionStream:
+    """The Server-Sent Events of a solve, iterated by an EventStreamResponse.
+
+    ``submit`` takes a SharedStop and a SharedSolution and returns the future
+    of the response, as SolverExecutor.submit does, or ``None`` when the
+    payload describes no problem. SolverBusy and ValueError are raised here,
+    before the stream starts.
+
+    Iterated synchronously under WSGI and asynchronously, without blocking
+    the event loop, by StreamingASGIHandler. Ending the iteration early or
+    closing the stream, as the servers do when the client goes away, stops
+    the solve. Intervals without a better solution send a comment, so that
+    happens within an interval even once the search stalls.
+    """
+
+    def __init__(self, submit, slots, interval, parse_seconds=0.0):
+        self.interval = interval
+        self.parse_seconds = parse_seconds
+        self.sequence = 0
+        self.closed = False
+        self.stop = SharedStop()
+        self.solution = SharedSolution(slots)
+        try:
+            self.future = submit(self.stop, self.solution)
+        except BaseException:
+            self.release()
+            raise
+        if self.future is None:
+            self.closed = True
+            self.release()
+
+    def release(self, future=None):
+        self.stop.release()
+        self.solution.release()
+
+    def interval_event(self, done):
+        """Returns the event of an interval: the best solution when it
+        improved, a comment while the solve runs or ``None`` once it ended.
+        """
+        latest = self.solution.read(self.sequence)
+        if latest is not None:
+            self.sequence, objective, routes = latest
+            return sse_event(
+                "solution", {"objective": objective, "routes": routes}, self.sequence
+            )
+        if not done:
+            # Writing it is how a client gone away is noticed.
+            return ": keep-alive\n\n"
+        return None
+
+    def result_event(self):
+        try:
+            response = self.future.result()
+        except Exception as e:
+            logging.info(
+                {"message": "error occur while streaming best route is {}".format(e)}
+            )
+            return sse_event("error", {"message": str(e)})
+        response["metrics"]["phases"]["parse"] = self.parse_seconds
+        metrics.record(response["metrics"])
+        return sse_event("result", response)
+
+    def __iter__(self):
+        try:
+            while True:
+                done = bool(wait([self.future], timeout=self.interval).done)
+                event = self.interval_event(done)
+                if event is not None:
+                    yield event
+                if done:
+                    break
+            yield self.result_event()
+        finally:
+            self.close()
+
+    async def __aiter__(self):
+        future = asyncio.wrap_future(self.future)
+        try:
+            while True:
+                done = bool((await asyncio.wait([future], timeout=self.interval))[0])
+                event = self.interval_event(done)
+                if event is not None:
+                    yield event
+                if done:
+                    break
+            yield self.result_event()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops the solve, the blocks are released once it ended."""
+        if self.closed:
+            return
+        self.closed = True
+        self.stop.set()
+        # The worker reads both blocks until its solve returns.
+        self.future.add_done_callback(self.release)
+
+
+class EventStreamResponse(StreamingHttpResponse):
+    """A text/event-stream response of a SolutionStream, which
+    StreamingASGIHandler iterates as its ``async_content``.
+    """
+
+    def __init__(self, stream):
+        super().__init__(stream, content_type="text/event-stream")
+        self.async_content = stream
+        self["Cache-Control"] = "no-cache"
+        # Proxies such as nginx must pass every event on as it comes.
+        self["X-Accel-Buffering"] = "no"
@@ -1,8 +1,65 @@
+import asyncio
+import base64
+import gzip
+import io
+import itertools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock, skipIf
+
+from django.core.asgi import get_asgi_application
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
 from django.urls import include, path, reverse
 
 from rest_framework.test import APITestCase, URLPatternsTestCase
 from rest_framework import status
 
+import numpy as np
+
+from traveller.benchmark import generate_instance, run_instance, time_matrix
+from traveller.bounds import held_karp_bound
+from traveller.cache import DistanceMatrixCache, matrix_key
+from traveller.condensed import CondensedMatrix
+from traveller.constant import DEADLINE_RESPONSE_SECONDS, GLOBAL_SPAN_COST_COEFFICIENT
+from traveller.decomposition import Decomposition, routes_objective, sweep_clusters
+from traveller.edges import EdgeStore
+from traveller.executor import (
+    SharedMatrix,
+    SolverBusy,
+    SolverExecutor,
+    get_solver_executor,
+    share_matrices,
+)
+from traveller import heuristic
+from traveller.jobs import run_solve_job
+from traveller.matrixfile import MappedMatrix, open_matrix_file, write_matrix_file
+from traveller.metrics import Histogram
+from traveller.models import SolveJob
+from traveller.offload import CancelOnDisconnect, StreamingASGIHandler
+from traveller.payloads import decode_matrix
+from traveller.renderers import msgpack
+from traveller.speeds import travel_time_matrices
+from traveller.stream import SharedSolution, SolutionStream
+from traveller.utils import (
+    DistanceMatrix,
+    RouteFinder,
+    SparseDistanceGraph,
+    apply_stop_delta,
+    batch_haversine_matrices,
+    insert_missing_stops,
+    build_search_parameters,
+    default_search_budget,
+    haversine_matrix,
+    infeasible_arcs,
+    route_finder_from_request,
+    sparse_neighbors,
+)
+
 
 class RoutingTests(APITestCase, URLPatternsTestCase):
     urlpatterns = [path("api/", include("traveller.urls"))]
@@ -114,3 +171,1521 @@ class RoutingTests(APITestCase, URLPatternsTestCase):
             },
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class DistanceMatrixTests(SimpleTestCase):
+    coordinate_list = [
+        [75.85959398126745, 22.796033910515693],
+        [75.84514379661131, 22.797202783046455],
+        [75.89372268920312, 22.744358154533295],
+        [75.90357728311815, 22.754718648887533],
+        [75.88515698311818, 22.757859818243723],
+        [75.85584452544431, 22.67783817185593],
+        [75.87114646777299, 22.699688243109538],
+    ]
+
+    def test_numpy_engine_matches_python_engine(self):
+        expected = DistanceMatrix(
+            self.coordinate_list, engine="python"
+        ).create_distance_matrix()
+        matrix = DistanceMatrix(self.coordinate_list).create_distance_matrix()
+
+        self.assertEqual(matrix.shape, (7, 7))
+        self.assertTrue(np.issubdtype(matrix.dtype, np.integer))
+        self.assertTrue(np.allclose(matrix, expected, atol=0.5))
+
+    def test_chunked_matrix_matches_single_pass(self):
+        single = DistanceMatrix(self.coordinate_list).create_distance_matrix()
+        chunked = DistanceMatrix(
+            self.coordinate_list, chunk_size=3
+        ).create_distance_matrix()
+
+        self.assertTrue(np.array_equal(single, chunked))
+
+    def test_condensed_matrix_matches_dense(self):
+        dense = DistanceMatrix(self.coordinate_list).create_distance_matrix()
+        condensed = DistanceMatrix(
+            self.coordinate_list, chunk_size=3, condensed=True
+        ).create_distance_matrix()
+
+        self.assertIsInstance(condensed, CondensedMatrix)
+        self.assertEqual(len(condensed.values), 7 * 6 // 2)
+        np.testing.assert_array_equal(np.asarray(condensed), dense)
+        self.assertEqual(condensed[2][5], dense[2][5])
+        self.assertEqual(condensed[5, 2], dense[5, 2])
+        self.assertEqual(condensed[4][4], 0)
+        np.testing.assert_array_equal(condensed[[0, 3], [6, 1]], dense[[0, 3], [6, 1]])
+        np.testing.assert_array_equal(list(condensed)[3], dense[3])
+
+    def test_batch_matrices_match_single_problems(self):
+        coordinate_lists = [
+            self.coordinate_list,
+            self.coordinate_list[:2],
+            self.coordinate_list[3:],
+            self.coordinate_list[:5],
+        ]
+        # Small enough to split the lists into several padded groups.
+        matrices = batch_haversine_matrices(coordinate_lists, max_cells=40)
+
+        for coordinates, matrix in zip(coordinate_lists, matrices):
+            np.testing.assert_array_equal(
+                matrix, haversine_matrix(coordinates, coordinates)
+            )
+
+
+class RouteFinderTests(SimpleTestCase):
+    coordinate_list = DistanceMatrixTests.coordinate_list
+
+    def route_finder(self, **kwargs):
+        distance_matrix = DistanceMatrix(self.coordinate_list).create_distance_matrix()
+        kwargs.setdefault("num_vehicles", 1)
+        return RouteFinder(
+            distance_matrix=distance_matrix,
+            coordinate_list=self.coordinate_list,
+            **kwargs
+        )
+
+    def test_native_matrix_and_callback_transit_agree(self):
+        native = self.route_finder(transit_mode="matrix")
+        callback = self.route_finder(transit_mode="callback")
+
+        self.assertEqual(
+            native.traveling_salesperson_solution(),
+            callback.traveling_salesperson_solution(),
+        )
+
+    def test_unknown_transit_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.route_finder(transit_mode="matrx")
+
+    def test_search_budget_with_metaheuristic(self):
+        route = self.route_finder(
+            search_budget={
+                "time_limit": 0.2,
+                "first_solution_strategy": "SAVINGS",
+                "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+            }
+        )
+
+        self.assertIn("plan_output", route.traveling_salesperson_solution())
+
+    def test_structured_output_matches_text_output(self):
+        text = self.route_finder(num_vehicles=2, vehicle_maximum_travel_distance=40000)
+        structured = self.route_finder(
+            num_vehicles=2, vehicle_maximum_travel_distance=40000, output="structured"
+        )
+
+        expected = text.vehicle_routing_solution()
+        response = structured.vehicle_routing_solution()
+
+        self.assertEqual(response["routes"], expected["routes"])
+        self.assertEqual(
+            response["route_distances"],
+            [
+                expected["Distance of the route for vehicle {} in meter".format(i)]
+                for i in range(2)
+            ],
+        )
+        for route, cumulative in zip(
+            response["routes"], response["cumulative_distances"]
+        ):
+            self.assertEqual(len(cumulative), len(route) + 2)
+            self.assertEqual(cumulative[0], 0)
+        self.assertEqual(response["objective"], structured.objective)
+
+    def test_passed_deadline_falls_back_to_heuristic(self):
+        route = self.route_finder(deadline=time.time() - 1)
+
+        # OR-tools may still build a first solution within the 1 ms left.
+        with mock.patch.object(route, "search", return_value=None):
+            response = route.by_deadline(route.traveling_salesperson_solution)()
+
+        self.assertTrue(response["truncated"])
+        self.assertEqual(route.status, "HEURISTIC_SUCCESS")
+        self.assertIn("plan_output", response)
+
+
+class SearchBudgetTests(SimpleTestCase):
+    search_budgets = [
+        {"max_stops": 10, "time_limit": 1},
+        {"max_stops": None, "time_limit": 30},
+    ]
+
+    def test_budget_tier_is_selected_by_problem_size(self):
+        self.assertEqual(
+            default_search_budget(self.search_budgets, 5), {"time_limit": 1}
+        )
+        self.assertEqual(
+            default_search_budget(self.search_budgets, 500, {"solution_limit": 3}),
+            {"time_limit": 30, "solution_limit": 3},
+        )
+
+    def test_unknown_strategy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            build_search_parameters({"first_solution_strategy": "FASTEST"})
+
+    def test_metaheuristic_requires_a_limit(self):
+        with self.assertRaises(ValueError):
+            build_search_parameters(
+                {"local_search_metaheuristic": "SIMULATED_ANNEALING"}
+            )
+
+
+class SolveJobTests(APITestCase, URLPatternsTestCase):
+    urlpatterns = [path("api/", include("traveller.urls"))]
+
+    problem = {
+        "list_cord": DistanceMatrixTests.coordinate_list,
+        "num_vehicles": 1,
+        "search_budget": {"time_limit": 1},
+    }
+
+    def test_submit_returns_job_id_immediately(self):
+        response = self.client.post(reverse("job-submit"), self.problem, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = SolveJob.objects.get(pk=response.data["job_id"])
+        self.assertEqual(job.status, SolveJob.QUEUED)
+
+    def test_submit_beyond_the_job_queue_answers_429(self):
+        with self.settings(ROUTE_JOB_WORKERS=1, ROUTE_JOB_QUEUE_SIZE=0):
+            with mock.patch("traveller.jobs._pool", None):
+                # The test transaction never commits, so the first job keeps
+                # its slot.
+                first = self.client.post(
+                    reverse("job-submit"), self.problem, format="json"
+                )
+                second = self.client.post(
+                    reverse("job-submit"), self.problem, format="json"
+                )
+
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(second.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn("Retry-After", second)
+        self.assertEqual(SolveJob.objects.count(), 1)
+
+    def test_submit_rejects_payload_without_problem(self):
+        response = self.client.post(
+            reverse("job-submit"), {"num_vehicles": 1}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_jobs_left_by_a_restart_are_failed(self):
+        queued = SolveJob.objects.create(problem=self.problem)
+        running = SolveJob.objects.create(
+            problem=self.problem, status=SolveJob.RUNNING
+        )
+        finished = SolveJob.objects.create(
+            problem=self.problem, status=SolveJob.SUCCEEDED
+        )
+
+        out = io.StringIO()
+        call_command("fail_stale_jobs", stdout=out)
+
+        self.assertIn("2 stale jobs", out.getvalue())
+        for job in (queued, running):
+            job.refresh_from_db()
+            self.assertEqual(job.status, SolveJob.FAILED)
+            self.assertIn("restart", job.error)
+        finished.refresh_from_db()
+        self.assertEqual(finished.status, SolveJob.SUCCEEDED)
+
+    def test_finished_job_reports_result(self):
+        job = SolveJob.objects.create(problem=self.problem)
+        run_solve_job(job.pk)
+
+        response = self.client.get(reverse("job-status", args=[job.pk]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], SolveJob.SUCCEEDED)
+        self.assertEqual(response.data["progress"], 1)
+        self.assertIsNotNone(response.data["best_objective"])
+        self.assertIn("plan_output", response.data["result"])
+
+    def test_failed_job_reports_error(self):
+        job = SolveJob.objects.create(
+            problem=dict(self.problem, search_budget={"first_solution_strategy": "X"})
+        )
+        run_solve_job(job.pk)
+
+        response = self.client.get(reverse("job-status", args=[job.pk]))
+
+        self.assertEqual(response.data["status"], SolveJob.FAILED)
+        self.assertIn("first_solution_strategy", response.data["error"])
+
+
+class SolverExecutorTests(APITestCase, URLPatternsTestCase):
+    urlpatterns = [path("api/", include("traveller.urls"))]
+
+    problem = {
+        "list_cord": DistanceMatrixTests.coordinate_list,
+        "num_vehicles": 2,
+        "vehicle_maximum_travel_distance": 40000,
+    }
+
+    def setUp(self):
+        self.executor = SolverExecutor(workers=1, queue_size=0)
+        self.addCleanup(self.executor.pool.shutdown)
+
+    def test_matrix_reaches_worker_through_shared_memory(self):
+        response = self.executor.submit(self.problem, []).result()
+
+        self.assertIn("Route for vehicle 0", response)
+        self.assertIn("Maximum of the route distances", response)
+
+    def test_large_matrix_reaches_worker_through_mapped_file(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+            ROUTE_MMAP_THRESHOLD=5, ROUTE_MATRIX_DIR=directory
+        ):
+            response = self.executor.submit(self.problem, []).result()
+
+            self.assertIn("Route for vehicle 0", response)
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_failed_submit_releases_its_slot_and_matrices(self):
+        with mock.patch.object(
+            self.executor.pool, "submit", side_effect=BrokenProcessPool("died")
+        ), mock.patch.object(
+            SharedMatrix, "release", autospec=True, side_effect=SharedMatrix.release
+        ) as release:
+            with self.assertRaises(BrokenProcessPool):
+                self.executor.submit(self.problem, [])
+
+        self.assertEqual(release.call_count, 1)
+        self.assertEqual(self.executor.pending, 0)
+        response = self.executor.submit(self.problem, []).result()
+        self.assertIn("Route for vehicle 0", response)
+
+    def test_broken_pool_is_replaced(self):
+        self.executor.pool._broken = "A worker died"
+
+        with mock.patch("traveller.executor._executor", self.executor), mock.patch(
+            "traveller.executor.SolverExecutor"
+        ) as new_executor:
+            executor = get_solver_executor()
+
+        self.assertIs(executor, new_executor.return_value)
+
+    def test_full_queue_is_rejected(self):
+        slow_problem = dict(
+            self.problem,
+            search_budget={
+                "time_limit": 1,
+                "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+            },
+        )
+        future = self.executor.submit(slow_problem, [])
+
+        with self.assertRaises(SolverBusy):
+            self.executor.submit(self.problem, [])
+        future.result()
+        self.assertIsNotNone(self.executor.submit(self.problem, []).result())
+
+    def test_deadline_truncates_the_search(self):
+        slow_problem = dict(
+            self.problem,
+            deadline=0.5,
+            search_budget={
+                "time_limit": 10,
+                "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+            },
+        )
+        started = time.perf_counter()
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value = self.executor
+            response = self.client.generic(
+                "GET", reverse("route"), json.dumps(slow_problem), "application/json"
+            )
+
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertTrue(response.data["truncated"])
+        self.assertIn("Route for vehicle 0", response.data)
+
+    def test_deadline_passing_in_the_queue_answers_the_heuristic(self):
+        executor = SolverExecutor(workers=1, queue_size=1)
+        self.addCleanup(executor.pool.shutdown)
+        busy = executor.submit(
+            dict(
+                self.problem,
+                search_budget={
+                    "time_limit": 2,
+                    "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+                },
+            ),
+            [],
+        )
+        started = time.perf_counter()
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value = executor
+            response = self.client.generic(
+                "GET",
+                reverse("route"),
+                json.dumps(dict(self.problem, deadline=0.5)),
+                "application/json",
+            )
+        answered = time.perf_counter() - started
+        busy.result()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLess(answered, 1)
+        self.assertTrue(response.data["truncated"])
+        self.assertIn("Route for vehicle 0", response.data)
+        self.assertEqual(response.data["metrics"]["status"], "HEURISTIC_SUCCESS")
+
+    def test_response_margin_follows_the_measured_lateness(self):
+        executor = SolverExecutor(workers=1, queue_size=1)
+        self.addCleanup(executor.pool.shutdown)
+
+        executor.observe_response(0.3)
+        self.assertEqual(executor.response_seconds, 0.3)
+        executor.observe_response(0.0)
+        self.assertAlmostEqual(executor.response_seconds, 0.24)
+        for _ in range(50):
+            executor.observe_response(0.0)
+        self.assertEqual(executor.response_seconds, DEADLINE_RESPONSE_SECONDS)
+
+    def test_invalid_deadline_is_rejected(self):
+        response = self.client.generic(
+            "GET",
+            reverse("route"),
+            json.dumps(self.problem),
+            "application/json",
+            HTTP_X_DEADLINE="-1",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_shared_solution_keeps_the_latest_routes(self):
+        solution = SharedSolution(10)
+        self.addCleanup(solution.release)
+
+        self.assertIsNone(solution.read())
+        solution.publish(120, [[3, 1], [], [2]])
+        solution.publish(100, [[1, 2, 3], [4]])
+
+        sequence, objective, routes = solution.read()
+        self.assertEqual((objective, routes), (100, [[1, 2, 3], [4]]))
+        self.assertIsNone(solution.read(sequence))
+
+    def test_stream_sends_improving_solutions(self):
+        slow_problem = dict(
+            self.problem,
+            search_budget={
+                "time_limit": 1,
+                "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+            },
+        )
+        with mock.patch(
+            "traveller.views.get_solver_executor"
+        ) as get_executor, self.settings(ROUTE_STREAM_INTERVAL=0.05):
+            get_executor.return_value = self.executor
+            response = self.client.generic(
+                "GET",
+                reverse("route-stream"),
+                json.dumps(slow_problem),
+                "application/json",
+            )
+            body = b"".join(response.streaming_content).decode()
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = [
+            (lines[0][len("event: ") :], json.loads(lines[-1][len("data: ") :]))
+            for lines in (event.split("\n") for event in body.strip().split("\n\n"))
+            if not lines[0].startswith(":")
+        ]
+        self.assertEqual(events[-1][0], "result")
+        solutions = [data for event, data in events if event == "solution"]
+        self.assertTrue(solutions)
+        objectives = [data["objective"] for data in solutions]
+        self.assertEqual(objectives, sorted(objectives, reverse=True))
+        self.assertEqual(objectives[-1], events[-1][1]["metrics"]["objective"])
+        self.assertEqual(
+            sorted(itertools.chain.from_iterable(solutions[-1]["routes"])),
+            list(range(1, 7)),
+        )
+
+    async def test_asgi_stream_leaves_the_loop_free_and_stops_on_disconnect(self):
+        slow_problem = dict(
+            self.problem,
+            search_budget={
+                "time_limit": 30,
+                "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+            },
+        )
+        body = json.dumps(slow_problem).encode()
+        messages = [{"type": "http.request", "body": body}]
+        sent = []
+        ticks = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(2)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.05)
+
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": reverse("route-stream"),
+            "query_string": b"",
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+        started = time.monotonic()
+        ticker = asyncio.ensure_future(tick())
+        with mock.patch(
+            "traveller.views.get_solver_executor"
+        ) as get_executor, mock.patch.object(
+            SolutionStream, "release", autospec=True, side_effect=SolutionStream.release
+        ) as release, self.settings(
+            ROUTE_STREAM_INTERVAL=0.5
+        ):
+            get_executor.return_value = self.executor
+            await CancelOnDisconnect(StreamingASGIHandler())(scope, receive, send)
+            while self.executor.pending:
+                await asyncio.sleep(0.1)
+        ticker.cancel()
+
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertLess(max(np.diff(ticks)), 0.3)
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertIn(b"event: solution", sent[1]["body"])
+        self.assertEqual(release.call_count, 1)
+
+    def test_view_reports_phase_metrics(self):
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value = self.executor
+            response = self.client.generic(
+                "GET", reverse("route"), json.dumps(self.problem), "application/json"
+            )
+        scrape = self.client.get(reverse("metrics"))
+
+        solve_metrics = response.data["metrics"]
+        self.assertEqual(solve_metrics["problem"], "vrp")
+        self.assertEqual(solve_metrics["stops"], 7)
+        self.assertEqual(solve_metrics["status"], "ROUTING_SUCCESS")
+        self.assertEqual(
+            set(solve_metrics["phases"]),
+            {"parse", "matrix", "queue", "model", "solve", "response"},
+        )
+        self.assertIn("solve;dur=", response["Server-Timing"])
+        self.assertContains(
+            scrape, 'route_phase_seconds_bucket{problem="vrp",phase="solve",le="+Inf"}'
+        )
+        self.assertContains(
+            scrape, 'route_solves_total{problem="vrp",status="ROUTING_SUCCESS"}'
+        )
+
+    def test_decompose_flag_is_parsed_strictly(self):
+        def get(**flags):
+            return self.client.generic(
+                "GET",
+                reverse("route"),
+                json.dumps(dict(self.problem, **flags)),
+                "application/json",
+            )
+
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value = self.executor
+            solved = get(decompose="false", compare_monolithic="0")
+            invalid = get(decompose="0")
+
+        self.assertEqual(solved.status_code, status.HTTP_200_OK)
+        self.assertNotIn("clusters", solved.data)
+        self.assertEqual(invalid.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("decompose", invalid.data["message"])
+
+    def test_decomposed_subproblems_end_by_the_deadline(self):
+        with mock.patch(
+            "traveller.views.get_solver_executor"
+        ) as get_executor, mock.patch.object(
+            self.executor, "submit", wraps=self.executor.submit
+        ) as submit:
+            get_executor.return_value = self.executor
+            started = time.time()
+            response = self.client.generic(
+                "GET",
+                reverse("route"),
+                json.dumps(dict(self.problem, decompose=True, deadline=5)),
+                "application/json",
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("clusters", response.data)
+        self.assertTrue(submit.call_args_list)
+        for call in submit.call_args_list:
+            self.assertAlmostEqual(call.kwargs["deadline"], started + 5, delta=1)
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_view_renders_message_pack(self):
+        problem = dict(self.problem, output="structured")
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value = self.executor
+            response = self.client.generic(
+                "GET",
+                reverse("route"),
+                json.dumps(problem),
+                "application/json",
+                HTTP_ACCEPT="application/msgpack",
+            )
+
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        body = msgpack.unpackb(response.content)
+        self.assertEqual(sorted(sum(body["routes"], [])), list(range(1, 7)))
+        self.assertEqual(len(body["cumulative_distances"]), 2)
+
+    def test_batch_streams_a_status_per_problem(self):
+        problems = [
+            self.problem,
+            {"list_cord": DistanceMatrixTests.coordinate_list[:4], "num_vehicles": 1},
+            {"num_vehicles": 1},
+            {"time_matrix": {"encoding": "base64", "data": "!"}, "time_windows": []},
+        ]
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value = self.executor
+            response = self.client.post(
+                reverse("batch"), {"problems": problems}, format="json"
+            )
+            lines = b"".join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        items = {item["index"]: item for item in map(json.loads, lines[:-1])}
+        self.assertEqual(sorted(items), [0, 1, 2, 3])
+        self.assertEqual(items[0]["status"], "solved")
+        self.assertIn("Route for vehicle 0", items[0]["result"])
+        self.assertEqual(items[1]["result"]["metrics"]["problem"], "tsp")
+        self.assertEqual(items[2]["status"], "failed")
+        self.assertEqual(items[3]["status"], "failed")
+        self.assertEqual(
+            json.loads(lines[-1]),
+            {"summary": {"solved": 2, "no_solution": 0, "failed": 2}},
+        )
+
+    def test_portfolio_stops_once_a_member_reaches_the_target(self):
+        problem = dict(
+            self.problem,
+            search_budget={"time_limit": 10},
+            portfolio=[
+                {"first_solution_strategy": "SAVINGS"},
+                {
+                    "first_solution_strategy": "PATH_CHEAPEST_ARC",
+                    "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+                },
+            ],
+            target_objective=10**9,
+        )
+        executor = SolverExecutor(workers=2, queue_size=0)
+        self.addCleanup(executor.pool.shutdown)
+        started = time.monotonic()
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value = executor
+            response = self.client.generic(
+                "GET", reverse("route"), json.dumps(problem), "application/json"
+            )
+
+        self.assertLess(time.monotonic() - started, 5)
+        report = response.data["portfolio"]
+        self.assertIn(report["winner"], problem["portfolio"])
+        self.assertEqual(len(report["members"]), 2)
+        self.assertEqual(
+            response.data["metrics"]["objective"],
+            min(
+                member["objective"]
+                for member in report["members"]
+                if member["objective"] is not None
+            ),
+        )
+        self.assertIn("Route for vehicle 0", response.data)
+
+    def test_portfolio_ends_by_the_deadline(self):
+        problem = dict(
+            self.problem,
+            search_budget={
+                "time_limit": 10,
+                "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+            },
+            portfolio=True,
+            deadline=1,
+        )
+        executor = SolverExecutor(workers=2, queue_size=0)
+        self.addCleanup(executor.pool.shutdown)
+        started = time.monotonic()
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value = executor
+            response = self.client.generic(
+                "GET", reverse("route"), json.dumps(problem), "application/json"
+            )
+
+        self.assertLess(time.monotonic() - started, 3)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("Route for vehicle 0", response.data)
+
+    async def test_async_view_solves_on_the_executor(self):
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value = self.executor
+            response = await self.async_client.post(
+                reverse("route-async"), self.problem, content_type="application/json"
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("Route for vehicle 0", response.json())
+        self.assertIn("solve;dur=", response["Server-Timing"])
+
+    async def test_async_view_submits_off_the_loop(self):
+        ticks = []
+
+        def slow_submit(*args, **kwargs):
+            # Stands in for building a large distance matrix.
+            time.sleep(0.5)
+            return None
+
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.05)
+
+        ticker = asyncio.ensure_future(tick())
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value.submit.side_effect = slow_submit
+            response = await self.async_client.post(
+                reverse("route-async"), self.problem, content_type="application/json"
+            )
+        ticker.cancel()
+
+        self.assertEqual(response.json(), {"message": "No Solution Found"})
+        self.assertLess(max(np.diff(ticks)), 0.3)
+
+    async def test_async_view_times_out_with_504(self):
+        slow_problem = dict(
+            self.problem,
+            search_budget={
+                "time_limit": 30,
+                "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+            },
+        )
+        with mock.patch(
+            "traveller.views.get_solver_executor"
+        ) as get_executor, self.settings(ROUTE_ASYNC_REQUEST_TIMEOUT=0.5):
+            get_executor.return_value = self.executor
+            response = await self.async_client.post(
+                reverse("route-async"), slow_problem, content_type="application/json"
+            )
+            while self.executor.pending:
+                await asyncio.sleep(0.1)
+
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+
+    async def test_disconnect_stops_the_solve(self):
+        slow_problem = dict(
+            self.problem,
+            search_budget={
+                "time_limit": 30,
+                "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+            },
+        )
+        messages = [
+            {"type": "http.request", "body": json.dumps(slow_problem).encode()}
+        ]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(1)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": reverse("route-async"),
+            "query_string": b"",
+            "headers": [(b"content-type", b"application/json")],
+        }
+        started = time.monotonic()
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value = self.executor
+            await CancelOnDisconnect(get_asgi_application())(scope, receive, send)
+            while self.executor.pending:
+                await asyncio.sleep(0.1)
+
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(sent, [])
+
+
+    def test_portfolio_runs_as_many_members_as_workers(self):
+        problem = dict(
+            self.problem,
+            search_budget={"time_limit": 1},
+            portfolio=[
+                {"first_solution_strategy": "SAVINGS"},
+                {"first_solution_strategy": "PATH_CHEAPEST_ARC"},
+            ],
+        )
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value = self.executor
+            response = self.client.generic(
+                "GET", reverse("route"), json.dumps(problem), "application/json"
+            )
+            off = self.client.generic(
+                "GET",
+                reverse("route"),
+                json.dumps(dict(self.problem, portfolio="false")),
+                "application/json",
+            )
+            invalid = self.client.generic(
+                "GET",
+                reverse("route"),
+                json.dumps(dict(self.problem, portfolio="0")),
+                "application/json",
+            )
+
+        members = response.data["portfolio"]["members"]
+        self.assertEqual(len(members), 1)
+        self.assertEqual(members[0]["first_solution_strategy"], "SAVINGS")
+        self.assertNotIn("portfolio", off.data)
+        self.assertIn("Route for vehicle 0", off.data)
+        self.assertEqual(invalid.status_code, status.HTTP_400_BAD_REQUEST)
+    def test_view_answers_429_with_retry_after(self):
+        with mock.patch("traveller.views.get_solver_executor") as get_executor:
+            get_executor.return_value.submit.side_effect = SolverBusy(3)
+            response = self.client.generic(
+                "GET", reverse("route"), json.dumps(self.problem), "application/json"
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "3")
+
+
+class DistanceMatrixCacheTests(SimpleTestCase):
+    coordinate_list = DistanceMatrixTests.coordinate_list
+
+    def test_key_ignores_representation_noise(self):
+        noisy = [[lon + 1e-10, lat] for lon, lat in self.coordinate_list]
+
+        self.assertEqual(matrix_key(self.coordinate_list), matrix_key(noisy))
+        self.assertNotEqual(
+            matrix_key(self.coordinate_list), matrix_key(self.coordinate_list[1:])
+        )
+
+    def test_distance_matrix_is_served_from_cache(self):
+        cache = DistanceMatrixCache(max_bytes=1024 * 1024)
+        first = DistanceMatrix(self.coordinate_list, cache=cache)
+        second = DistanceMatrix(self.coordinate_list, cache=cache)
+
+        self.assertTrue(
+            np.array_equal(
+                first.create_distance_matrix(), second.create_distance_matrix()
+            )
+        )
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_least_recently_used_matrix_is_evicted(self):
+        matrix = np.zeros((4, 4))
+        cache = DistanceMatrixCache(max_bytes=2 * 4 * 4 * 4)
+        cache.put("a", matrix)
+        cache.put("b", matrix)
+        cache.get("a")
+        cache.put("c", matrix)
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.stats()["bytes"], 2 * 4 * 4 * 4)
+
+    def test_condensed_matrix_stays_condensed_on_disk(self):
+        matrix = CondensedMatrix.from_dense(
+            haversine_matrix(self.coordinate_list, self.coordinate_list)
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            DistanceMatrixCache(1 << 20, directory).put("key", matrix)
+            cached = DistanceMatrixCache(1 << 20, directory).get("key")
+
+        self.assertIsInstance(cached, CondensedMatrix)
+        np.testing.assert_array_equal(cached.values, matrix.values)
+
+    def test_disk_tier_is_shared_between_caches(self):
+        directory = tempfile.mkdtemp()
+        DistanceMatrixCache(max_bytes=1024, directory=directory).put(
+            "a", np.ones((3, 3))
+        )
+        cache = DistanceMatrixCache(max_bytes=1024, directory=directory)
+
+        self.assertTrue(np.array_equal(cache.get("a"), np.ones((3, 3))))
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+
+
+class EdgeStoreTests(SimpleTestCase):
+    coordinate_list = DistanceMatrixTests.coordinate_list
+
+    def expected(self, coordinate_list):
+        return DistanceMatrix(coordinate_list).create_distance_matrix()
+
+    def test_overlapping_request_only_computes_new_edges(self):
+        store = EdgeStore(max_bytes=1024 * 1024)
+        store.matrix(self.coordinate_list[:5])
+        computed = store.stats()["computed_edges"]
+
+        matrix = store.matrix(self.coordinate_list)
+
+        self.assertTrue(np.array_equal(matrix, self.expected(self.coordinate_list)))
+        # 2 new stops against 7: 5 * 2 pairs with old stops + 1 between them.
+        self.assertEqual(store.stats()["computed_edges"] - computed, 11)
+
+    def test_least_recently_used_points_are_evicted(self):
+        store = EdgeStore(max_bytes=5 * 5 * 4, initial_points=2)
+        store.matrix(self.coordinate_list[:3])
+        matrix = store.matrix(self.coordinate_list[3:7])
+
+        self.assertEqual(store.stats()["points"], 5)
+        self.assertEqual(store.stats()["evictions"], 2)
+        self.assertTrue(
+            np.array_equal(matrix, self.expected(self.coordinate_list[3:7]))
+        )
+
+    def test_duplicate_stops_share_a_slot(self):
+        store = EdgeStore(max_bytes=1024 * 1024)
+        coordinate_list = self.coordinate_list[:3] + self.coordinate_list[:1]
+
+        matrix = store.matrix(coordinate_list)
+
+        self.assertEqual(store.stats()["points"], 3)
+        self.assertTrue(np.array_equal(matrix, self.expected(coordinate_list)))
+
+
+class ReoptimizationTests(SimpleTestCase):
+    coordinate_list = DistanceMatrixTests.coordinate_list
+
+    def test_stop_delta_remaps_previous_routes(self):
+        payload = apply_stop_delta(
+            {
+                "list_cord": self.coordinate_list[:5],
+                "num_vehicles": 2,
+                "routes": [[1, 2], [4, 3]],
+                "remove_stops": [2],
+                "add_stops": self.coordinate_list[5:],
+            }
+        )
+
+        self.assertEqual(
+            payload["list_cord"],
+            self.coordinate_list[:2] + self.coordinate_list[3:],
+        )
+        self.assertEqual(payload["routes"], [[1], [3, 2]])
+        self.assertNotIn("add_stops", payload)
+
+    def test_depot_cannot_be_removed(self):
+        with self.assertRaises(ValueError):
+            apply_stop_delta(
+                {"list_cord": self.coordinate_list, "routes": [], "remove_stops": [0]}
+            )
+
+    def test_missing_stops_are_inserted_at_cheapest_position(self):
+        matrix = np.array(
+            [
+                [0, 1, 2, 1],
+                [1, 0, 1, 5],
+                [2, 1, 0, 5],
+                [1, 5, 5, 0],
+            ]
+        )
+
+        self.assertEqual(insert_missing_stops([[2], [3]], matrix), [[1, 2], [3]])
+
+    def test_search_starts_from_previous_routes(self):
+        distance_matrix = DistanceMatrix(self.coordinate_list).create_distance_matrix()
+        route = RouteFinder(
+            distance_matrix=distance_matrix,
+            coordinate_list=self.coordinate_list,
+            num_vehicles=2,
+            vehicle_maximum_travel_distance=40000,
+            initial_routes=[[3, 1], [5]],
+        )
+
+        routes = route.vehicle_routing_solution()["routes"]
+
+        self.assertEqual(sorted(sum(routes, [])), list(range(1, 7)))
+
+
+class SparseDistanceGraphTests(SimpleTestCase):
+    def setUp(self):
+        self.coordinate_list = (
+            np.random.default_rng(0)
+            .uniform([75.8, 22.6], [76.0, 22.8], size=(300, 2))
+            .tolist()
+        )
+
+    def test_candidate_arcs_are_the_nearest_stops(self):
+        graph = SparseDistanceGraph(self.coordinate_list, neighbors=8)
+        matrix = haversine_matrix(self.coordinate_list, self.coordinate_list)
+        np.fill_diagonal(matrix, np.iinfo(np.int64).max)
+        nearest = np.sort(matrix, axis=1)[:, :8]
+
+        self.assertEqual(graph.neighbor_index.shape, (300, 8))
+        found = np.sort(graph.neighbor_distance, axis=1)
+        self.assertGreater((found == nearest).all(axis=1).mean(), 0.95)
+
+    def test_depot_and_candidate_arcs_cost_their_distance(self):
+        graph = SparseDistanceGraph(self.coordinate_list, neighbors=8)
+        matrix = haversine_matrix(self.coordinate_list, self.coordinate_list)
+        neighbor = int(graph.neighbor_index[10, 0])
+
+        self.assertEqual(graph.arc_cost(10, neighbor), matrix[10, neighbor])
+        self.assertEqual(graph.arc_cost(10, 0), matrix[10, 0])
+        self.assertEqual(graph.arc_cost(0, 10), matrix[0, 10])
+
+    def test_sparse_graph_is_used_above_threshold(self):
+        data = {"list_cord": self.coordinate_list, "num_vehicles": 1}
+
+        self.assertEqual(sparse_neighbors(data, 100, 16), 16)
+        self.assertIsNone(sparse_neighbors(data, 1000, 16))
+        self.assertEqual(sparse_neighbors(dict(data, sparse_neighbors=4), 1000, 16), 4)
+
+    def test_search_starts_from_the_given_routes(self):
+        graph = SparseDistanceGraph(self.coordinate_list, neighbors=8)
+        given = graph.initial_routes(2)[::-1]
+        missing = given[0].pop(3)
+        route = RouteFinder(
+            distance_matrix=graph,
+            coordinate_list=self.coordinate_list,
+            num_vehicles=2,
+            initial_routes=given,
+        )
+
+        routes = route.starting_routes()
+
+        self.assertNotEqual(routes, graph.initial_routes(2))
+        self.assertEqual(sorted(sum(routes, [])), list(range(1, 300)))
+        self.assertEqual([stop for stop in routes[0] if stop != missing], given[0])
+        self.assertEqual(routes[1], given[1])
+
+    def test_route_visits_every_stop(self):
+        route = RouteFinder(
+            distance_matrix=SparseDistanceGraph(self.coordinate_list, neighbors=8),
+            coordinate_list=self.coordinate_list,
+            search_budget={"time_limit": 2},
+        )
+
+        routes = route.traveling_salesperson_solution()["routes"]
+
+        self.assertEqual(sorted(routes[0]), list(range(1, 300)))
+
+
+class DecompositionTests(SimpleTestCase):
+    def setUp(self):
+        self.coordinate_list = (
+            np.random.default_rng(1)
+            .uniform([75.8, 22.6], [76.0, 22.8], size=(41, 2))
+            .tolist()
+        )
+
+    def submit(self, payload):
+        future = Future()
+        future.set_result(route_finder_from_request(payload, [])[1]())
+        return future
+
+    def test_sweep_clusters_partition_the_stops(self):
+        clusters = sweep_clusters(self.coordinate_list, 4)
+
+        self.assertEqual([len(cluster) for cluster in clusters], [10] * 4)
+        self.assertEqual(sorted(sum(clusters, [])), list(range(1, 41)))
+
+    def test_decomposed_routes_visit_every_stop(self):
+        data = {
+            "list_cord": self.coordinate_list,
+            "num_vehicles": 4,
+            "vehicle_maximum_travel_distance": 300000,
+            "search_budget": {"time_limit": 1},
+        }
+        decomposition = Decomposition(data, self.submit, cluster_stops=10)
+
+        response = decomposition.solve()
+
+        self.assertEqual(response["clusters"], 4)
+        self.assertEqual(len(response["routes"]), 4)
+        self.assertEqual(sorted(sum(response["routes"], [])), list(range(1, 41)))
+        self.assertEqual(
+            response["objective"],
+            routes_objective(self.coordinate_list, response["routes"]),
+        )
+
+
+class HeuristicTests(SimpleTestCase):
+    def setUp(self):
+        self.tsp = generate_instance("tsp", 60, seed=2)
+        self.vrp = generate_instance("vrp", 60, seed=2)
+
+    def test_local_search_improves_nearest_neighbour_tour(self):
+        matrix = haversine_matrix(self.tsp["list_cord"], self.tsp["list_cord"])
+        tour = heuristic.nearest_neighbour_tour(matrix, np.arange(1, 60))
+
+        (route,) = heuristic.solve(matrix)
+
+        self.assertEqual(sorted(route), list(range(1, 60)))
+        self.assertLess(
+            heuristic.path_cost(matrix, np.array([0] + route + [0])),
+            heuristic.path_cost(matrix, np.concatenate([[0], tour, [0]])),
+        )
+
+    def test_fast_tier_answers_like_the_solver(self):
+        for data in (self.tsp, self.vrp):
+            solver = route_finder_from_request(data, [{"solution_limit": 10}])[1]()
+            route, solve = route_finder_from_request(dict(data, tier="fast"), [])
+            fast = solve()
+
+            self.assertEqual(set(fast), set(solver))
+            self.assertEqual(sorted(sum(fast["routes"], [])), list(range(1, 60)))
+            self.assertEqual(route.metrics()["status"], "HEURISTIC_SUCCESS")
+
+    def test_fast_vehicle_routes_are_balanced(self):
+        data = dict(self.vrp, tier="fast", output="structured", num_vehicles=3)
+        response = route_finder_from_request(data, [])[1]()
+
+        distances = response["route_distances"]
+        self.assertEqual(len(response["routes"]), 3)
+        self.assertEqual(
+            response["objective"],
+            sum(distances) + GLOBAL_SPAN_COST_COEFFICIENT * max(distances),
+        )
+
+    def test_fast_tier_rejects_time_windows(self):
+        data = dict(generate_instance("vrptw", 10), tier="fast")
+        data["time_matrix"] = time_matrix(data["list_cord"]).tolist()
+
+        with self.assertRaisesMessage(ValueError, "time windows"):
+            route_finder_from_request(data, [])
+
+
+class LowerBoundTests(SimpleTestCase):
+    def test_held_karp_bound_is_below_the_optimal_tour(self):
+        coordinates = DistanceMatrixTests.coordinate_list
+        matrix = haversine_matrix(coordinates, coordinates)
+        optimum = min(
+            heuristic.path_cost(matrix, np.array((0,) + tour + (0,)))
+            for tour in itertools.permutations(range(1, 7))
+        )
+
+        bound = held_karp_bound(matrix, iterations=50)
+
+        self.assertLessEqual(bound, optimum)
+        self.assertGreater(bound, 0.95 * optimum)
+
+    def test_search_stops_at_the_target_gap(self):
+        data = dict(
+            generate_instance("tsp", 60, seed=3),
+            search_budget={
+                "time_limit": 10,
+                "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+            },
+            target_gap=0.2,
+        )
+        started = time.monotonic()
+        route, solve = route_finder_from_request(data, [])
+        response = solve()
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertLessEqual(response["gap"], 0.2)
+        self.assertLessEqual(response["lower_bound"], route.objective)
+        self.assertIn("bound", route.metrics()["phases"])
+
+    def test_target_gap_must_be_a_fraction(self):
+        data = dict(generate_instance("tsp", 10), target_gap=1)
+
+        with self.assertRaises(ValueError):
+            route_finder_from_request(data, [])
+
+
+class SpeedProfileTests(SimpleTestCase):
+    def test_time_matrices_follow_speed_and_time_of_day(self):
+        distances = np.array([[0, 1000, 2000], [1000, 0, 1500], [2000, 1500, 0]])
+        profile = {"vehicle_speeds": [60, 30, 60], "time_of_day": [[100, 2.0]]}
+
+        matrices = travel_time_matrices(
+            distances, profile, [[0, 50], [100, 200], [40, 90]], num_vehicles=3
+        )
+
+        self.assertIs(matrices[0], matrices[2])
+        self.assertEqual(matrices[0].tolist(), [[0, 1, 2], [2, 0, 3], [2, 2, 0]])
+        self.assertEqual(matrices[1].tolist(), [[0, 2, 4], [4, 0, 6], [4, 3, 0]])
+
+    def test_derived_time_matrix_solves_like_an_uploaded_one(self):
+        data = dict(generate_instance("vrptw", 20, seed=1), output="structured")
+        cache = DistanceMatrixCache(max_bytes=1024 * 1024)
+        derived = route_finder_from_request(data, [], matrix_cache=cache)[1]()
+        uploaded = dict(data, time_matrix=time_matrix(data["list_cord"]))
+        del uploaded["speed_profile"]
+        route, solve = route_finder_from_request(uploaded, [])
+        route.data["num_vehicles"] = data["num_vehicles"]
+        route.allow_waiting_time = route.maximum_time_per_vehicle = 480
+
+        self.assertEqual(derived, solve())
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_vehicles_travel_at_their_own_speed(self):
+        data = dict(
+            generate_instance("vrptw", 20, seed=1),
+            speed_profile={"vehicle_speeds": [30, 60, 30, 60]},
+            output="structured",
+        )
+        route, solve = route_finder_from_request(data, [])
+        response = solve()
+
+        for vehicle_id, times in enumerate(route.vehicle_time_matrices):
+            path = [0] + response["routes"][vehicle_id] + [0]
+            self.assertEqual(
+                response["route_times"][vehicle_id],
+                int(times[path[:-1], path[1:]].sum()),
+            )
+
+    def test_speed_profile_needs_a_speed(self):
+        data = dict(generate_instance("vrptw", 10), speed_profile={"time_of_day": []})
+
+        with self.assertRaisesMessage(ValueError, "speed"):
+            route_finder_from_request(data, [])
+
+
+class ArcPruningTests(SimpleTestCase):
+    def test_arcs_missing_the_window_are_infeasible(self):
+        times = np.full((4, 4), 5)
+        windows = [[0, 100], [0, 10], [20, 30], [50, 60]]
+
+        infeasible = infeasible_arcs(times, windows, max_waiting=20, horizon=100)
+
+        # 2 -> 1 arrives after 1 closes, 1 -> 3 waits more than 20.
+        self.assertEqual(
+            np.argwhere(infeasible).tolist(), [[1, 3], [2, 1], [3, 1], [3, 2]]
+        )
+
+    def test_pruning_keeps_the_solution(self):
+        data = dict(
+            generate_instance("vrptw", 40, seed=2),
+            search_budget={"solution_limit": 20},
+        )
+        pruned, solve_pruned = route_finder_from_request(data, [])
+        full, solve_full = route_finder_from_request(dict(data, prune_arcs=False), [])
+
+        self.assertEqual(solve_pruned(), solve_full())
+        self.assertGreater(pruned.metrics()["pruned_arcs"], 0)
+        self.assertNotIn("pruned_arcs", full.metrics())
+
+    def test_flags_are_parsed_strictly(self):
+        data = generate_instance("vrptw", 10, seed=2)
+
+        route, _ = route_finder_from_request(
+            dict(data, prune_arcs="false", report_gap="True"), []
+        )
+        self.assertFalse(route.prune_arcs)
+        self.assertTrue(route.report_gap)
+        for value in ("no", 0, None):
+            with self.assertRaises(ValueError):
+                route_finder_from_request(dict(data, prune_arcs=value), [])
+
+    def test_arcs_only_the_slowest_vehicle_can_take_are_kept(self):
+        fast = [[0, 1, 1], [1, 0, 1], [1, 1, 0]]
+        slow = [[0, 10, 55], [10, 0, 45], [55, 45, 0]]
+
+        def route_finder(prune_arcs):
+            return RouteFinder(
+                time_matrix=fast,
+                vehicle_time_matrices=[fast, slow],
+                time_windows=[[0, 0], [10, 10], [55, 55]],
+                num_vehicles=2,
+                allow_waiting_time=0,
+                maximum_time_per_vehicle=120,
+                prune_arcs=prune_arcs,
+                search_budget={"time_limit": 1},
+            )
+
+        pruned, full = route_finder(True), route_finder(False)
+        pruned.time_window_constraint_solution()
+        full.time_window_constraint_solution()
+
+        self.assertEqual(full.objective, 110)
+        self.assertEqual(pruned.objective, full.objective)
+
+
+class MatrixFileTests(SimpleTestCase):
+    coordinate_list = DistanceMatrixTests.coordinate_list
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_streamed_matrix_maps_back_as_int32(self):
+        matrix = MappedMatrix.from_coordinates(
+            self.coordinate_list, self.directory, chunk_size=3
+        )
+        mapping, view = matrix.attach()
+
+        self.assertEqual(view.dtype, np.int32)
+        self.assertFalse(view.flags.writeable)
+        np.testing.assert_array_equal(
+            view, haversine_matrix(self.coordinate_list, self.coordinate_list)
+        )
+        del view
+        mapping.close()
+        matrix.release()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_header_records_unit_and_shape(self):
+        path = os.path.join(self.directory, "times.tspm")
+        write_matrix_file(path, [[[0, 5, 7]], [[5, 0, 2]]], (2, 3), unit="seconds")
+
+        mapping, unit, view = open_matrix_file(path)
+
+        self.assertEqual(unit, "seconds")
+        self.assertEqual(view.tolist(), [[0, 5, 7], [5, 0, 2]])
+        del view
+        mapping.close()
+
+    def test_mapped_matrix_is_solved_through_the_callback(self):
+        problem = {"list_cord": self.coordinate_list, "num_vehicles": 1}
+        with self.settings(ROUTE_MMAP_THRESHOLD=5, ROUTE_MATRIX_DIR=self.directory):
+            mapped, shared = share_matrices(problem)
+            asked, asked_shared = share_matrices(dict(problem, transit_mode="matrix"))
+        small, small_shared = share_matrices(problem)
+        for matrices in (shared, asked_shared, small_shared):
+            for matrix in matrices.values():
+                matrix.release()
+
+        self.assertIsInstance(shared["distance_matrix"], MappedMatrix)
+        self.assertEqual(mapped["transit_mode"], "callback")
+        self.assertEqual(asked["transit_mode"], "matrix")
+        self.assertNotIn("transit_mode", small)
+
+    def test_short_write_leaves_no_file(self):
+        path = os.path.join(self.directory, "short.tspm")
+
+        with self.assertRaises(ValueError):
+            write_matrix_file(path, [[[0, 1]]], (2, 2))
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_instances_are_reproducible(self):
+        first = generate_instance("vrptw", 30, seed=4)
+
+        self.assertEqual(first, generate_instance("vrptw", 30, seed=4))
+        self.assertNotEqual(first, generate_instance("vrptw", 30, seed=5))
+        self.assertEqual(len(first["time_windows"]), 30)
+
+    def test_run_records_every_phase(self):
+        result = run_instance("vrp", 20, 0, [{"time_limit": 1}])
+
+        self.assertIsNotNone(result["objective"])
+        self.assertEqual(
+            set(result["timings"]), {"matrix", "model", "solve", "response"}
+        )
+
+    def test_regression_fails_the_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, "baseline.json")
+            options = {"kinds": ["tsp"], "sizes": [20], "baseline": baseline}
+            call_command(
+                "benchmark_routes", save_baseline=True, stdout=io.StringIO(), **options
+            )
+            call_command("benchmark_routes", stdout=io.StringIO(), **options)
+
+            with open(baseline) as f:
+                saved = json.load(f)
+            saved["results"]["tsp-20-seed0"]["objective"] //= 2
+            with open(baseline, "w") as f:
+                json.dump(saved, f)
+            with self.assertRaisesMessage(CommandError, "tsp-20-seed0: objective"):
+                call_command("benchmark_routes", stdout=io.StringIO(), **options)
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = Histogram("solve_seconds", "Solve time.", (1, 5), ("phase",))
+        histogram.observe(0.5, "solve")
+        histogram.observe(3, "solve")
+
+        self.assertEqual(
+            histogram.render(),
+            [
+                "# HELP solve_seconds Solve time.",
+                "# TYPE solve_seconds histogram",
+                'solve_seconds_bucket{phase="solve",le="1"} 1',
+                'solve_seconds_bucket{phase="solve",le="5"} 2',
+                'solve_seconds_bucket{phase="solve",le="+Inf"} 2',
+                'solve_seconds_sum{phase="solve"} 3.5',
+                'solve_seconds_count{phase="solve"} 2',
+            ],
+        )
+
+
+class CompactPayloadTests(APITestCase, URLPatternsTestCase):
+    urlpatterns = [path("api/", include("traveller.urls"))]
+
+    time_matrix = [
+        [0, 6, 9, 8, 7, 3, 6, 2, 3, 2, 6, 6, 4, 4, 5, 9, 7],
+        [6, 0, 8, 3, 2, 6, 8, 4, 8, 8, 13, 7, 5, 8, 12, 10, 14],
+        [9, 8, 0, 11, 10, 6, 3, 9, 5, 8, 4, 15, 14, 13, 9, 18, 9],
+        [8, 3, 11, 0, 1, 7, 10, 6, 10, 10, 14, 6, 7, 9, 14, 6, 16],
+        [7, 2, 10, 1, 0, 6, 9, 4, 8, 9, 13, 4, 6, 8, 12, 8, 14],
+        [3, 6, 6, 7, 6, 0, 2, 3, 2, 2, 7, 9, 7, 7, 6, 12, 8],
+        [6, 8, 3, 10, 9, 2, 0, 6, 2, 5, 4, 12, 10, 10, 6, 15, 5],
+        [2, 4, 9, 6, 4, 3, 6, 0, 4, 4, 8, 5, 4, 3, 7, 8, 10],
+        [3, 8, 5, 10, 8, 2, 2, 4, 0, 3, 4, 9, 8, 7, 3, 13, 6],
+        [2, 8, 8, 10, 9, 2, 5, 4, 3, 0, 4, 6, 5, 4, 3, 9, 5],
+        [6, 13, 4, 14, 13, 7, 4, 8, 4, 4, 0, 10, 9, 8, 4, 13, 4],
+        [6, 7, 15, 6, 4, 9, 12, 5, 9, 6, 10, 0, 1, 3, 7, 3, 10],
+        [4, 5, 14, 7, 6, 7, 10, 4, 8, 5, 9, 1, 0, 2, 6, 4, 8],
+        [4, 8, 13, 9, 8, 7, 10, 3, 7, 4, 8, 3, 2, 0, 4, 5, 6],
+        [5, 12, 9, 14, 12, 6, 6, 7, 3, 3, 4, 7, 6, 4, 0, 9, 2],
+        [9, 10, 18, 6, 8, 12, 15, 8, 13, 9, 13, 3, 4, 5, 9, 0, 9],
+        [7, 14, 9, 16, 14, 8, 5, 10, 6, 5, 4, 10, 8, 6, 2, 9, 0],
+    ]
+    time_windows = [[0, 5], [7, 12], [10, 15], [16, 18], [10, 13], [0, 5], [5, 10], [0, 4], [5, 10], [0, 3], [10, 16], [10, 15], [0, 5], [5, 10], [7, 8], [10, 15], [11, 15]]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        upload_dir = self.settings(ROUTE_MATRIX_UPLOAD_DIR=directory.name)
+        upload_dir.enable()
+        self.addCleanup(upload_dir.disable)
+        executor = mock.patch(
+            "traveller.views.get_solver_executor",
+            return_value=SolverExecutor(workers=1, queue_size=0),
+        )
+        self.addCleanup(executor.stop)
+        self.addCleanup(executor.start().return_value.pool.shutdown)
+
+    def solve(self, time_matrix):
+        body = {"time_matrix": time_matrix, "time_windows": self.time_windows}
+        return self.client.generic(
+            "GET", reverse("route"), json.dumps(body), "application/json"
+        )
+
+    def solution(self, time_matrix):
+        response = self.solve(time_matrix)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {key: value for key, value in response.data.items() if key != "metrics"}
+
+    def test_base64_matrix_is_a_view_of_the_payload(self):
+        cells = np.asarray(self.time_matrix, dtype="<i4")
+        encoded = {
+            "encoding": "base64",
+            "shape": list(cells.shape),
+            "data": base64.b64encode(cells.tobytes()).decode(),
+        }
+
+        matrix = decode_matrix(encoded)
+
+        self.assertFalse(matrix.flags.owndata)
+        self.assertFalse(matrix.flags.writeable)
+        np.testing.assert_array_equal(matrix, cells)
+        self.assertEqual(self.solution(encoded), self.solution(self.time_matrix))
+
+    def test_malformed_matrix_is_rejected(self):
+        response = self.solve({"encoding": "base64", "shape": [3, 3], "data": "AAAA"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_inline_matrix_is_rejected(self):
+        def npy(matrix):
+            stream = io.BytesIO()
+            np.save(stream, matrix)
+            return {
+                "encoding": "npy",
+                "data": base64.b64encode(stream.getvalue()).decode(),
+            }
+
+        cells = np.asarray(self.time_matrix, dtype=np.int64)
+        negative = cells.copy()
+        negative[1, 2] = -3
+        too_large = cells.copy()
+        too_large[1, 2] = 2**31
+        for time_matrix in (
+            npy(cells[:, :-1]),
+            npy(negative),
+            npy(too_large),
+            npy(cells[:-1, :-1]),
+            self.time_matrix[:-1],
+        ):
+            response = self.solve(time_matrix)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(
+            self.solution(npy(cells.astype(np.float64))),
+            self.solution(self.time_matrix),
+        )
+
+    def test_uploaded_npy_matrix_is_referenced_by_id(self):
+        npy = io.BytesIO()
+        np.save(npy, np.asarray(self.time_matrix, dtype=np.int32))
+        upload = self.client.post(
+            reverse("matrix-upload"),
+            npy.getvalue(),
+            content_type="application/x-npy",
+        )
+
+        self.assertEqual(upload.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(upload.data["shape"], [17, 17])
+        self.assertEqual(
+            self.solution({"matrix_id": upload.data["matrix_id"]}),
+            self.solution(self.time_matrix),
+        )
+
+    def test_invalid_uploaded_matrix_is_rejected(self):
+        for matrix in (
+            [[0, 5, 7], [5, 0, 2]],
+            [[0, -5], [5, 0]],
+            [[0, 2**31], [5, 0]],
+            [[0, 1.5], [5, 0]],
+        ):
+            upload = self.client.post(
+                reverse("matrix-upload"), {"matrix": matrix}, format="json"
+            )
+            self.assertEqual(upload.status_code, status.HTTP_400_BAD_REQUEST, matrix)
+
+        npy = io.BytesIO()
+        np.save(npy, np.array([[0, np.inf], [5, 0]]))
+        upload = self.client.post(
+            reverse("matrix-upload"), npy.getvalue(), content_type="application/x-npy"
+        )
+        self.assertEqual(upload.status_code, status.HTTP_400_BAD_REQUEST)
+
+        upload = self.client.post(
+            reverse("matrix-upload") + "?unit=seconds",
+            {"matrix": self.time_matrix},
+            format="json",
+        )
+        self.assertEqual(upload.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_gzip_request_body_is_decompressed(self):
+        body = {"time_matrix": self.time_matrix, "time_windows": self.time_windows}
+        response = self.client.generic(
+            "GET",
+            reverse("route"),
+            gzip.compress(json.dumps(body).encode()),
+            "application/json",
+            HTTP_CONTENT_ENCODING="gzip",
+        )
+        unsupported = self.client.generic(
+            "GET",
+            reverse("route"),
+            b"{}",
+            "application/json",
+            HTTP_CONTENT_ENCODING="br",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("Objective", response.data)
+        self.assertEqual(unsupported.status_code, 415)
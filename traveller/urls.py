@@ -1,4 +1,15 @@
 from django.urls import path
 from traveller import views
 
-urlpatterns = [path("getroute/", views.ObtainBestRoute.as_view(), name="route")]
+urlpatterns = [
+    path("getroute/", views.ObtainBestRoute.as_view(), name="route"),
+    path("async/getroute/", views.solve_route_async, name="route-async"),
+    path("stream/getroute/", views.StreamRoute.as_view(), name="route-stream"),
+    path("reoptimize/", views.ReoptimizeRoute.as_view(), name="reoptimize"),
+    path("batch/", views.SolveBatch.as_view(), name="batch"),
+    path("jobs/", views.SubmitSolveJob.as_view(), name="job-submit"),
+    path("jobs/<uuid:job_id>/", views.SolveJobStatus.as_view(), name="job-status"),
+    path("cache/stats/", views.MatrixCacheStats.as_view(), name="cache-stats"),
+    path("metrics/", views.Metrics.as_view(), name="metrics"),
+    path("matrices/", views.UploadMatrix.as_view(), name="matrix-upload"),
+]
@@ -1,14 +1,383 @@
 """Simple travelling salesman problem between cities."""
+
 import math, logging
+import time
+from contextlib import contextmanager
 from math import cos
 from math import sin
 from math import asin
 from math import sqrt
 from math import radians
 
+import numpy as np
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 
+from traveller import heuristic
+from traveller.bounds import routing_bound
+from traveller.cache import matrix_key
+from traveller.condensed import CondensedMatrix
+from traveller.constant import (
+    BATCH_MATRIX_CELLS,
+    DEADLINE_RESPONSE_SECONDS,
+    DEADLINE_TOLERANCE_SECONDS,
+    DISTANCE_MATRIX_CHUNK_SIZE,
+    GLOBAL_SPAN_COST_COEFFICIENT,
+    HELD_KARP_ITERATIONS,
+    LOWER_BOUND_MAX_STOPS,
+    SPARSE_FALLBACK_FACTOR,
+)
+from traveller.metrics import solver_status
+from traveller.speeds import travel_time_matrices
+
+
+def build_search_parameters(search_budget=None):
+    """Builds OR-tools search parameters from a search budget.
+
+    ``search_budget`` is a dict with the optional keys ``time_limit`` (seconds),
+    ``solution_limit``, ``first_solution_strategy`` and
+    ``local_search_metaheuristic``, the latter two given by their OR-tools enum
+    name (e.g. ``"SAVINGS"``, ``"GUIDED_LOCAL_SEARCH"``).
+    """
+    search_budget = search_budget or {}
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    first_solution_strategy = search_budget.get(
+        "first_solution_strategy", "PATH_CHEAPEST_ARC"
+    )
+    metaheuristic = search_budget.get("local_search_metaheuristic")
+    time_limit = search_budget.get("time_limit")
+    solution_limit = search_budget.get("solution_limit")
+
+    for field, enum, name in (
+        (
+            "first_solution_strategy",
+            routing_enums_pb2.FirstSolutionStrategy.Value,
+            first_solution_strategy,
+        ),
+        (
+            "local_search_metaheuristic",
+            routing_enums_pb2.LocalSearchMetaheuristic.Value,
+            metaheuristic,
+        ),
+    ):
+        if not name:
+            continue
+        if name not in enum.keys():
+            raise ValueError("Unknown {} {}".format(field, name))
+        setattr(search_parameters, field, enum.Value(name))
+
+    if time_limit:
+        search_parameters.time_limit.FromMilliseconds(int(float(time_limit) * 1000))
+    if solution_limit:
+        search_parameters.solution_limit = int(solution_limit)
+    # Metaheuristics other than greedy descent only stop on a limit.
+    if metaheuristic not in (None, "AUTOMATIC", "GREEDY_DESCENT") and not (
+        time_limit or solution_limit
+    ):
+        raise ValueError(
+            "{} requires a time_limit or solution_limit".format(metaheuristic)
+        )
+    return search_parameters
+
+
+def default_search_budget(search_budgets, num_stops, requested_budget=None):
+    """Returns the first server side budget whose ``max_stops`` covers
+    ``num_stops`` with the fields of ``requested_budget`` applied on top.
+    """
+    budget = {}
+    for tier in search_budgets:
+        if tier.get("max_stops") is None or num_stops <= tier["max_stops"]:
+            budget = {key: value for key, value in tier.items() if key != "max_stops"}
+            break
+    budget.update(requested_budget or {})
+    return budget
+
+
+# Quality tiers a request can pick with "tier": the OR-tools search or the
+# NumPy heuristic.
+TIERS = ("solver", "fast")
+
+# How a matrix reaches the solver, see RouteFinder.register_transit.
+TRANSIT_MODES = ("matrix", "callback")
+
+
+def route_finder_from_request(
+    data,
+    search_budgets,
+    distance_matrix=None,
+    time_matrix=None,
+    matrix_cache=None,
+    edge_store=None,
+    **kwargs
+):
+    """Builds the RouteFinder described by a route request payload.
+
+    Returns the finder together with the solve method for the problem type, or
+    ``None`` when the payload describes no problem. ``distance_matrix`` and
+    ``time_matrix`` replace the matrices derived from the payload when given,
+    ``matrix_cache`` serves and keeps whole distance matrices and
+    ``edge_store`` the distances between individual stops, extra
+    ``kwargs`` are passed to RouteFinder. A time window payload with a
+    "speed_profile" and no "time_matrix" is solved on travel times derived
+    from the distances of its stops. Raises ValueError for an invalid search
+    budget, tier, transit mode, speed profile or flag.
+    """
+    coordinate_list = data.get("list_cord", None)
+    num_vehicles = data.get("num_vehicles", None)
+    vehicle_maximum_travel_distance = data.get("vehicle_maximum_travel_distance", None)
+    if time_matrix is None:
+        time_matrix = data.get("time_matrix", None)
+    time_windows = data.get("time_windows", None)
+    kwargs.setdefault("transit_mode", data.get("transit_mode", "matrix"))
+    kwargs.setdefault("initial_routes", data.get("routes", None))
+    kwargs.setdefault("output", data.get("output", "text"))
+    kwargs.setdefault("prune_arcs", request_flag(data, "prune_arcs", True))
+    kwargs.setdefault("report_gap", request_flag(data, "report_gap", False))
+    kwargs.setdefault("target_gap", data.get("target_gap", None))
+    search_budget = data.get("search_budget", None)
+    tier = data.get("tier", "solver")
+    if tier not in TIERS:
+        raise ValueError("Unknown tier {}".format(tier))
+
+    if time_matrix is not None and len(time_matrix) and time_windows:
+        if tier == "fast":
+            raise ValueError("The fast tier does not support time windows")
+        route = RouteFinder(
+            time_matrix=time_matrix,
+            time_windows=time_windows,
+            num_vehicles=4,
+            allow_waiting_time=30,
+            maximum_time_per_vehicle=30,
+            depot=0,
+            search_budget=default_search_budget(
+                search_budgets, len(time_matrix), search_budget
+            ),
+            **kwargs
+        )
+        return route, route.by_deadline(route.time_window_constraint_solution)
+
+    if derives_time_matrix(data):
+        if tier == "fast":
+            raise ValueError("The fast tier does not support time windows")
+        started = time.perf_counter()
+        if distance_matrix is None:
+            distance_matrix = DistanceMatrix(
+                coordinate_list,
+                chunk_size=DISTANCE_MATRIX_CHUNK_SIZE,
+                cache=matrix_cache,
+                edge_store=edge_store,
+                condensed=True,
+            ).create_distance_matrix()
+        num_vehicles = num_vehicles or 4
+        time_matrices = travel_time_matrices(
+            distance_matrix, data["speed_profile"], time_windows, num_vehicles
+        )
+        matrix_time = time.perf_counter() - started
+        route = RouteFinder(
+            time_matrix=time_matrices[0],
+            vehicle_time_matrices=time_matrices,
+            time_windows=time_windows,
+            num_vehicles=num_vehicles,
+            allow_waiting_time=data.get("allow_waiting_time", 30),
+            maximum_time_per_vehicle=data.get("maximum_time_per_vehicle", 30),
+            depot=0,
+            search_budget=default_search_budget(
+                search_budgets, len(coordinate_list), search_budget
+            ),
+            **kwargs
+        )
+        route.timings["matrix"] = matrix_time
+        return route, route.by_deadline(route.time_window_constraint_solution)
+
+    if coordinate_list and num_vehicles:
+        started = time.perf_counter()
+        if distance_matrix is None and data.get("sparse_neighbors", None):
+            distance_matrix = SparseDistanceGraph(
+                coordinate_list, int(data["sparse_neighbors"]), depot=0
+            )
+        if distance_matrix is None:
+            matrix = DistanceMatrix(
+                coordinate_list,
+                chunk_size=DISTANCE_MATRIX_CHUNK_SIZE,
+                cache=matrix_cache,
+                edge_store=edge_store,
+                condensed=True,
+            )
+            distance_matrix = matrix.create_distance_matrix()
+        matrix_time = time.perf_counter() - started
+        route = RouteFinder(
+            distance_matrix=distance_matrix,
+            coordinate_list=coordinate_list,
+            num_vehicles=num_vehicles,
+            depot=0,
+            vehicle_maximum_travel_distance=vehicle_maximum_travel_distance,
+            search_budget=default_search_budget(
+                search_budgets, len(coordinate_list), search_budget
+            ),
+            **kwargs
+        )
+        route.timings["matrix"] = matrix_time
+        if tier == "fast":
+            return route, route.fast_solution
+        if num_vehicles == 1:
+            return route, route.by_deadline(route.traveling_salesperson_solution)
+        return route, route.by_deadline(route.vehicle_routing_solution)
+
+    return None
+
+
+def request_flag(data, key, default):
+    """Returns the boolean ``key`` of a request payload, given as a JSON
+    boolean or the string "true" or "false".
+    """
+    value = data.get(key, default)
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    if not isinstance(value, bool):
+        raise ValueError("{} must be true or false".format(key))
+    return value
+
+
+def derives_time_matrix(data):
+    """Whether ``data`` is a time window problem whose time matrix is derived
+    from its "list_cord" and "speed_profile".
+    """
+    time_matrix = data.get("time_matrix", None)
+    return bool(
+        data.get("speed_profile", None)
+        and data.get("list_cord", None)
+        and data.get("time_windows", None)
+        and (time_matrix is None or not len(time_matrix))
+    )
+
+
+def sparse_neighbors(data, sparse_threshold, default_neighbors):
+    """Returns the number of candidate neighbours per stop to solve ``data``
+    with, or ``None`` for a dense distance matrix.
+
+    The payload may ask for a candidate graph with ``sparse_neighbors``,
+    otherwise one is used once the stop count exceeds ``sparse_threshold``.
+    """
+    if data.get("sparse_neighbors", None):
+        return int(data["sparse_neighbors"])
+    if len(data.get("list_cord", None) or []) > sparse_threshold:
+        return default_neighbors
+    return None
+
+
+def apply_stop_delta(data):
+    """Applies the ``remove_stops`` / ``add_stops`` delta of a re-optimization
+    payload to the ``list_cord`` and ``routes`` of the previous solution.
+
+    ``remove_stops`` are indexes into the previous ``list_cord`` and
+    ``add_stops`` coordinates appended to it. Returns a route payload for the
+    new stop list whose ``routes`` keep the previous visiting order of the
+    remaining stops, new stops are inserted later by RouteFinder. Raises
+    ValueError for an inconsistent delta.
+    """
+    coordinate_list = data.get("list_cord", None)
+    routes = data.get("routes", None)
+    if not coordinate_list or not isinstance(routes, list):
+        raise ValueError("list_cord and routes of the previous solution are required")
+
+    remove_stops = data.get("remove_stops", None) or []
+    for stop in remove_stops:
+        if not isinstance(stop, int) or not 0 <= stop < len(coordinate_list):
+            raise ValueError("remove_stops must be indexes into list_cord")
+    if 0 in remove_stops:
+        raise ValueError("The depot cannot be removed")
+    for route in routes:
+        for stop in route:
+            if not isinstance(stop, int) or not 0 < stop < len(coordinate_list):
+                raise ValueError("routes must be indexes into list_cord")
+
+    removed = set(remove_stops)
+    kept = [stop for stop in range(len(coordinate_list)) if stop not in removed]
+    new_index = {stop: index for index, stop in enumerate(kept)}
+    payload = {
+        key: value
+        for key, value in data.items()
+        if key not in ("add_stops", "remove_stops")
+    }
+    payload["list_cord"] = [coordinate_list[stop] for stop in kept] + list(
+        data.get("add_stops", None) or []
+    )
+    payload["routes"] = [
+        [new_index[stop] for stop in route if stop in new_index] for route in routes
+    ]
+    return payload
+
+
+def insert_missing_stops(routes, matrix, depot=0):
+    """Completes ``routes`` by inserting every stop they do not visit at the
+    position of least added cost.
+    """
+    if not isinstance(matrix, (CondensedMatrix, SparseDistanceGraph)):
+        matrix = np.asarray(matrix)
+    routes = [list(route) for route in routes]
+    visited = {stop for route in routes for stop in route}
+    for stop in range(len(matrix)):
+        if stop == depot or stop in visited:
+            continue
+        best = None
+        for vehicle_id, route in enumerate(routes):
+            path = np.array([depot] + route + [depot])
+            stops = np.full(len(path) - 1, stop)
+            added_cost = (
+                arc_costs(matrix, path[:-1], stops)
+                + arc_costs(matrix, stops, path[1:])
+                - arc_costs(matrix, path[:-1], path[1:])
+            )
+            position = int(np.argmin(added_cost))
+            if best is None or added_cost[position] < best[0]:
+                best = (added_cost[position], vehicle_id, position)
+        routes[best[1]].insert(best[2], stop)
+    return routes
+
+
+def infeasible_arcs(
+    time_matrix, time_windows, max_waiting, horizon, depot=0, slowest_matrix=None
+):
+    """Returns the boolean matrix of the arcs no route can take.
+
+    Leaving ``i`` at the earliest when its window opens still reaches ``j``
+    after its window (or the ``horizon``) closes, or leaving ``i`` at the
+    latest reaches ``j`` so early that it waits more than ``max_waiting``.
+    With vehicles of different speeds ``time_matrix`` holds the fastest and
+    ``slowest_matrix`` the slowest travel times: arriving too late is tested
+    for the fastest vehicle, waiting too long for the slowest.
+    Arcs into the depot, which has no window at the route ends, are kept.
+    """
+    times = np.asarray(time_matrix, dtype=np.int64)
+    slowest = times if slowest_matrix is None else np.asarray(slowest_matrix)
+    windows = np.asarray(time_windows, dtype=np.int64).reshape(-1, 2)
+    opens = windows[:, 0]
+    closes = np.minimum(windows[:, 1], horizon)
+    infeasible = opens[:, np.newaxis] + times > closes[np.newaxis, :]
+    infeasible |= closes[:, np.newaxis] + slowest + max_waiting < opens[np.newaxis, :]
+    np.fill_diagonal(infeasible, False)
+    infeasible[:, depot] = False
+    return infeasible
+
+
+def path_costs(matrix, path):
+    """Returns the cost of every arc along the node array ``path``."""
+    return arc_costs(matrix, path[:-1], path[1:])
+
+
+def arc_costs(matrix, sources, targets):
+    """Returns the cost of the arc from every node of the array ``sources`` to
+    the node of ``targets`` at the same position.
+    """
+    if isinstance(matrix, SparseDistanceGraph):
+        return np.array(
+            [matrix.arc_cost(a, b) for a, b in zip(sources, targets)],
+            dtype=np.int64,
+        )
+    if not isinstance(matrix, (np.ndarray, CondensedMatrix)):
+        matrix = np.asarray(matrix, dtype=np.int64)
+    return np.asarray(matrix[sources, targets], dtype=np.int64)
+
 
 class RouteFinder:
     def __init__(
@@ -17,13 +386,53 @@ class RouteFinder:
         time_matrix=None,
         time_windows=None,
         coordinate_list=None,
+        vehicle_time_matrices=None,
         num_vehicles=1,
         depot=0,
         vehicle_maximum_travel_distance=3000,
         allow_waiting_time=30,
         maximum_time_per_vehicle=30,
+        transit_mode="matrix",
+        search_budget=None,
+        solution_callback=None,
+        initial_routes=None,
+        output="text",
+        should_stop=None,
+        deadline=None,
+        response_seconds=DEADLINE_RESPONSE_SECONDS,
+        prune_arcs=True,
+        report_gap=False,
+        target_gap=None,
+        on_target=None,
+        routes_callback=None,
     ):
         self.coordinate_list = coordinate_list
+        self.output = output
+        if transit_mode not in TRANSIT_MODES:
+            raise ValueError("Unknown transit_mode {}".format(transit_mode))
+        self.transit_mode = transit_mode
+        self.search_parameters = build_search_parameters(search_budget)
+        self.solution_callback = solution_callback
+        self.should_stop = should_stop
+        self.deadline = deadline
+        self.response_seconds = response_seconds
+        self.search_end = None
+        self.truncated = False
+        self.prune_arcs = prune_arcs
+        self.pruned_arcs = None
+        if target_gap is not None:
+            target_gap = float(target_gap)
+            if not 0 <= target_gap < 1:
+                raise ValueError("target_gap must be at least 0 and below 1")
+        self.report_gap = report_gap or target_gap is not None
+        self.target_gap = target_gap
+        self.on_target = on_target
+        self.routes_callback = routes_callback
+        self.best_reported = None
+        self.lower_bound = None
+        self.target_objective = None
+        self.target_reached = False
+        self.initial_routes = initial_routes
         self.data = {
             "distance_matrix": distance_matrix,
             "num_vehicles": num_vehicles if num_vehicles else 1,
@@ -33,168 +442,597 @@ class RouteFinder:
         self.allow_waiting_time = allow_waiting_time
         self.maximum_time_per_vehicle = maximum_time_per_vehicle
         self.response = {}
+        self.timings = {}
+        self.objective = None
+        self.status = None
 
         self.data["time_matrix"] = time_matrix
         self.data["time_windows"] = time_windows
+        # The time matrix of every vehicle when their speeds differ.
+        self.vehicle_time_matrices = vehicle_time_matrices
 
-    def traveling_salesperson_response(self, manager, routing, solution):
-        # self.response['Objective'] = '{} miles'.format(solution.ObjectiveValue())
-        index = routing.Start(0)
-        plan_output = "Route for vehicle: "
-        route_distance = 0
-        while not routing.IsEnd(index):
-            plan_output += " {} ->".format(
-                self.coordinate_list[manager.IndexToNode(index)]
+    @contextmanager
+    def phase(self, name):
+        """Adds the seconds spent in the block to ``self.timings[name]``."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = (
+                self.timings.get(name, 0.0) + time.perf_counter() - started
             )
-            previous_index = index
-            index = solution.Value(routing.NextVar(index))
-            route_distance += routing.GetArcCostForVehicle(previous_index, index, 0)
-        plan_output += " {}".format(self.coordinate_list[manager.IndexToNode(index)])
-        self.response["plan_output"] = plan_output
-        self.response["Route distance"] = "{} meters".format(route_distance)
 
-    def traveling_salesperson_solution(self):
-        """Entry point of the program."""
-        # Create the routing index manager.
-        manager = pywrapcp.RoutingIndexManager(
-            len(self.data["distance_matrix"]),
-            self.data["num_vehicles"],
-            self.data["depot"],
-        )
+    def metrics(self):
+        """Returns the phase timings and outcome of the last solve."""
+        if self.data["time_windows"]:
+            problem, stops = "vrptw", len(self.data["time_matrix"])
+        else:
+            stops = len(self.data["distance_matrix"])
+            problem = "tsp" if self.data["num_vehicles"] == 1 else "vrp"
+        metrics = {
+            "problem": problem,
+            "stops": stops,
+            "vehicles": self.data["num_vehicles"],
+            "objective": self.objective,
+            "status": self.status,
+            "phases": dict(self.timings),
+        }
+        if self.pruned_arcs is not None:
+            metrics["pruned_arcs"] = self.pruned_arcs
+        return metrics
+
+    def register_transit(self, manager, routing, matrix_key):
+        """Registers ``self.data[matrix_key]`` as the arc transit.
 
-        # Create Routing Model.
-        routing = pywrapcp.RoutingModel(manager)
+        With ``transit_mode="matrix"`` the whole matrix is handed to the solver
+        once and evaluated natively, keeping Python off the search hot path.
+        ``transit_mode="callback"`` registers a Python closure instead, which is
+        called for every arc evaluation. A SparseDistanceGraph is always
+        evaluated through a callback since it has no dense form.
+        """
+        return self.register_matrix(manager, routing, self.data[matrix_key])
+
+    def register_matrix(self, manager, routing, matrix):
+        if isinstance(matrix, SparseDistanceGraph):
+            return routing.RegisterTransitCallback(
+                lambda from_index, to_index: matrix.arc_cost(
+                    manager.IndexToNode(from_index), manager.IndexToNode(to_index)
+                )
+            )
+        if self.transit_mode == "matrix":
+            # OR-tools only takes nested lists, about 40 bytes a cell while
+            # registering on top of its own 8 byte copy, even from a mapped
+            # matrix. Mapped matrices default to the callback mode, which
+            # reads the cells where they are.
+            return routing.RegisterTransitMatrix(
+                [np.asarray(row, dtype=np.int64).tolist() for row in matrix]
+            )
 
-        def distance_callback(from_index, to_index):
-            """Returns the distance between the two nodes."""
-            # Convert from routing variable Index to distance matrix NodeIndex.
+        def transit_callback(from_index, to_index):
+            """Returns the transit between the two nodes."""
+            # Convert from routing variable Index to matrix NodeIndex.
             from_node = manager.IndexToNode(from_index)
             to_node = manager.IndexToNode(to_index)
-            return self.data["distance_matrix"][from_node][to_node]
+            return int(matrix[from_node][to_node])
 
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+        return routing.RegisterTransitCallback(transit_callback)
 
-        # Define cost of each arc.
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    def register_vehicle_transits(self, manager, routing):
+        """Registers the time matrix of every vehicle, once per distinct
+        matrix, and returns the transit index of every vehicle.
+        """
+        registered = {}
+        transits = []
+        for matrix in self.vehicle_matrices("time_matrix"):
+            if id(matrix) not in registered:
+                registered[id(matrix)] = self.register_matrix(manager, routing, matrix)
+            transits.append(registered[id(matrix)])
+        return transits
 
-        # Setting first solution heuristic.
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    def vehicle_matrices(self, matrix_key):
+        """Returns the ``matrix_key`` matrix each vehicle travels on."""
+        if matrix_key == "time_matrix" and self.vehicle_time_matrices is not None:
+            return self.vehicle_time_matrices
+        return [self.data[matrix_key]] * self.data["num_vehicles"]
+
+    def solve_with_parameters(self, manager, routing):
+        """Solves ``routing`` with the search budget, reporting the objective of
+        every solution to ``solution_callback`` and the objective and routes of
+        every improving one to ``routes_callback`` when they are set.
+        The search ends with its best solution so far once ``should_stop``
+        returns true.
+
+        When starting_routes gives routes the search starts from them instead
+        of building a first solution.
+        """
+        self.compute_lower_bound()
+        self.search_end = self.apply_deadline()
+        with self.phase("solve"):
+            solution = self.search(manager, routing)
+        self.status = solver_status(routing)
+        # Ended by the deadline rather than a local optimum, OR-tools may stop
+        # a few milliseconds short of its time limit.
+        self.truncated = (
+            self.search_end is not None
+            and time.time() >= self.search_end - DEADLINE_TOLERANCE_SECONDS
+        )
+        if solution:
+            self.objective = solution.ObjectiveValue()
+        return solution
+
+    def apply_deadline(self):
+        """Lowers the search time limit to what is left until ``deadline``, a
+        time.time() timestamp, keeping ``response_seconds`` for the search to
+        overrun its limit and the response to reach the view. Returns when the
+        search is due to end then, or ``None`` when its own budget ends first.
+        """
+        if self.deadline is None:
+            return None
+        remaining = self.deadline - time.time() - self.response_seconds
+        time_limit = self.search_parameters.time_limit
+        if (
+            self.search_parameters.HasField("time_limit")
+            and time_limit.ToMilliseconds() <= remaining * 1000
+        ):
+            return None
+        time_limit.FromMilliseconds(max(int(remaining * 1000), 1))
+        return time.time() + max(remaining, 0)
+
+    def by_deadline(self, solve):
+        """Returns ``solve`` answering with "truncated" when a ``deadline`` is
+        set, true when the deadline cut the search short.
+
+        A travelling salesman or vehicle routing search finding nothing by
+        the deadline is answered by fast_solution instead.
+        """
+        if self.deadline is None:
+            return solve
+
+        def solve_by_deadline():
+            response = solve()
+            if (
+                self.objective is None
+                and self.truncated
+                and not self.data["time_windows"]
+            ):
+                self.response = {}
+                response = self.fast_solution()
+            response["truncated"] = self.truncated
+            return response
+
+        return solve_by_deadline
+
+    def search(self, manager, routing):
+        if self.should_stop or self.target_objective is not None:
+            # Kept on self, the solver does not own the Python limit.
+            self.stop_limit = routing.solver().CustomLimit(self.stop_requested)
+            routing.AddSearchMonitor(self.stop_limit)
+        if self.solution_callback or self.target_objective is not None:
+            routing.AddAtSolutionCallback(
+                lambda: self.solution_found(routing.CostVar().Value())
+            )
+        if self.routes_callback:
+            routing.AddAtSolutionCallback(lambda: self.improved(manager, routing))
+        routes = self.starting_routes()
+        if routes is not None:
+            if isinstance(self.data["distance_matrix"], SparseDistanceGraph):
+                self.restrict_to_candidates(manager, routing, routes)
+            routing.CloseModelWithParameters(self.search_parameters)
+            initial_solution = routing.ReadAssignmentFromRoutes(
+                [[manager.NodeToIndex(stop) for stop in route] for route in routes],
+                True,
+            )
+            if initial_solution:
+                return routing.SolveFromAssignmentWithParameters(
+                    initial_solution, self.search_parameters
+                )
+            logging.info("Starting routes are infeasible, solving from scratch")
+        return routing.SolveWithParameters(self.search_parameters)
+
+    def stop_requested(self):
+        return self.target_reached or bool(self.should_stop and self.should_stop())
+
+    def solution_found(self, objective):
+        if self.solution_callback:
+            self.solution_callback(objective)
+        if (
+            self.target_objective is not None
+            and objective <= self.target_objective
+            and not self.target_reached
+        ):
+            self.target_reached = True
+            if self.on_target:
+                self.on_target()
+
+    def improved(self, manager, routing):
+        """Reports the solution just found to ``routes_callback`` when it is
+        better than all the solutions before it.
+        """
+        objective = routing.CostVar().Value()
+        if self.best_reported is not None and objective >= self.best_reported:
+            return
+        self.best_reported = objective
+        routes = []
+        for vehicle_id in range(self.data["num_vehicles"]):
+            index = routing.NextVar(routing.Start(vehicle_id)).Value()
+            route = []
+            while not routing.IsEnd(index):
+                route.append(manager.IndexToNode(index))
+                index = routing.NextVar(index).Value()
+            routes.append(route)
+        self.routes_callback(objective, routes)
+
+    def compute_lower_bound(self):
+        """Computes the lower bound of a travelling salesman or vehicle routing
+        problem of at most LOWER_BOUND_MAX_STOPS stops when a gap is asked
+        for, and the objective meeting ``target_gap``.
+        """
+        matrix = self.data["distance_matrix"]
+        if (
+            not self.report_gap
+            or matrix is None
+            or isinstance(matrix, SparseDistanceGraph)
+            or len(matrix) > LOWER_BOUND_MAX_STOPS
+        ):
+            return
+        with self.phase("bound"):
+            self.lower_bound = routing_bound(
+                np.asarray(matrix),
+                self.data["num_vehicles"],
+                GLOBAL_SPAN_COST_COEFFICIENT,
+                HELD_KARP_ITERATIONS,
+                self.data["depot"],
+            )
+        if self.target_gap is not None:
+            self.target_objective = math.floor(self.lower_bound / (1 - self.target_gap))
+
+    def add_gap(self):
+        """Adds the lower bound and the optimality gap, the share of the
+        objective above the bound, to the response.
+        """
+        if self.lower_bound is None or self.objective is None:
+            return
+        self.response["lower_bound"] = self.lower_bound
+        self.response["gap"] = (
+            round((self.objective - self.lower_bound) / self.objective, 6)
+            if self.objective
+            else 0.0
+        )
+
+    def starting_routes(self):
+        """Returns the routes the search starts from, or ``None`` to let the
+        solver build its first solution.
+
+        ``initial_routes`` are completed with the stops they miss. Without
+        them a sparse graph starts from its nearest neighbour routes, since
+        the solver's own first solution heuristics look at every arc.
+        """
+        num_vehicles = self.data["num_vehicles"]
+        matrix = self.data["distance_matrix"]
+        if self.initial_routes is None:
+            if isinstance(matrix, SparseDistanceGraph):
+                return matrix.initial_routes(num_vehicles)
+            return None
+        if len(self.initial_routes) > num_vehicles:
+            raise ValueError("routes has more routes than num_vehicles")
+        if matrix is None:
+            matrix = self.data["time_matrix"]
+        return insert_missing_stops(
+            list(self.initial_routes)
+            + [[]] * (num_vehicles - len(self.initial_routes)),
+            matrix,
+            self.data["depot"],
+        )
+
+    def restrict_to_candidates(self, manager, routing, routes):
+        """Limits the successors of every stop to its candidate arcs, the
+        route ends and its successor in ``routes``.
+        """
+        graph = self.data["distance_matrix"]
+        depot = self.data["depot"]
+        ends = [routing.End(vehicle_id) for vehicle_id in range(len(routes))]
+        starting_successor = {}
+        for route in routes:
+            starting_successor.update(zip(route, route[1:]))
+        for stop in range(len(graph)):
+            if stop == depot:
+                continue
+            successors = set(graph.candidates[stop])
+            if stop in starting_successor:
+                successors.add(starting_successor[stop])
+            successors.discard(depot)
+            routing.NextVar(manager.NodeToIndex(stop)).SetValues(
+                [manager.NodeToIndex(successor) for successor in successors] + ends
+            )
+
+    def prune_time_window_arcs(self, manager, routing):
+        """Removes the arcs no vehicle can take from the successors of every
+        stop and vehicle start, and counts them in ``pruned_arcs``.
+        """
+        # An arc is only out of reach when it is for every vehicle: too late
+        # for the fastest or waiting too long for the slowest.
+        matrices = {
+            id(matrix): matrix for matrix in self.vehicle_matrices("time_matrix")
+        }
+        times = np.asarray(matrices.popitem()[1], dtype=np.int64)
+        slowest = times
+        for matrix in matrices.values():
+            times = np.minimum(times, matrix)
+            slowest = np.maximum(slowest, matrix)
+        depot = self.data["depot"]
+        infeasible = infeasible_arcs(
+            times,
+            self.data["time_windows"],
+            self.allow_waiting_time,
+            self.maximum_time_per_vehicle,
+            depot,
+            slowest_matrix=slowest,
+        )
+        self.pruned_arcs = int(infeasible.sum())
+        indexes = np.array(
+            [manager.NodeToIndex(node) for node in range(len(times))], dtype=np.int64
         )
+        for node in np.flatnonzero(infeasible.any(axis=1)):
+            pruned = indexes[infeasible[node]].tolist()
+            if node == depot:
+                for vehicle_id in range(self.data["num_vehicles"]):
+                    routing.NextVar(routing.Start(vehicle_id)).RemoveValues(pruned)
+            else:
+                routing.NextVar(int(indexes[node])).RemoveValues(pruned)
+
+    def solution_indexes(self, routing, solution):
+        """Returns the routing indexes of each vehicle, start to end."""
+        paths = []
+        for vehicle_id in range(self.data["num_vehicles"]):
+            index = routing.Start(vehicle_id)
+            path = [index]
+            while not routing.IsEnd(index):
+                index = solution.Value(routing.NextVar(index))
+                path.append(index)
+            paths.append(path)
+        return paths
+
+    def solution_routes(self, manager, routing, solution):
+        """Returns the stops visited by each vehicle, without the depot."""
+        routes = []
+        for vehicle_id in range(self.data["num_vehicles"]):
+            index = solution.Value(routing.NextVar(routing.Start(vehicle_id)))
+            route = []
+            while not routing.IsEnd(index):
+                route.append(manager.IndexToNode(index))
+                index = solution.Value(routing.NextVar(index))
+            routes.append(route)
+        return routes
+
+    def solution_paths(self, routes):
+        """Returns every route as a node array running depot to depot."""
+        depot = self.data["depot"]
+        return [np.array([depot] + route + [depot], dtype=np.intp) for route in routes]
+
+    def structured_response(self, routes, objective, matrix_key):
+        """Returns the solution as per-vehicle arrays instead of strings.
+
+        "routes" are the stops of each vehicle, "cumulative_distances" (or
+        "cumulative_times" for a time matrix) the transit from the depot at
+        each node of ``[depot] + route + [depot]``, taken from the matrix in
+        one pass per route.
+        """
+        unit = "distances" if matrix_key == "distance_matrix" else "times"
+        cumulative = [
+            np.concatenate([[0], np.cumsum(path_costs(matrix, path))])
+            for matrix, path in zip(
+                self.vehicle_matrices(matrix_key), self.solution_paths(routes)
+            )
+        ]
+        self.response = {
+            "objective": objective,
+            "depot": self.data["depot"],
+            "routes": routes,
+            "cumulative_{}".format(unit): [values.tolist() for values in cumulative],
+            "route_{}".format(unit): [int(values[-1]) for values in cumulative],
+        }
+        return self.response
 
+    def traveling_salesperson_response(self, routes, objective):
+        # self.response['Objective'] = '{} miles'.format(solution.ObjectiveValue())
+        if self.output == "structured":
+            return self.structured_response(routes, objective, "distance_matrix")
+        path = self.solution_paths(routes)[0]
+        plan_output = "".join(
+            [" {} ->".format(self.coordinate_list[node]) for node in path[:-1]]
+        )
+        plan_output = "Route for vehicle: {} {}".format(
+            plan_output, self.coordinate_list[path[-1]]
+        )
+        route_distance = int(path_costs(self.data["distance_matrix"], path).sum())
+        self.response["plan_output"] = plan_output
+        self.response["Route distance"] = "{} meters".format(route_distance)
+        self.response["routes"] = routes
+
+    def traveling_salesperson_solution(self):
+        """Entry point of the program."""
+        with self.phase("model"):
+            # Create the routing index manager.
+            manager = pywrapcp.RoutingIndexManager(
+                len(self.data["distance_matrix"]),
+                self.data["num_vehicles"],
+                self.data["depot"],
+            )
+
+            # Create Routing Model.
+            routing = pywrapcp.RoutingModel(manager)
+
+            transit_callback_index = self.register_transit(
+                manager, routing, "distance_matrix"
+            )
+
+            # Define cost of each arc.
+            routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+        # Setting first solution heuristic.
         # Solve the problem.
-        solution = routing.SolveWithParameters(search_parameters)
+        solution = self.solve_with_parameters(manager, routing)
 
         # Print solution on console.
         if solution:
-            self.traveling_salesperson_response(manager, routing, solution)
+            with self.phase("response"):
+                self.traveling_salesperson_response(
+                    self.solution_routes(manager, routing, solution),
+                    solution.ObjectiveValue(),
+                )
+            self.add_gap()
 
         return self.response
 
-    def vehicle_routing_response(self, manager, routing, solution):
+    def vehicle_routing_response(self, routes, objective):
         """Prints solution on console."""
-        print(f"Objective: {solution.ObjectiveValue()}")
+        print(f"Objective: {objective}")
+        if self.output == "structured":
+            return self.structured_response(routes, objective, "distance_matrix")
         max_route_distance = 0
-        for vehicle_id in range(self.data["num_vehicles"]):
-            index = routing.Start(vehicle_id)
-            plan_output = "Route: "
-            route_distance = 0
-            while not routing.IsEnd(index):
-                plan_output += " {} -> ".format(
-                    self.coordinate_list[manager.IndexToNode(index)]
-                )
-                previous_index = index
-                index = solution.Value(routing.NextVar(index))
-                route_distance += routing.GetArcCostForVehicle(
-                    previous_index, index, vehicle_id
-                )
-            plan_output += "{}".format(self.coordinate_list[manager.IndexToNode(index)])
+        for vehicle_id, path in enumerate(self.solution_paths(routes)):
+            plan_output = "".join(
+                [" {} -> ".format(self.coordinate_list[node]) for node in path[:-1]]
+            )
+            plan_output = "Route: {}{}".format(
+                plan_output, self.coordinate_list[path[-1]]
+            )
+            route_distance = int(path_costs(self.data["distance_matrix"], path).sum())
             self.response["Route for vehicle {}".format(vehicle_id)] = plan_output
             self.response[
                 "Distance of the route for vehicle {} in meter".format(vehicle_id)
             ] = route_distance
             max_route_distance = max(route_distance, max_route_distance)
         self.response["Maximum of the route distances"] = max_route_distance
+        self.response["routes"] = routes
         return self.response
 
     def vehicle_routing_solution(self):
         """Entry point of the program."""
         # Instantiate the data problem.
 
-        # Create the routing index manager.
-        manager = pywrapcp.RoutingIndexManager(
-            len(self.data["distance_matrix"]),
-            self.data["num_vehicles"],
-            self.data["depot"],
-        )
-
-        # Create Routing Model.
-        routing = pywrapcp.RoutingModel(manager)
+        with self.phase("model"):
+            # Create the routing index manager.
+            manager = pywrapcp.RoutingIndexManager(
+                len(self.data["distance_matrix"]),
+                self.data["num_vehicles"],
+                self.data["depot"],
+            )
 
-        # Create and register a transit callback.
-        def distance_callback(from_index, to_index):
-            """Returns the distance between the two nodes."""
-            # Convert from routing variable Index to distance matrix NodeIndex.
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return self.data["distance_matrix"][from_node][to_node]
+            # Create Routing Model.
+            routing = pywrapcp.RoutingModel(manager)
 
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+            # Create and register a transit callback.
+            transit_callback_index = self.register_transit(
+                manager, routing, "distance_matrix"
+            )
 
-        # Define cost of each arc.
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+            # Define cost of each arc.
+            routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
-        # Add Distance constraint.
-        dimension_name = "Distance"
-        routing.AddDimension(
-            transit_callback_index,
-            0,  # no slack
-            self.vehicle_maximum_travel_distance,  # vehicle maximum travel distance
-            True,  # start cumul to zero
-            dimension_name,
-        )
-        distance_dimension = routing.GetDimensionOrDie(dimension_name)
-        distance_dimension.SetGlobalSpanCostCoefficient(100)
+            # Add Distance constraint.
+            dimension_name = "Distance"
+            routing.AddDimension(
+                transit_callback_index,
+                0,  # no slack
+                self.vehicle_maximum_travel_distance,  # vehicle maximum travel distance
+                True,  # start cumul to zero
+                dimension_name,
+            )
+            distance_dimension = routing.GetDimensionOrDie(dimension_name)
+            distance_dimension.SetGlobalSpanCostCoefficient(
+                GLOBAL_SPAN_COST_COEFFICIENT
+            )
 
         # Setting first solution heuristic.
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-        )
-
         # Solve the problem.
-        solution = routing.SolveWithParameters(search_parameters)
+        solution = self.solve_with_parameters(manager, routing)
 
         # Print solution on console.
         if solution:
-            return self.vehicle_routing_response(manager, routing, solution)
+            with self.phase("response"):
+                self.vehicle_routing_response(
+                    self.solution_routes(manager, routing, solution),
+                    solution.ObjectiveValue(),
+                )
+            self.add_gap()
+            return self.response
+        else:
+            self.response["message"] = "No solution found !"
+            return self.response
+
+    def fast_solution(self):
+        """Solves the TSP or VRP with the NumPy heuristic of traveller.heuristic
+        instead of OR-tools, answering in the same format. The vehicle routing
+        objective is scored as the solver scores it. A SparseDistanceGraph,
+        too large for the heuristic's dense matrix, is answered with its
+        nearest neighbour routes.
+        """
+        num_vehicles = self.data["num_vehicles"]
+        self.compute_lower_bound()
+        matrix = self.data["distance_matrix"]
+        if isinstance(matrix, SparseDistanceGraph):
+            with self.phase("solve"):
+                routes = matrix.initial_routes(num_vehicles)
         else:
+            with self.phase("model"):
+                matrix = np.asarray(matrix, dtype=np.int64)
+            with self.phase("solve"):
+                routes = heuristic.solve(matrix, num_vehicles, self.data["depot"])
+        distances = [
+            int(path_costs(matrix, path).sum()) for path in self.solution_paths(routes)
+        ]
+        if num_vehicles == 1:
+            self.status = "HEURISTIC_SUCCESS"
+            self.objective = distances[0]
+            with self.phase("response"):
+                self.traveling_salesperson_response(routes, self.objective)
+            self.add_gap()
+            return self.response
+
+        if (
+            self.vehicle_maximum_travel_distance is not None
+            and max(distances) > self.vehicle_maximum_travel_distance
+        ):
+            self.status = "HEURISTIC_FAIL"
             self.response["message"] = "No solution found !"
             return self.response
+        self.status = "HEURISTIC_SUCCESS"
+        self.objective = sum(distances) + GLOBAL_SPAN_COST_COEFFICIENT * max(distances)
+        with self.phase("response"):
+            self.vehicle_routing_response(routes, self.objective)
+        self.add_gap()
+        return self.response
 
     def time_window_constraint_response(self, manager, routing, solution):
 
-        self.response["Objective"] = solution.ObjectiveValue()
         time_dimension = routing.GetDimensionOrDie("Time")
+        if self.output == "structured":
+            self.structured_response(
+                self.solution_routes(manager, routing, solution),
+                solution.ObjectiveValue(),
+                "time_matrix",
+            )
+            self.response["arrival_times"] = [
+                [solution.Min(time_dimension.CumulVar(index)) for index in indexes]
+                for indexes in self.solution_indexes(routing, solution)
+            ]
+            return self.response
+
+        self.response["Objective"] = solution.ObjectiveValue()
         total_time = 0
-        for vehicle_id in range(self.data["num_vehicles"]):
-            index = routing.Start(vehicle_id)
-            plan_output = "Route :-->"
-            while not routing.IsEnd(index):
+        for vehicle_id, indexes in enumerate(self.solution_indexes(routing, solution)):
+            parts = []
+            for index in indexes:
                 time_var = time_dimension.CumulVar(index)
-                plan_output += "{0} Time({1},{2}) -> ".format(
-                    manager.IndexToNode(index),
-                    solution.Min(time_var),
-                    solution.Max(time_var),
+                parts.append(
+                    "{0} Time({1},{2})".format(
+                        manager.IndexToNode(index),
+                        solution.Min(time_var),
+                        solution.Max(time_var),
+                    )
                 )
-                index = solution.Value(routing.NextVar(index))
-            time_var = time_dimension.CumulVar(index)
-            plan_output += "{0} Time({1},{2})".format(
-                manager.IndexToNode(index),
-                solution.Min(time_var),
-                solution.Max(time_var),
-            )
+            plan_output = "Route :-->" + " -> ".join(parts)
             plan_output += "Time of the route: {}min".format(solution.Min(time_var))
             total_time += solution.Min(time_var)
             self.response["Route for vehicle {}".format(vehicle_id)] = plan_output
@@ -205,82 +1043,357 @@ class RouteFinder:
         """Solve the VRP with time windows."""
         # Instantiate the data problem.
         # import pdb;pdb.set_trace()
-        # Create the routing index manager.
-        manager = pywrapcp.RoutingIndexManager(
-            len(self.data["time_matrix"]), self.data["num_vehicles"], self.data["depot"]
-        )
+        with self.phase("model"):
+            # Create the routing index manager.
+            manager = pywrapcp.RoutingIndexManager(
+                len(self.data["time_matrix"]),
+                self.data["num_vehicles"],
+                self.data["depot"],
+            )
 
-        # Create Routing Model.
-        routing = pywrapcp.RoutingModel(manager)
+            # Create Routing Model.
+            routing = pywrapcp.RoutingModel(manager)
 
-        # Create and register a transit callback.
-        def time_callback(from_index, to_index):
-            """Returns the travel time between the two nodes."""
-            # Convert from routing variable Index to time matrix NodeIndex.
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return self.data["time_matrix"][from_node][to_node]
+            # Create and register a transit callback per vehicle speed.
+            transit_callback_indexes = self.register_vehicle_transits(manager, routing)
 
-        transit_callback_index = routing.RegisterTransitCallback(time_callback)
+            # Define cost of each arc.
+            time = "Time"
+            if len(set(transit_callback_indexes)) == 1:
+                routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_indexes[0])
 
-        # Define cost of each arc.
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+                # Add Time Windows constraint.
+                routing.AddDimension(
+                    transit_callback_indexes[0],
+                    self.allow_waiting_time,  # allow waiting time
+                    self.maximum_time_per_vehicle,  # maximum time per vehicle
+                    False,  # Don't force start cumul to zero.
+                    time,
+                )
+            else:
+                for vehicle_id, transit in enumerate(transit_callback_indexes):
+                    routing.SetArcCostEvaluatorOfVehicle(transit, vehicle_id)
+                routing.AddDimensionWithVehicleTransits(
+                    transit_callback_indexes,
+                    self.allow_waiting_time,
+                    self.maximum_time_per_vehicle,
+                    False,
+                    time,
+                )
+            time_dimension = routing.GetDimensionOrDie(time)
+            # Add time window constraints for each location except depot.
+            for location_idx, time_window in enumerate(self.data["time_windows"]):
+                if location_idx == self.data["depot"]:
+                    continue
+                index = manager.NodeToIndex(location_idx)
+                time_dimension.CumulVar(index).SetRange(time_window[0], time_window[1])
+            # Add time window constraints for each vehicle start node.
+            depot_idx = self.data["depot"]
+            for vehicle_id in range(self.data["num_vehicles"]):
+                index = routing.Start(vehicle_id)
+                time_dimension.CumulVar(index).SetRange(
+                    self.data["time_windows"][depot_idx][0],
+                    self.data["time_windows"][depot_idx][1],
+                )
 
-        # Add Time Windows constraint.
-        time = "Time"
-        routing.AddDimension(
-            transit_callback_index,
-            self.allow_waiting_time,  # allow waiting time
-            self.maximum_time_per_vehicle,  # maximum time per vehicle
-            False,  # Don't force start cumul to zero.
-            time,
-        )
-        time_dimension = routing.GetDimensionOrDie(time)
-        # Add time window constraints for each location except depot.
-        for location_idx, time_window in enumerate(self.data["time_windows"]):
-            if location_idx == self.data["depot"]:
-                continue
-            index = manager.NodeToIndex(location_idx)
-            time_dimension.CumulVar(index).SetRange(time_window[0], time_window[1])
-        # Add time window constraints for each vehicle start node.
-        depot_idx = self.data["depot"]
-        for vehicle_id in range(self.data["num_vehicles"]):
-            index = routing.Start(vehicle_id)
-            time_dimension.CumulVar(index).SetRange(
-                self.data["time_windows"][depot_idx][0],
-                self.data["time_windows"][depot_idx][1],
-            )
+            # Instantiate route start and end times to produce feasible times.
+            for i in range(self.data["num_vehicles"]):
+                routing.AddVariableMinimizedByFinalizer(
+                    time_dimension.CumulVar(routing.Start(i))
+                )
+                routing.AddVariableMinimizedByFinalizer(
+                    time_dimension.CumulVar(routing.End(i))
+                )
 
-        # Instantiate route start and end times to produce feasible times.
-        for i in range(self.data["num_vehicles"]):
-            routing.AddVariableMinimizedByFinalizer(
-                time_dimension.CumulVar(routing.Start(i))
-            )
-            routing.AddVariableMinimizedByFinalizer(
-                time_dimension.CumulVar(routing.End(i))
-            )
+        if self.prune_arcs:
+            with self.phase("prune"):
+                self.prune_time_window_arcs(manager, routing)
 
         # Setting first solution heuristic.
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-        )
-
         # Solve the problem.
-        solution = routing.SolveWithParameters(search_parameters)
+        solution = self.solve_with_parameters(manager, routing)
 
         # Print solution on console.
         if solution:
-            return self.time_window_constraint_response(manager, routing, solution)
+            with self.phase("response"):
+                return self.time_window_constraint_response(manager, routing, solution)
         else:
             self.response["message"] = "No Solution Found !"
             return self.response
 
 
+EARTH_RADIUS_METERS = 6371 * 1000
+
+
+def haversine_matrix(source, destination, chunk_size=None):
+    """Returns the haversine distance in meters between every pair of
+    ``source`` and ``destination`` points as an integer ndarray.
+
+    Points are ``[longitude, latitude]`` pairs. When ``chunk_size`` is given
+    the rows are computed ``chunk_size`` at a time so that the float
+    temporaries never exceed ``chunk_size * len(destination)`` cells.
+    """
+    source = np.radians(np.asarray(source, dtype=np.float64).reshape(-1, 2))
+    destination = np.radians(np.asarray(destination, dtype=np.float64).reshape(-1, 2))
+    lon2 = destination[:, 0]
+    lat2 = destination[:, 1]
+    cos_lat2 = np.cos(lat2)
+
+    matrix = np.empty((len(source), len(destination)), dtype=np.int64)
+    step = chunk_size if chunk_size else max(len(source), 1)
+    for start in range(0, len(source), step):
+        block = source[start : start + step]
+        matrix[start : start + step] = _haversine_meters(
+            block[:, 0, np.newaxis], block[:, 1, np.newaxis], lon2, lat2, cos_lat2
+        )
+    return matrix
+
+
+def haversine_pairs(source, destination):
+    """Returns the haversine distance in meters between ``source[i]`` and
+    ``destination[i]`` for every ``i`` as an integer ndarray.
+    """
+    source = np.radians(np.asarray(source, dtype=np.float64).reshape(-1, 2))
+    destination = np.radians(np.asarray(destination, dtype=np.float64).reshape(-1, 2))
+    return _haversine_meters(
+        source[:, 0],
+        source[:, 1],
+        destination[:, 0],
+        destination[:, 1],
+        np.cos(destination[:, 1]),
+    )
+
+
+def _haversine_meters(lon1, lat1, lon2, lat2, cos_lat2):
+    """Broadcast haversine formula over radians, rounded to integer meters."""
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * cos_lat2 * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    distance = 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    return np.rint(distance).astype(np.int64)
+
+
+def condensed_haversine(coordinate_list, chunk_size=None):
+    """Returns the pairwise haversine distances of ``coordinate_list`` as a
+    CondensedMatrix, computing every pair once.
+    """
+    coordinates = np.asarray(coordinate_list, dtype=np.float64).reshape(-1, 2)
+    size = len(coordinates)
+    values = np.empty(size * (size - 1) // 2, dtype=np.int32)
+    step = chunk_size if chunk_size else max(size, 1)
+    offset = 0
+    for start in range(0, size, step):
+        stop = min(start + step, size)
+        # Only the columns from the block's first row on, above the diagonal.
+        block = haversine_matrix(coordinates[start:stop], coordinates[start:])
+        upper = block[np.triu(np.ones(block.shape, dtype=bool), k=1)]
+        values[offset : offset + len(upper)] = upper
+        offset += len(upper)
+    return CondensedMatrix(values)
+
+
+def batch_haversine_matrices(coordinate_lists, max_cells=BATCH_MATRIX_CELLS):
+    """Returns the haversine distance matrix of every coordinate list.
+
+    Lists of similar length are padded to the same size and computed together
+    in one broadcast, at most ``max_cells`` cells at a time.
+    """
+    coordinate_lists = [
+        np.radians(np.asarray(coordinates, dtype=np.float64).reshape(-1, 2))
+        for coordinates in coordinate_lists
+    ]
+    order = sorted(
+        range(len(coordinate_lists)), key=lambda index: len(coordinate_lists[index])
+    )
+    matrices = [None] * len(coordinate_lists)
+    start = 0
+    while start < len(order):
+        stop = start + 1
+        # Sorted by length, so the last list of a group sets its padding.
+        while (
+            stop < len(order)
+            and (stop - start + 1) * len(coordinate_lists[order[stop]]) ** 2
+            <= max_cells
+        ):
+            stop += 1
+        group = order[start:stop]
+        size = len(coordinate_lists[group[-1]])
+        padded = np.zeros((len(group), size, 2))
+        for row, index in enumerate(group):
+            padded[row, : len(coordinate_lists[index])] = coordinate_lists[index]
+        lon = padded[:, :, 0]
+        lat = padded[:, :, 1]
+        distances = _haversine_meters(
+            lon[:, :, np.newaxis],
+            lat[:, :, np.newaxis],
+            lon[:, np.newaxis, :],
+            lat[:, np.newaxis, :],
+            np.cos(lat)[:, np.newaxis, :],
+        )
+        for row, index in enumerate(group):
+            length = len(coordinate_lists[index])
+            matrices[index] = distances[row, :length, :length].copy()
+        start = stop
+    return matrices
+
+
+class SparseDistanceGraph:
+    """k-nearest-neighbour candidate graph standing in for a dense matrix.
+
+    A uniform grid over the stops finds the (approximate) ``neighbors``
+    nearest stops of each one; those arcs, both ways, and every arc to and from
+    the depot keep their exact distance. Any other arc costs its haversine
+    distance times SPARSE_FALLBACK_FACTOR, so the solver stays on candidate
+    arcs unless it has no other choice. Memory is O(n * neighbors).
+    """
+
+    def __init__(self, coordinate_list, neighbors, depot=0):
+        self.coordinates = np.asarray(coordinate_list, dtype=np.float64).reshape(-1, 2)
+        self.size = len(self.coordinates)
+        self.depot = depot
+        self.neighbors = min(neighbors, self.size - 1)
+        self.radians = np.radians(self.coordinates).tolist()
+        self.depot_distances = haversine_matrix(
+            self.coordinates[depot : depot + 1], self.coordinates
+        )[0].tolist()
+        self.neighbor_index, self.neighbor_distance = self.nearest_neighbors()
+        self.edges = {}
+        self.candidates = [[] for _ in range(self.size)]
+        for stop, (row, distances) in enumerate(
+            zip(self.neighbor_index.tolist(), self.neighbor_distance.tolist())
+        ):
+            for neighbor, distance in zip(row, distances):
+                if stop * self.size + neighbor not in self.edges:
+                    self.candidates[stop].append(neighbor)
+                    self.candidates[neighbor].append(stop)
+                self.edges[stop * self.size + neighbor] = distance
+                self.edges[neighbor * self.size + stop] = distance
+
+    def __len__(self):
+        return self.size
+
+    def nearest_neighbors(self):
+        """Returns the index and distance arrays (n x neighbors) of the nearest
+        stops of every stop, searching the grid cells around each stop's cell.
+        """
+        k = self.neighbors
+        index = np.zeros((self.size, k), dtype=np.int32)
+        distance = np.zeros((self.size, k), dtype=np.int32)
+        if k <= 0:
+            return index, distance
+
+        # Equirectangular projection is enough to bin stops into cells.
+        planar = self.coordinates * [
+            np.cos(np.radians(self.coordinates[:, 1].mean())),
+            1,
+        ]
+        low = planar.min(axis=0)
+        extent = np.maximum(planar.max(axis=0) - low, 1e-9)
+        # Cells sized to hold about ``k`` stops each.
+        cell_size = np.sqrt(extent[0] * extent[1] * k / self.size) or extent.max()
+        cells = np.floor((planar - low) / cell_size).astype(np.int64)
+        order = np.lexsort((cells[:, 1], cells[:, 0]))
+        cell_keys, starts, counts = np.unique(
+            cells[order], axis=0, return_index=True, return_counts=True
+        )
+        cell_members = {
+            (int(x), int(y)): order[start : start + count]
+            for (x, y), start, count in zip(cell_keys, starts, counts)
+        }
+
+        def window(x, y, ring):
+            return np.concatenate(
+                [
+                    cell_members[(x + dx, y + dy)]
+                    for dx in range(-ring, ring + 1)
+                    for dy in range(-ring, ring + 1)
+                    if (x + dx, y + dy) in cell_members
+                ]
+            )
+
+        for (x, y), members in cell_members.items():
+            ring = 1
+            while len(window(x, y, ring)) <= k:
+                ring += 1
+            # One ring more so that neighbours just across the border are seen.
+            candidates = window(x, y, ring + 1)
+            block = haversine_matrix(
+                self.coordinates[members], self.coordinates[candidates]
+            )
+            block[candidates[np.newaxis, :] == members[:, np.newaxis]] = np.iinfo(
+                np.int64
+            ).max
+            nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+            nearest_distance = np.take_along_axis(block, nearest, axis=1)
+            by_distance = np.argsort(nearest_distance, axis=1)
+            index[members] = np.take_along_axis(candidates[nearest], by_distance, 1)
+            distance[members] = np.take_along_axis(nearest_distance, by_distance, 1)
+        return index, distance
+
+    def initial_routes(self, num_vehicles):
+        """Returns a nearest neighbour tour from the depot, split into
+        ``num_vehicles`` routes of consecutive stops.
+
+        The tour follows candidate arcs and only scans all unvisited stops
+        when every candidate of the current stop is already visited.
+        """
+        unvisited = np.ones(self.size, dtype=bool)
+        unvisited[self.depot] = False
+        tour = []
+        current = self.depot
+        for _ in range(self.size - 1):
+            row = self.neighbor_index[current]
+            free = row[unvisited[row]]
+            if len(free):
+                current = int(free[0])
+            else:
+                remaining = np.flatnonzero(unvisited)
+                distances = haversine_matrix(
+                    self.coordinates[current : current + 1],
+                    self.coordinates[remaining],
+                )[0]
+                current = int(remaining[np.argmin(distances)])
+            unvisited[current] = False
+            tour.append(current)
+        return [route.tolist() for route in np.array_split(tour, num_vehicles)]
+
+    def arc_cost(self, from_node, to_node):
+        if to_node == self.depot:
+            return self.depot_distances[from_node]
+        if from_node == self.depot:
+            return self.depot_distances[to_node]
+        cost = self.edges.get(from_node * self.size + to_node)
+        if cost is not None:
+            return cost
+        lon1, lat1 = self.radians[from_node]
+        lon2, lat2 = self.radians[to_node]
+        a = (
+            sin((lat2 - lat1) / 2) ** 2
+            + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+        )
+        return int(
+            2 * EARTH_RADIUS_METERS * asin(sqrt(min(a, 1.0))) * SPARSE_FALLBACK_FACTOR
+        )
+
+
 class DistanceMatrix:
-    def __init__(self, coordinate_sequence):
+    def __init__(
+        self,
+        coordinate_sequence,
+        engine="numpy",
+        chunk_size=None,
+        cache=None,
+        edge_store=None,
+        condensed=False,
+    ):
         self.source = coordinate_sequence
         self.destination = coordinate_sequence
+        self.engine = engine
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.edge_store = edge_store
+        self.condensed = condensed
         self.distance_matrix = []
 
     def haversine(self, pointA, pointB):
@@ -313,6 +1426,28 @@ class DistanceMatrix:
         return math.sqrt(dlon ** 2 + dlat ** 2)
 
     def create_distance_matrix(self):
+        if self.engine == "numpy":
+            key = matrix_key(self.source) if self.cache else None
+            if key:
+                self.distance_matrix = self.cache.get(key)
+                if self.distance_matrix is not None:
+                    return self.distance_matrix
+            if self.edge_store:
+                self.distance_matrix = self.edge_store.matrix(self.source)
+                if self.condensed:
+                    self.distance_matrix = CondensedMatrix.from_dense(
+                        self.distance_matrix
+                    )
+            elif self.condensed:
+                # Haversine is symmetric, only the upper triangle is computed.
+                self.distance_matrix = condensed_haversine(self.source, self.chunk_size)
+            else:
+                self.distance_matrix = haversine_matrix(
+                    self.source, self.destination, self.chunk_size
+                )
+            if key:
+                self.distance_matrix = self.cache.put(key, self.distance_matrix)
+            return self.distance_matrix
         for pointA in self.source:
             row = []
             for pointB in self.destination:
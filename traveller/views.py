@@ -1,10 +1,50 @@
+import asyncio
+import json
 import logging
+import time
+from concurrent.futures import TimeoutError
 
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import (
+    HttpResponse,
+    HttpResponseNotAllowed,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from rest_framework.generics import GenericAPIView
+from rest_framework.parsers import JSONParser
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 
-from traveller.utils import DistanceMatrix, RouteFinder
+from traveller.batch import dense_distance_problem, ndjson_lines, solve_batch
+from traveller.cache import get_distance_matrix_cache
+from traveller.constant import DISTANCE_MATRIX_CHUNK_SIZE
+from traveller.decomposition import Decomposition
+from traveller.edges import get_edge_store
+from traveller.executor import SharedStop, SolverBusy, get_solver_executor
+from traveller.jobs import submit_job
+from traveller import metrics
+from traveller.matrixfile import save_uploaded_matrix
+from traveller.models import SolveJob
+from traveller.offload import solve_offloaded
+from traveller.parsers import NpyParser
+from traveller.payloads import decode_matrix, decode_request
+from traveller.portfolio import Portfolio, portfolio_members
+from traveller.renderers import route_renderer_classes
+from traveller.serializers import SolveJobSerializer
+from traveller.stream import EventStreamResponse, SolutionStream, solution_slots
+from traveller.utils import (
+    DistanceMatrix,
+    SparseDistanceGraph,
+    apply_stop_delta,
+    derives_time_matrix,
+    request_flag,
+    route_finder_from_request,
+    sparse_neighbors,
+)
 
 """
 1. For solving Travelling Salesman problem following input is required:
@@ -104,73 +144,614 @@ from traveller.utils import DistanceMatrix, RouteFinder
     e. "maximum_time_per_vehicle": 30, maximum time available per vehicle
     
     f. "depot": 0 It is the starting point of the routing
+
+4. Optional inputs accepted by every problem type:
+
+    a. "transit_mode": "matrix", how the distance/time matrix is given to the solver.
+    "matrix" (default) hands the whole matrix to OR-tools natively, "callback" registers
+    a python callback evaluated per arc, the default for memory-mapped matrices
+    (settings.ROUTE_MMAP_THRESHOLD and "matrix_id"). Any other value is answered 400.
+
+    b. "search_budget": {"time_limit": 5, "solution_limit": 100,
+                         "first_solution_strategy": "SAVINGS",
+                         "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH"}
+    all keys are optional and override the server default for the problem size
+    (settings.ROUTE_SEARCH_BUDGETS). time_limit is in seconds, strategies are OR-tools
+    enum names. Metaheuristics other than GREEDY_DESCENT need a time or solution limit.
+
+    c. "time_matrix" can also be sent compactly: {"encoding": "base64", "shape": [n, n],
+    "data": <base64 of little endian int32 cells>}, {"encoding": "npy", "data": <base64 of
+    a .npy file>} or {"matrix_id": <id returned by POST /api/matrices/>}. Bodies may be
+    gzip or zstd compressed (Content-Encoding). In every form the matrix must be n x n
+    for the n time windows, with whole number cells from 0 to the int32 maximum.
+
+    d. "output": "structured", answers with arrays instead of the route strings:
+    "routes" (stops of each vehicle), "cumulative_distances" ("cumulative_times" and
+    "arrival_times" for time windows) along depot + route + depot, "route_distances"
+    ("route_times") and "objective". With msgpack installed, "Accept: application/msgpack"
+    returns any response as MessagePack.
+
+    e. "decompose": true, vehicle routing only. Splits the stops into clusters around
+    the depot (settings.ROUTE_CLUSTER_STOPS stops each), solves the clusters in
+    parallel and then repairs the cluster boundaries. "compare_monolithic": true also
+    solves the whole problem at once and reports its objective and wall time.
+
+    f. "tier": "fast", travelling salesman and vehicle routing only. Answers in a few
+    milliseconds from a nearest neighbour tour improved by 2-opt and Or-opt moves
+    instead of the OR-tools search, with the same response. "solver" is the default.
+
+    g. "portfolio": true, solves the problem with every search strategy of
+    settings.ROUTE_PORTFOLIO in parallel (or with a list of {"first_solution_strategy",
+    "local_search_metaheuristic"}) until the search budget's time_limit and answers with
+    the best solution. Only the first as many strategies as there are solver workers
+    are run. "portfolio" in the response names the winning strategy and the
+    objective of every member. "target_objective": n stops every member as soon as one
+    finds a solution of at most n.
+
+    h. "report_gap": true, travelling salesman and vehicle routing up to 1000 stops. Adds
+    "lower_bound", a Held-Karp bound on the objective, and "gap", the share of the
+    objective above it. "target_gap": 0.02 also ends the search as soon as the gap is
+    reached (in a portfolio, every member).
+
+    i. "speed_profile": {"speed": 30}, time windows only. Replaces "time_matrix": the
+    travel minutes are derived from the distances between the "list_cord" stops at the
+    given km/h, or per vehicle with "vehicle_speeds": [30, 25, 40]. "time_of_day":
+    [[420, 1.5], [600, 1.0]] multiplies the travel times leaving a stop whose window
+    opens from minute 420 (until 600) by 1.5. "num_vehicles", "allow_waiting_time"
+    and "maximum_time_per_vehicle" are taken from the request.
+
+    j. "prune_arcs": false, time windows only. Before the search, the arcs no vehicle can
+    take in time are removed from the successors of every stop. Their count is reported
+    as "pruned_arcs" in the metrics; false keeps every arc, for A/B measurement.
+
+    k. "deadline": 2.5 (or an X-Deadline: 2.5 header), seconds until the answer is due.
+    What is left of it once the request is parsed, queued and its matrices built,
+    less the measured time from the end of a search to its answer, becomes the solver
+    time limit, and the response carries "truncated": true when the deadline cut the
+    search short. A travelling salesman or vehicle routing search that found nothing
+    by then is answered by the fast tier. The fast tier answer is also computed while
+    such a request is solved and sent, truncated, when it is still queued or solving at
+    the deadline. A time window request is then answered 504. The members of a
+    "portfolio" end by the deadline and so do the subproblems of "decompose".
         
             
 
 
 """
+def solver_busy(e):
+    """The 429 answer to a SolverBusy error."""
+    return Response(
+        {"message": str(e)},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def request_deadline(request, data, arrived):
+    """Returns the time.time() by which the response to ``request`` is due,
+    ``arrived`` plus the seconds of its "deadline" field or X-Deadline header,
+    or ``None`` without a deadline.
+    """
+    seconds = data.get("deadline", request.headers.get("X-Deadline"))
+    if seconds is None:
+        return None
+    try:
+        seconds = float(seconds)
+    except (TypeError, ValueError):
+        raise ValueError("deadline must be a number of seconds")
+    if not seconds > 0:
+        raise ValueError("deadline must be positive")
+    return arrived + seconds
+
+
+def deadline_matrices(data):
+    """Returns the distance matrix to share with the solve of a route payload
+    with a deadline and the one to compute its fallback answer on, ``None``
+    for either when there is none.
+
+    Only travelling salesman and vehicle routing payloads for the solver tier
+    have a fallback: the fast tier on their dense matrix, or above the sizes
+    the web process builds one for, the nearest neighbour routes of a sparse
+    candidate graph.
+    """
+    if (
+        data.get("tier", "solver") != "solver"
+        or data.get("time_windows")
+        or not (data.get("list_cord") and data.get("num_vehicles"))
+    ):
+        return None, None
+    if dense_distance_problem(data):
+        matrix = DistanceMatrix(
+            data["list_cord"],
+            chunk_size=DISTANCE_MATRIX_CHUNK_SIZE,
+            cache=get_distance_matrix_cache(),
+            edge_store=get_edge_store(),
+            condensed=True,
+        ).create_distance_matrix()
+        return matrix, matrix
+    neighbors = sparse_neighbors(
+        data, settings.ROUTE_SPARSE_THRESHOLD, settings.ROUTE_SPARSE_NEIGHBORS
+    )
+    return None, SparseDistanceGraph(
+        data["list_cord"], neighbors or settings.ROUTE_SPARSE_NEIGHBORS
+    )
+
+
+def fallback_response(data, matrix):
+    """Returns the fast tier answer to a route payload on ``matrix`` with its
+    metrics, marked truncated.
+    """
+    route, solve = route_finder_from_request(
+        dict(data, tier="fast", report_gap=False, target_gap=None),
+        settings.ROUTE_SEARCH_BUDGETS,
+        distance_matrix=matrix,
+    )
+    response = solve()
+    return dict(response, metrics=route.metrics(), truncated=True)
+
+
 class ObtainBestRoute(GenericAPIView):
-    def get(self, request, *args, **kwargs):
+    renderer_classes = route_renderer_classes()
 
-        coordinate_list = request.data.get("list_cord", None)
-        num_vehicles = request.data.get("num_vehicles", None)
-        vehicle_maximum_travel_distance = request.data.get(
-            "vehicle_maximum_travel_distance", None
+    def get(self, request, *args, **kwargs):
+        arrived = time.time()
+        started = time.perf_counter()
+        try:
+            data = decode_request(request.data)
+            deadline = request_deadline(request, data, arrived)
+        except ValueError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return self.solve(
+            data, parse_seconds=time.perf_counter() - started, deadline=deadline
         )
-        time_matrix = request.data.get("time_matrix", None)
-        time_windows = request.data.get("time_windows", None)
-
-        if time_matrix and time_windows:
-
-            route = RouteFinder(
-                time_matrix=time_matrix,
-                time_windows=time_windows,
-                num_vehicles=4,
-                allow_waiting_time=30,
-                maximum_time_per_vehicle=30,
-                depot=0,
+
+    def solve(self, data, parse_seconds=0.0, deadline=None):
+        """Solves a route payload on the solver executor.
+
+        The phase timings and outcome of the solve are recorded for /metrics
+        and returned under "metrics" and in the Server-Timing header. With a
+        ``deadline`` the solver gets the time left once the matrices are
+        built and the answer is due by then, see RouteFinder.by_deadline.
+        A solve still queued or running at the deadline is stopped and
+        answered with the fallback computed meanwhile, see
+        deadline_matrices, or 504 when the payload has none.
+        """
+        try:
+            members = portfolio_members(data, settings.ROUTE_PORTFOLIO)
+            decompose = request_flag(data, "decompose", False)
+        except ValueError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if members is not None:
+            return self.solve_portfolio(data, members, parse_seconds, deadline)
+        if (
+            decompose
+            and data.get("list_cord")
+            and int(data.get("num_vehicles") or 0) > 1
+        ):
+            return self.solve_decomposed(data, deadline)
+
+        # Ends a solve the deadline passed while it was queued or running.
+        stop = None if deadline is None else SharedStop()
+        distance_matrix = fallback_matrix = None
+        matrix_started = time.perf_counter()
+        try:
+            if deadline is not None:
+                distance_matrix, fallback_matrix = deadline_matrices(data)
+            matrix_seconds = time.perf_counter() - matrix_started
+            future = get_solver_executor().submit(
+                data,
+                settings.ROUTE_SEARCH_BUDGETS,
+                distance_matrix=distance_matrix,
+                stop=stop,
+                deadline=deadline,
             )
-            logging.info(
-                "Initiating Time Window Contraint Solution, Ready to find best route"
+        except BaseException as e:
+            if stop is not None:
+                stop.release()
+            if isinstance(e, SolverBusy):
+                return solver_busy(e)
+            raise
+
+        if stop is not None:
+            if future is None:
+                stop.release()
+            else:
+                # The worker reads the flag until its solve returns.
+                future.add_done_callback(lambda future: stop.release())
+        if future is None:
+            logging.info("No Solution Found")
+            return Response({"message": "No Solution Found"})
+
+        logging.info("Initiating route solution, Ready to find best route")
+        fallback = None
+        try:
+            if fallback_matrix is not None:
+                # Computed while the solver works, the answer if it is late.
+                fallback = fallback_response(data, fallback_matrix)
+            resp = future.result(
+                timeout=None if deadline is None else max(deadline - time.time(), 0)
             )
-            try:
-                resp = route.time_window_constraint_solution()
-                return Response(resp)
-            except Exception as e:
-                logging.info(
-                    {
-                        "message": "error occur while finding best route for Time Window Contraint problem is {}".format(
-                            e
-                        )
-                    }
+        except TimeoutError:
+            stop.set()
+            if fallback is None:
+                return Response(
+                    {"message": "Route not found by the deadline"},
+                    status=status.HTTP_504_GATEWAY_TIMEOUT,
                 )
+            resp = fallback
+        except ValueError as e:
+            if stop is not None:
+                stop.set()
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            if stop is not None:
+                stop.set()
+            logging.info(
+                {"message": "error occur while finding best route is {}".format(e)}
+            )
+            return None
+
+        solve_metrics = resp["metrics"]
+        solve_metrics["phases"]["parse"] = parse_seconds
+        phases = solve_metrics["phases"]
+        phases["matrix"] = phases.get("matrix", 0.0) + matrix_seconds
+        metrics.record(solve_metrics)
+        return Response(
+            resp, headers={"Server-Timing": metrics.server_timing(solve_metrics)}
+        )
 
-        elif coordinate_list and num_vehicles:
-            matrix = DistanceMatrix(coordinate_list)
-            distance_data = matrix.create_distance_matrix()
-            route = RouteFinder(
-                distance_matrix=distance_data,
-                coordinate_list=coordinate_list,
-                num_vehicles=num_vehicles,
-                depot=0,
-                vehicle_maximum_travel_distance=vehicle_maximum_travel_distance,
+    def solve_portfolio(self, data, members, parse_seconds=0.0, deadline=None):
+        """Solves a route payload with the search strategies of ``members`` at
+        once, as many of them as the executor has workers: the others would
+        only start once their time limit has passed. Every member ends by the
+        ``deadline``.
+        """
+        executor = get_solver_executor()
+        try:
+            portfolio = Portfolio(
+                data,
+                lambda payload, stop: executor.submit(
+                    payload, settings.ROUTE_SEARCH_BUDGETS, stop=stop, deadline=deadline
+                ),
+                members[: executor.workers],
+                settings.ROUTE_SEARCH_BUDGETS,
+                target_objective=data.get("target_objective"),
+                deadline=deadline,
             )
-            try:
-                resp = (
-                    route.traveling_salesperson_solution()
-                    if num_vehicles == 1
-                    else route.vehicle_routing_solution()
-                )
-                return Response(resp)
-            except Exception as e:
-                logging.info(
-                    {
-                        "message": "error occur while finding best route for travelling salesman problem is {}".format(
-                            e
-                        )
-                    }
-                )
+            result = portfolio.solve()
+        except SolverBusy as e:
+            return solver_busy(e)
+        except ValueError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        else:
-            logging.info("No Solution Found")
+        if result is None:
+            return Response({"message": "No Solution Found"})
+        resp, member_metrics = result
+        resp["metrics"]["phases"]["parse"] = parse_seconds
+        for solve_metrics in member_metrics:
+            metrics.record(solve_metrics)
+        return Response(
+            resp, headers={"Server-Timing": metrics.server_timing(resp["metrics"])}
+        )
+
+    def solve_decomposed(self, data, deadline=None):
+        """Solves a vehicle routing payload cluster by cluster, every
+        subproblem by the ``deadline``.
+        """
+        executor = get_solver_executor()
+        decomposition = Decomposition(
+            data,
+            lambda payload: executor.submit(
+                payload, settings.ROUTE_SEARCH_BUDGETS, deadline=deadline
+            ),
+            settings.ROUTE_CLUSTER_STOPS,
+        )
+        try:
+            compare_monolithic = request_flag(data, "compare_monolithic", False)
+            resp = decomposition.solve()
+            if compare_monolithic:
+                resp["monolithic"] = decomposition.monolithic()
+            return Response(resp)
+        except SolverBusy as e:
+            return solver_busy(e)
+        except ValueError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+async def solve_route_async(request):
+    """Async variant of ObtainBestRoute for ASGI servers, taking the same
+    payload as a GET or POST body.
+
+    The request waits on the event loop while its solve runs on the solver
+    executor. The solve is stopped when the client disconnects or after
+    ROUTE_ASYNC_REQUEST_TIMEOUT seconds or at its deadline, answered with the
+    fallback of ObtainBestRoute.solve when the request has a deadline and 504
+    otherwise. "portfolio" and "decompose" are only solved by ObtainBestRoute.
+    """
+    if request.method not in ("GET", "POST"):
+        return HttpResponseNotAllowed(["GET", "POST"])
+    arrived = time.time()
+    started = time.perf_counter()
+    try:
+        data = json.loads(request.body or b"{}")
+        if not isinstance(data, dict):
+            raise ValueError("Request body must be an object")
+        data = decode_request(data)
+        deadline = request_deadline(request, data, arrived)
+        if portfolio_members(data, settings.ROUTE_PORTFOLIO) or request_flag(
+            data, "decompose", False
+        ):
+            raise ValueError("portfolio and decompose are not solved asynchronously")
+    except ValueError as e:
+        return JsonResponse({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    parse_seconds = time.perf_counter() - started
+
+    # Starting the workers on first use blocks, off the loop.
+    executor = await sync_to_async(get_solver_executor, thread_sensitive=False)()
+    distance_matrix = fallback_matrix = None
+    matrix_started = time.perf_counter()
+    if deadline is not None:
+        distance_matrix, fallback_matrix = await sync_to_async(
+            deadline_matrices, thread_sensitive=False
+        )(data)
+    matrix_seconds = time.perf_counter() - matrix_started
+    timeout = settings.ROUTE_ASYNC_REQUEST_TIMEOUT
+    if deadline is not None:
+        timeout = min(timeout, max(deadline - time.time(), 0))
+    solving = asyncio.ensure_future(
+        solve_offloaded(
+            lambda stop: executor.submit(
+                data,
+                settings.ROUTE_SEARCH_BUDGETS,
+                distance_matrix=distance_matrix,
+                stop=stop,
+                deadline=deadline,
+            ),
+            timeout,
+        )
+    )
+    fallback = None
+    try:
+        if fallback_matrix is not None:
+            # Computed while the solver works, the answer if it is late.
+            fallback = await sync_to_async(fallback_response, thread_sensitive=False)(
+                data, fallback_matrix
+            )
+        resp = await solving
+    except SolverBusy as e:
+        return JsonResponse(
+            {"message": str(e)},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ValueError as e:
+        return JsonResponse({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except asyncio.TimeoutError:
+        if fallback is None:
+            return JsonResponse(
+                {"message": "Route not found within the request timeout"},
+                status=status.HTTP_504_GATEWAY_TIMEOUT,
+            )
+        resp = fallback
+    finally:
+        # Stops the solve when the fallback failed or the request was cancelled.
+        solving.cancel()
+
+    if resp is None:
+        return JsonResponse({"message": "No Solution Found"})
+    solve_metrics = resp["metrics"]
+    solve_metrics["phases"]["parse"] = parse_seconds
+    phases = solve_metrics["phases"]
+    phases["matrix"] = phases.get("matrix", 0.0) + matrix_seconds
+    metrics.record(solve_metrics)
+    return JsonResponse(
+        resp,
+        encoder=JSONEncoder,
+        headers={"Server-Timing": metrics.server_timing(solve_metrics)},
+    )
+
+
+# Like the rest framework views, the payload is not a form.
+solve_route_async.csrf_exempt = True
+
+
+class ReoptimizeRoute(ObtainBestRoute):
+    """Re-plans a previous solution after stops were added or cancelled.
+
+    Takes the previous "list_cord", "num_vehicles" and "routes" with
+    "add_stops" and/or "remove_stops", and starts the search from the previous
+    routes. The response carries the new "list_cord" the routes index into.
+    """
+
+    def get(self, request, *args, **kwargs):
+        arrived = time.time()
+        started = time.perf_counter()
+        if not request.data.get("num_vehicles"):
+            return Response(
+                {"message": "num_vehicles is required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            data = apply_stop_delta(request.data)
+            deadline = request_deadline(request, data, arrived)
+        except ValueError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = self.solve(
+            data, parse_seconds=time.perf_counter() - started, deadline=deadline
+        )
+        if response is not None and "routes" in response.data:
+            response.data["list_cord"] = data["list_cord"]
+        return response
+
+
+class StreamRoute(GenericAPIView):
+    """Solves a route payload as ObtainBestRoute does, streaming Server-Sent
+    Events as the search improves.
+
+    A "solution" event {"objective", "routes"} carries the best solution so
+    far at most every ROUTE_STREAM_INTERVAL seconds, a "result" event the
+    final response, or an "error" event its message. The solve is stopped
+    when the client disconnects. "portfolio" and "decompose" are only solved
+    by ObtainBestRoute.
+    """
+
+    def get(self, request, *args, **kwargs):
+        arrived = time.time()
+        started = time.perf_counter()
+        try:
+            data = decode_request(request.data)
+            deadline = request_deadline(request, data, arrived)
+            if portfolio_members(data, settings.ROUTE_PORTFOLIO) or request_flag(
+                data, "decompose", False
+            ):
+                raise ValueError("portfolio and decompose are not streamed")
+        except ValueError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        executor = get_solver_executor()
+        try:
+            stream = SolutionStream(
+                lambda stop, solution: executor.submit(
+                    data,
+                    settings.ROUTE_SEARCH_BUDGETS,
+                    stop=stop,
+                    deadline=deadline,
+                    solution=solution,
+                ),
+                solution_slots(data),
+                settings.ROUTE_STREAM_INTERVAL,
+                parse_seconds=time.perf_counter() - started,
+            )
+        except SolverBusy as e:
+            return solver_busy(e)
+        except ValueError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if stream.future is None:
             return Response({"message": "No Solution Found"})
+        return EventStreamResponse(stream)
+
+    post = get
+
+
+class SolveBatch(GenericAPIView):
+    """Solves many independent route problems, {"problems": [payload, ...]}
+    with payloads as ObtainBestRoute takes them.
+
+    Streams one JSON line per problem as it finishes, {"index", "status"} with
+    "result" when "solved" or "no_solution" and "message" when "failed", then
+    a {"summary": {status: count}} line.
+    """
+
+    def post(self, request, *args, **kwargs):
+        problems = (
+            request.data.get("problems") if isinstance(request.data, dict) else None
+        )
+        if not isinstance(problems, list) or not problems:
+            return Response(
+                {"message": "problems must be a non empty list"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        executor = get_solver_executor()
+        results = solve_batch(
+            problems,
+            lambda data, matrix: executor.submit(
+                data, settings.ROUTE_SEARCH_BUDGETS, distance_matrix=matrix
+            ),
+            executor.workers,
+        )
+        return StreamingHttpResponse(
+            ndjson_lines(results), content_type="application/x-ndjson"
+        )
+
+
+class SubmitSolveJob(GenericAPIView):
+    """Queues a route request (same payload as ObtainBestRoute) for a background
+    worker and returns the job id immediately.
+    """
+
+    def post(self, request, *args, **kwargs):
+        data = request.data
+        if not (
+            (data.get("time_matrix") and data.get("time_windows"))
+            or (data.get("list_cord") and data.get("num_vehicles"))
+            or derives_time_matrix(data)
+        ):
+            return Response(
+                {"message": "No Solution Found"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            job = submit_job(data)
+        except SolverBusy as e:
+            return solver_busy(e)
+        return Response(
+            {"job_id": job.pk, "status": job.status}, status=status.HTTP_202_ACCEPTED
+        )
+
+
+class SolveJobStatus(GenericAPIView):
+    """Returns the progress, best objective so far and final routes of a job."""
+
+    queryset = SolveJob.objects.all()
+    serializer_class = SolveJobSerializer
+    lookup_url_kwarg = "job_id"
+
+    def get(self, request, *args, **kwargs):
+        return Response(self.get_serializer(self.get_object()).data)
+
+
+class UploadMatrix(GenericAPIView):
+    """Stores a time matrix that route requests can then reference as
+    {"matrix_id": ...} instead of sending it again.
+
+    Takes a raw ``.npy`` body (Content-Type application/x-npy) or a JSON
+    {"matrix": ...} in any encoding "time_matrix" accepts. The cells are in
+    the unit of the time windows, a ``unit`` query parameter is rejected.
+    """
+
+    parser_classes = [NpyParser, JSONParser]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            if "unit" in request.query_params:
+                raise ValueError(
+                    "unit is not supported, cells are in the unit of the time windows"
+                )
+            if isinstance(request.data, np.ndarray):
+                matrix = request.data
+            else:
+                matrix = decode_matrix(request.data.get("matrix"))
+                if not isinstance(matrix, np.ndarray):
+                    matrix = np.asarray(matrix)
+            matrix_id = save_uploaded_matrix(matrix)
+        except ValueError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {"matrix_id": matrix_id, "shape": list(matrix.shape)},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class MatrixCacheStats(GenericAPIView):
+    """Returns the counters of this web worker's distance matrix cache and
+    edge store.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response(
+            dict(
+                get_distance_matrix_cache().stats(), edge_store=get_edge_store().stats()
+            )
+        )
+
+
+class Metrics(GenericAPIView):
+    """Route solve metrics of this web worker in the Prometheus text format."""
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
@@ -13,4 +13,11 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "travelling_salesman.settings")
 
-application = get_asgi_application()
+# Loads the apps, the streaming handler replaces the plain one.
+get_asgi_application()
+
+# Imported once the apps are loaded.
+from traveller.offload import CancelOnDisconnect, StreamingASGIHandler  # noqa: E402
+
+# Solves of requests whose client went away are stopped.
+application = CancelOnDisconnect(StreamingASGIHandler())
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "traveller.middleware.DecompressRequestMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -185,3 +187,103 @@ LOGGING = {
         },
     },
 }
+
+# Default solver search budget per problem size, the first tier whose
+# "max_stops" covers the number of stops is used (None matches any size).
+# Requests may override any field through "search_budget". Raise time_limit
+# or switch to "GUIDED_LOCAL_SEARCH" to trade latency for route quality.
+ROUTE_SEARCH_BUDGETS = [
+    {
+        "max_stops": 100,
+        "time_limit": 2,
+        "first_solution_strategy": "PATH_CHEAPEST_ARC",
+        "local_search_metaheuristic": "GREEDY_DESCENT",
+    },
+    {
+        "max_stops": 1000,
+        "time_limit": 10,
+        "first_solution_strategy": "PATH_CHEAPEST_ARC",
+        "local_search_metaheuristic": "GREEDY_DESCENT",
+    },
+    {
+        "max_stops": None,
+        "time_limit": 30,
+        "first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION",
+        "local_search_metaheuristic": "GREEDY_DESCENT",
+    },
+]
+
+# Worker processes solving background jobs submitted to /api/jobs/, and how
+# many more jobs may wait for a free worker before new ones get a 429.
+ROUTE_JOB_WORKERS = 1
+ROUTE_JOB_QUEUE_SIZE = 16
+
+# Worker processes solving /api/getroute/ requests, and how many more
+# requests may wait for a free worker before new ones get a 429. Together
+# with the job workers they take every core.
+ROUTE_SOLVER_WORKERS = max((os.cpu_count() or 1) - ROUTE_JOB_WORKERS, 1)
+ROUTE_SOLVER_QUEUE_SIZE = 2 * ROUTE_SOLVER_WORKERS
+
+# Seconds an /api/async/getroute/ request may take, waiting for a free solver
+# included, before its solve is stopped and it is answered 504.
+ROUTE_ASYNC_REQUEST_TIMEOUT = 120
+
+# Seconds between the improving solutions sent by /api/stream/getroute/, at
+# most one event per interval however often the search improves.
+ROUTE_STREAM_INTERVAL = 0.5
+
+# Distance matrices kept in memory per process, keyed by the coordinate list,
+# and the directory of the on-disk tier shared by all processes, e.g.
+# os.path.join(BASE_DIR, "cache", "matrices"). None disables the disk tier.
+ROUTE_MATRIX_CACHE_BYTES = 256 * 1024 * 1024
+ROUTE_MATRIX_CACHE_DIR = None
+
+# Memory of the per process store of distances between individual stops,
+# 256 MB holds the pairwise distances of the 8192 most recently used stops.
+ROUTE_EDGE_STORE_BYTES = 256 * 1024 * 1024
+
+# Above this many stops the solver gets a k-nearest-neighbour candidate graph
+# of ROUTE_SPARSE_NEIGHBORS arcs per stop instead of a dense n x n matrix.
+ROUTE_SPARSE_THRESHOLD = 5000
+ROUTE_SPARSE_NEIGHBORS = 16
+
+# Stops per cluster when a vehicle routing request asks for "decompose".
+ROUTE_CLUSTER_STOPS = 200
+
+# Search strategies a request asking for "portfolio": true runs in parallel,
+# keeping the best solution found by the request's time limit.
+ROUTE_PORTFOLIO = [
+    {
+        "first_solution_strategy": "PATH_CHEAPEST_ARC",
+        "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+    },
+    {
+        "first_solution_strategy": "SAVINGS",
+        "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+    },
+    {
+        "first_solution_strategy": "PARALLEL_CHEAPEST_INSERTION",
+        "local_search_metaheuristic": "GUIDED_LOCAL_SEARCH",
+    },
+    {
+        "first_solution_strategy": "CHRISTOFIDES",
+        "local_search_metaheuristic": "SIMULATED_ANNEALING",
+    },
+]
+
+# From this many stops the distance matrix is streamed to an int32 file and
+# memory-mapped by the solver workers instead of being built in memory.
+# None disables it. Files go to ROUTE_MATRIX_DIR, the temp dir when None.
+# Mapped and uploaded matrices are solved with "transit_mode": "callback"
+# unless the request asks for "matrix". A solving worker then holds at most
+# the file, 4 bytes a cell shared by every worker through the page cache
+# (16 MB at 2000 stops). "matrix" adds about 10 times the file per worker,
+# 162 MB measured at 2000 stops, but finds better routes in the same time.
+ROUTE_MMAP_THRESHOLD = 2000
+ROUTE_MATRIX_DIR = None
+
+# Uploaded matrices referenced by route requests as {"matrix_id": ...}.
+ROUTE_MATRIX_UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "traveller-matrices")
+
+# Largest request body accepted after gzip or zstd decompression.
+ROUTE_MAX_REQUEST_BYTES = 512 * 1024 * 1024
@@ -17,5 +17,12 @@ from django.contrib import admin
 from django.urls import path
 from django.conf.urls import include
 
+from traveller.views import Metrics
 
-urlpatterns = [path("admin/", admin.site.urls), path("api/", include("traveller.urls"))]
+
+urlpatterns = [
+    path("admin/", admin.site.urls),
+    path("api/", include("traveller.urls")),
+    # Where Prometheus scrapes by default, same as /api/metrics/.
+    path("metrics", Metrics.as_view()),
+]